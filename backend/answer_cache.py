@@ -0,0 +1,157 @@
+"""AI答案缓存 - 内存LRU + SQLite持久层
+
+缓存键由司法辖区、问题ID、提示词、检索上下文摘要、模型名和采样参数共同决定（内容寻址），
+SQLite 文件由同一台机器上的所有 worker 共享，worker 重启后缓存仍然有效。
+每个条目记录所属司法辖区的知识库版本，知识库文件变化后旧版本的条目会被清理。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def make_cache_key(**parts):
+    """将各组成部分序列化后取SHA-256作为缓存键"""
+    return content_hash(json.dumps(parts, ensure_ascii=False, sort_keys=True))
+
+
+class AnswerCache:
+    """两级答案缓存，线程安全；SQLite 使用 WAL 模式支持多进程并发读写"""
+
+    def __init__(self, path, memory_entries=256, ttl=0):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.ttl = ttl
+        self._memory = OrderedDict()  # key -> (answer, jurisdiction, kb_version, created_at)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+        self._init_db()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = self._connect()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS answers (
+                    key TEXT PRIMARY KEY,
+                    jurisdiction TEXT NOT NULL,
+                    kb_version TEXT NOT NULL,
+                    answer TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_answers_jurisdiction ON answers (jurisdiction, kb_version)')
+
+    def _expired(self, created_at):
+        return self.ttl > 0 and time.time() - created_at > self.ttl
+
+    def get(self, key, kb_version):
+        """查找答案，不存在、已过期或知识库版本不一致时返回None"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[2] == kb_version and not self._expired(entry[3]):
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[0]
+                del self._memory[key]
+
+        try:
+            row = self._connect().execute(
+                'SELECT answer, jurisdiction, kb_version, created_at FROM answers WHERE key = ?', (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"读取答案缓存失败: {e}")
+            self.errors += 1
+            row = None
+
+        with self._lock:
+            if row is None or row[2] != kb_version or self._expired(row[3]):
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, *row)
+        return row[0]
+
+    def put(self, key, answer, jurisdiction, kb_version):
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, answer, jurisdiction, kb_version, created_at)
+            self.writes += 1
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO answers (key, jurisdiction, kb_version, answer, created_at) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (key, jurisdiction, kb_version, answer, created_at)
+                )
+        except sqlite3.Error as e:
+            print(f"写入答案缓存失败: {e}")
+            self.errors += 1
+
+    def invalidate_jurisdiction(self, jurisdiction, current_version):
+        """删除该司法辖区中知识库版本不是 current_version 的所有条目"""
+        with self._lock:
+            stale = [
+                key for key, entry in self._memory.items()
+                if entry[1] == jurisdiction and entry[2] != current_version
+            ]
+            for key in stale:
+                del self._memory[key]
+        try:
+            conn = self._connect()
+            with conn:
+                deleted = conn.execute(
+                    'DELETE FROM answers WHERE jurisdiction = ? AND kb_version != ?',
+                    (jurisdiction, current_version)
+                ).rowcount
+        except sqlite3.Error as e:
+            print(f"清理答案缓存失败: {e}")
+            self.errors += 1
+            return 0
+        if deleted:
+            print(f"{jurisdiction} 知识库已变化，清理 {deleted} 条旧答案缓存")
+        return deleted
+
+    def _remember(self, key, answer, jurisdiction, kb_version, created_at):
+        self._memory[key] = (answer, jurisdiction, kb_version, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'path': self.path,
+                'memory_entries': len(self._memory),
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                'writes': self.writes,
+                'errors': self.errors
+            }
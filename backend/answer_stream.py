@@ -0,0 +1,119 @@
+"""进行中答案的增量文本 - 把上游流式返回的片段转发给等待该问题的流式请求
+
+- AnswerStream：一个问题任务的增量输出，由执行任务的线程写入，可被多个请求订阅（相同问题合并时），
+  并携带取消标志：所有请求都放弃后，正在读取上游响应的线程检查到标志即关闭连接
+- DeltaMailbox：一个流式请求的待发送增量。同一问题尚未发出的片段合并为一段，
+  客户端读得慢时不会堆积事件，占用的内存不超过答案本身
+- StreamingTask：带 AnswerStream 的任务 Future，任务已在执行时 cancel() 改为通知任务中止
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class AnswerStream:
+    """一个问题任务的增量输出"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._parts = []
+        self._subscribers = []  # [(mailbox, key)]
+        self._closed = False
+        self._cancelled = threading.Event()
+
+    def subscribe(self, mailbox, key):
+        """订阅之后的增量；已有输出时先以重置的方式补发全部已有文本"""
+        with self._lock:
+            if self._closed:
+                return
+            if self._parts:
+                mailbox.put(key, ''.join(self._parts), reset=True)
+            self._subscribers.append((mailbox, key))
+
+    def publish(self, text):
+        with self._lock:
+            self._parts.append(text)
+            for mailbox, key in self._subscribers:
+                mailbox.put(key, text)
+
+    def reset(self):
+        """丢弃已输出的文本（重试时上游从头生成）"""
+        with self._lock:
+            if not self._parts:
+                return
+            self._parts = []
+            for mailbox, key in self._subscribers:
+                mailbox.put(key, '', reset=True)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._subscribers = []
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+
+class DeltaMailbox:
+    """一个流式请求待发送的增量，按问题合并"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()  # key -> [文本, 是否重置]
+        self._woken = False
+        self._closed = False
+
+    def put(self, key, text, reset=False):
+        with self._cond:
+            if self._closed:
+                return
+            entry = self._pending.get(key)
+            if entry is None or reset:
+                self._pending[key] = [text, reset]
+            else:
+                entry[0] += text
+            self._cond.notify_all()
+
+    def wake(self):
+        """唤醒 drain()（如有问题完成）"""
+        with self._cond:
+            self._woken = True
+            self._cond.notify_all()
+
+    def drain(self, timeout=None):
+        """等待增量或唤醒，返回 [(key, 文本, 是否重置)]；超时或被唤醒但没有增量时返回空列表"""
+        with self._cond:
+            if not self._pending and not self._woken:
+                self._cond.wait(timeout)
+            self._woken = False
+            items = [(key, text, reset) for key, (text, reset) in self._pending.items()]
+            self._pending.clear()
+            return items
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._pending.clear()
+
+
+class StreamingTask(Future):
+    """带增量输出的任务 Future
+
+    尚未开始时 cancel() 与普通 Future 相同；已在执行时设置 stream 的取消标志并返回 False，
+    由任务自行中止上游请求。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.stream = AnswerStream()
+
+    def cancel(self):
+        if super().cancel():
+            return True
+        if not self.done():
+            self.stream.cancel()
+        return False
@@ -1,49 +1,224 @@
-from flask import Flask, request, jsonify, send_from_directory, send_file
+from flask import Flask, Response, g, request, jsonify, send_from_directory, send_file, stream_with_context
 from flask_cors import CORS
 import os
-import requests
-from dotenv import load_dotenv
 import json
 import sys
-import glob
-import docx
-from docx.shared import Inches
-from docx.enum.text import WD_ALIGN_PARAGRAPH
+import hashlib
+import hmac
+import math
+import time
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+from functools import lru_cache
 from io import BytesIO
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# 加载环境变量
-load_dotenv()
+from backend.kb_cache import DocumentCache, file_signature
+from backend.kb_corpus import DEFAULT_CORPUS_PATH, load_file_content, normalize_text, open_corpus, sha1_of_file
+from backend.kb_articles import ArticleIndex, parse_citation
+from backend.kb_index import BM25Index, KnowledgeText, TextLines, tokenize
+from backend.kb_shards import ShardCache, ShardCatalog, iter_knowledge_files
+from backend.kb_vectors import RETRIEVAL_MODES, RelevanceScorer
+from backend.kb_watcher import KnowledgeWatcher
+from backend.context_packing import PackedContext, estimate_tokens, pack_context, packing_stats, truncate_to_budget
+from backend.answer_cache import AnswerCache, content_hash, make_cache_key
+from backend.answer_stream import DeltaMailbox, StreamingTask
+from backend.jobs import JobStore, JOB_COMPLETED, JOB_FAILED
+from backend.perf import llm_usage, stage, stage_timer, timed
+from backend.single_flight import SingleFlight
+from backend.upstream_guard import (
+    OUTCOME_CLIENT_ERROR, OUTCOME_INVALID, OUTCOME_OK, OUTCOME_RATE_LIMITED, OUTCOME_UNAVAILABLE,
+    UpstreamGuard, UpstreamUnavailable, classify_status, parse_retry_after
+)
+from backend import metrics, profiling
+from backend.word_export import (
+    DOCX_MIMETYPE, GENERATED_AT_FORMAT, RenderCache, package_report, render_report_body, report_cache_key
+)
+from backend.word_export import get_template as get_word_template, template_ready as word_template_ready
+
+# requests（Deepseek客户端）和 python-docx 较重，在首次使用或后台预热时才导入，
+# 导入本模块只需要 Flask，worker 启动后很快就能响应 /health
+
+def find_dotenv_file():
+    """与 dotenv.find_dotenv 相同：从本文件所在目录向上查找 .env 文件"""
+    path = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        candidate = os.path.join(path, '.env')
+        if os.path.isfile(candidate):
+            return candidate
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+# 加载环境变量（没有 .env 文件时不导入 python-dotenv）
+_dotenv_path = find_dotenv_file()
+if _dotenv_path:
+    from dotenv import load_dotenv
+    load_dotenv(_dotenv_path)
 
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
+# 各阶段耗时同时计入 /api/metrics 的直方图
+stage_timer.add_listener(lambda name, seconds: metrics.STAGE_SECONDS.observe(seconds, stage=name))
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+def requested_profile_mode():
+    """请求是否要求剖析：X-Profile 头或 ?profile= 参数，值为 sample / cprofile 时同时写剖析转储
+
+    配置了 PROFILE_TOKEN 时还需要 X-Profile-Token 头与之一致。
+    """
+    value = (request.headers.get('X-Profile') or request.args.get('profile') or '').strip().lower()
+    if not value or value in ('0', 'false', 'off'):
+        return None
+    if PROFILE_TOKEN and not hmac.compare_digest(request.headers.get('X-Profile-Token', ''), PROFILE_TOKEN):
+        return None
+    return value if value in profiling.DUMP_MODES else 'timing'
+
+@app.before_request
+def start_request_profile():
+    if not PROFILE_ENABLED:
+        return
+    mode = requested_profile_mode()
+    if mode is None:
+        return
+    profile = profiling.RequestProfile(
+        request.endpoint or 'request', mode, PROFILE_DIR,
+        max_dumps=PROFILE_MAX_DUMPS, sample_interval=PROFILE_SAMPLE_INTERVAL_MS / 1000
+    )
+    profile.activate()
+    g.profile = profile
+
+@app.after_request
+def attach_request_profile(response):
+    """添加 Server-Timing 头，JSON 响应中附加 profile 字段
+
+    NDJSON 流式响应此时尚未开始处理问题，剖析结果改为在 done 事件中附加。
+    """
+    profile = g.get('profile')
+    if profile is None or response.mimetype == 'application/x-ndjson':
+        return response
+    profile.finish()
+    response.headers['Server-Timing'] = profile.server_timing()
+    if response.is_json:
+        data = response.get_json(silent=True)
+        if isinstance(data, dict):
+            data['profile'] = profile.to_dict()
+            response.set_data(app.json.dumps(data))
+    return response
+
+@app.teardown_request
+def end_request_profile(exc=None):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile.finish()
+        profile.deactivate()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unmatched'
+    metrics.HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    start = g.get('request_start')
+    if start is not None:
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+    return response
+
 # Deepseek API配置
 DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY')
 if not DEEPSEEK_API_KEY:
     print("警告：未设置 DEEPSEEK_API_KEY 环境变量")
     print("请在生产环境中设置此环境变量")
 
-DEEPSEEK_API_URL = 'https://api.deepseek.com/v1/chat/completions'
-
-# 支持的司法辖区
-JURISDICTIONS = [
-    "英国",
-    "加拿大", 
-    "法国",
-    "德国",
-    "西班牙",
-    "爱尔兰",
-    "荷兰",
-    "阿根廷",
-    "阿塞拜疆",
-    "土耳其"
-]
-
-# 欧盟成员国（适用GDPR）
+DEEPSEEK_API_URL = os.getenv('DEEPSEEK_API_URL', 'https://api.deepseek.com/v1/chat/completions')
+
+# Deepseek 连接池配置
+DEEPSEEK_POOL_SIZE = int(os.getenv('DEEPSEEK_POOL_SIZE', '10'))  # 每个进程保持的最大连接数
+DEEPSEEK_POOL_IDLE_TIMEOUT = float(os.getenv('DEEPSEEK_POOL_IDLE_TIMEOUT', '60'))  # 没有进行中的请求、空闲多少秒后丢弃连接
+
+# Deepseek 上游保护：自适应并发上限、熔断器和重试退避
+DEEPSEEK_MAX_IN_FLIGHT = int(os.getenv('DEEPSEEK_MAX_IN_FLIGHT', '8'))  # 每个进程同时进行的AI请求上限（过载时自动降低）
+DEEPSEEK_LIMIT_WAIT = float(os.getenv('DEEPSEEK_LIMIT_WAIT', '30'))  # 等待并发名额的最长秒数
+DEEPSEEK_BREAKER_THRESHOLD = int(os.getenv('DEEPSEEK_BREAKER_THRESHOLD', '5'))  # 连续多少次失败后熔断
+DEEPSEEK_BREAKER_RESET = float(os.getenv('DEEPSEEK_BREAKER_RESET', '30'))  # 熔断多少秒后探测恢复
+DEEPSEEK_BACKOFF_BASE = float(os.getenv('DEEPSEEK_BACKOFF_BASE', '1'))  # 首次重试前的退避秒数（之后逐次翻倍）
+DEEPSEEK_BACKOFF_MAX = float(os.getenv('DEEPSEEK_BACKOFF_MAX', '10'))  # 退避上限；Retry-After 超过此值时不再重试
+
+# 逐题调用时请求流式响应：片段实时转发给流式接口，客户端断开后中止上游生成
+DEEPSEEK_STREAM = os.getenv('DEEPSEEK_STREAM', '1') == '1'
+DEEPSEEK_MAX_RESPONSE_BYTES = 5 * 1024 * 1024  # 响应大小上限
+
+# 批量模式：同一司法辖区的多个问题合并为一次AI调用（请求中可用 batch 参数覆盖）
+DEEPSEEK_BATCH_MODE = os.getenv('DEEPSEEK_BATCH_MODE', '0') == '1'
+DEEPSEEK_BATCH_CONTEXT_TOKENS = int(os.getenv('DEEPSEEK_BATCH_CONTEXT_TOKENS', '2500'))  # 合并后上下文的token预算
+
+# 答案缓存配置
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', '1') == '1'
+ANSWER_CACHE_PATH = os.getenv('ANSWER_CACHE_PATH', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'build', 'answer_cache.sqlite3'))
+ANSWER_CACHE_MEMORY_ENTRIES = int(os.getenv('ANSWER_CACHE_MEMORY_ENTRIES', '256'))
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', str(7 * 24 * 3600)))  # 秒，0表示永不过期
+
+# 问题并发配置：同一进程内同时进行的AI调用上限（所有请求共享），以及单个报告的总等待时间
+RESEARCH_MAX_CONCURRENCY = int(os.getenv('RESEARCH_MAX_CONCURRENCY', '4'))
+RESEARCH_QUESTION_TIMEOUT = float(os.getenv('RESEARCH_QUESTION_TIMEOUT', '180'))
+# 合并相同的并发工作：同一问题和检索上下文的AI调用、同一知识库的加载和索引只执行一次，其余请求等待结果
+RESEARCH_COALESCE = os.getenv('RESEARCH_COALESCE', '1') == '1'
+# 流式接口发送答案片段的最小间隔（秒），间隔内的片段合并为一个事件
+RESEARCH_STREAM_FLUSH_INTERVAL = float(os.getenv('RESEARCH_STREAM_FLUSH_INTERVAL', '0.05'))
+
+# 异步检索任务配置
+RESEARCH_JOB_DB = os.getenv('RESEARCH_JOB_DB', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'build', 'research_jobs.sqlite3'))
+RESEARCH_JOB_WORKERS = int(os.getenv('RESEARCH_JOB_WORKERS', '2'))  # 每个进程同时执行的任务数
+RESEARCH_JOB_RETENTION = float(os.getenv('RESEARCH_JOB_RETENTION', str(24 * 3600)))  # 已结束任务保留时间（秒）
+# 任务租约时长（秒）：执行任务的进程每隔1/3租约续期一次，进程退出后租约过期的任务由其他进程接管
+RESEARCH_JOB_LEASE_SECONDS = float(os.getenv('RESEARCH_JOB_LEASE_SECONDS', '30'))
+
+# 知识库目录
+KNOWLEDGE_DIR = os.getenv('KNOWLEDGE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '../knowledge-base'))
+# 分片清单，默认为知识库目录下的 manifest.json；不存在时按目录布局发现分片（见 kb_shards）
+KB_MANIFEST_PATH = os.getenv('KB_MANIFEST_PATH', '')
+# 已加载分片（拼接后的知识库内容、条文记录和检索索引）的内存上限，超出时淘汰最久未用的分片
+KB_SHARD_MEMORY_MB = float(os.getenv('KB_SHARD_MEMORY_MB', '128'))
+
+# 知识库缓存配置
+KB_CACHE_MAX_BYTES = int(os.getenv('KB_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))  # 解析结果缓存上限，默认64MB
+# Word 导出配置
+WORD_EXPORT_CACHE_BYTES = int(os.getenv('WORD_EXPORT_CACHE_BYTES', str(32 * 1024 * 1024)))  # 渲染结果缓存上限，0表示不缓存
+WORD_EXPORT_PROCESSES = int(os.getenv('WORD_EXPORT_PROCESSES', '0'))  # 渲染进程数，0表示在请求线程中渲染
+WORD_EXPORT_POOL_MIN_CHARS = int(os.getenv('WORD_EXPORT_POOL_MIN_CHARS', '20000'))  # 达到此长度的报告才交给进程池
+
+# 按请求剖析：默认关闭，PROFILE_ENABLED=1 时才处理 X-Profile 头和 profile 参数
+PROFILE_ENABLED = os.getenv('PROFILE_ENABLED', '0') == '1'
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')  # 非空时请求需带相同的 X-Profile-Token 头
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'build', 'profiles'))
+PROFILE_MAX_DUMPS = int(os.getenv('PROFILE_MAX_DUMPS', '20'))  # 转储目录中保留的文件数
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', '5'))  # 采样剖析的间隔
+
+# 知识库目录轮询间隔（秒），0表示不启用监视线程、改为请求时检查文件签名
+KB_WATCH_INTERVAL = float(os.getenv('KB_WATCH_INTERVAL', '2'))
+KB_CACHE_REVALIDATE_SECONDS = float(os.getenv('KB_CACHE_REVALIDATE_SECONDS', '5'))  # 多久检查一次文件是否变化
+# 进程启动后是否在后台预热：加载并索引所有司法辖区、导入AI客户端和Word依赖（0表示按需加载）
+KB_WARMUP = os.getenv('KB_WARMUP', '1') == '1'
+KB_CORPUS_PATH = os.getenv('KB_CORPUS_PATH', DEFAULT_CORPUS_PATH)  # 预编译语料文件（python -m backend.kb_corpus 生成）
+
+# 欧盟成员国（适用GDPR）：没有分片清单时自动附加"欧盟"公共分片的司法辖区
 EU_COUNTRIES = ["法国", "德国", "西班牙", "爱尔兰", "荷兰"]
 
+# 支持的司法辖区：由分片清单给出，没有清单时按知识库目录布局发现
+shard_catalog = ShardCatalog(
+    KNOWLEDGE_DIR, KB_MANIFEST_PATH or None,
+    shared_defaults={'欧盟': EU_COUNTRIES}, revalidate_seconds=KB_CACHE_REVALIDATE_SECONDS
+)
+
 # 问题模板
 QUESTIONS = {
     "1": {
@@ -76,113 +251,443 @@ QUESTIONS = {
     }
 }
 
-def load_file_content(filepath):
-    """加载单个文件内容，支持txt和docx格式"""
-    filename = os.path.basename(filepath)
-    
+# 预编译语料文件（只读mmap，所有worker共享页缓存），不存在时为None
+kb_corpus = open_corpus(KB_CORPUS_PATH, KNOWLEDGE_DIR)
+
+@timed('kb_parse')
+def load_document(filepath, signature=None):
+    """解析源文件（语料中没有或已过期的文件）"""
+    return normalize_text(load_file_content(filepath))
+
+# 已解析文件缓存（进程内共享）；预编译语料中的文件直接引用映射，不进入缓存
+document_cache = DocumentCache(load_document, KB_CACHE_MAX_BYTES)
+
+def document_lines(filepath, signature, header):
+    """文件的按行视图：优先引用预编译语料的映射（各worker共享，只解码用到的行），否则解析源文件；没有内容时返回None"""
+    if kb_corpus is not None:
+        lines = kb_corpus.lines(filepath, signature, header)
+        if lines is not None:
+            # 与解析结果的判断一致：空文件不计入
+            return lines if len(lines) > len(header) + 1 or lines[len(header)] else None
+    content = document_cache.get(filepath, signature)
+    return TextLines(content, header) if content else None
+
+def open_answer_cache():
+    """打开答案缓存，未启用或无法创建时返回None"""
+    if not ANSWER_CACHE_ENABLED:
+        return None
     try:
-        if filename.lower().endswith('.txt'):
-            # 读取txt文件
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    return f.read()
-            except UnicodeDecodeError:
-                with open(filepath, 'r', encoding='gbk') as f:
-                    return f.read()
+        return AnswerCache(ANSWER_CACHE_PATH, ANSWER_CACHE_MEMORY_ENTRIES, ANSWER_CACHE_TTL)
+    except Exception as e:
+        print(f"答案缓存初始化失败，已禁用: {e}")
+        return None
+
+# AI答案缓存（所有worker共享同一个SQLite文件）
+answer_cache = open_answer_cache()
+
+def knowledge_snapshot_bytes(snapshot):
+    """快照占用内存的估算：拼接后的内容和条文记录，加上已构建的检索索引"""
+    scorer = find_relevance_scorer(snapshot['content'])
+    return snapshot['bytes'] + (scorer.memory_bytes() if scorer is not None else 0)
+
+def release_knowledge_shard(jurisdiction, snapshot):
+    """分片被淘汰后释放其检索索引，以及不被其他已加载分片使用的文件的解析结果；之后再次请求时重新加载"""
+    drop_knowledge_index(snapshot['content'])
+    in_use = {path for _, other in loaded_shards.items() for path, _ in other['signatures']}
+    for path, _ in snapshot['signatures']:
+        if path not in in_use:
+            document_cache.invalidate(path)
+    metrics.KB_SHARD_EVICTIONS.inc()
+    print(f"{jurisdiction} 知识库分片已从内存中淘汰")
+
+# 各司法辖区（分片）拼接后的知识库快照: jurisdiction -> {'signatures', 'version', 'content', 'articles', 'bytes', 'checked_at'}
+# 首次请求时加载，按LRU保留在 KB_SHARD_MEMORY_MB 之内
+loaded_shards = ShardCache(int(KB_SHARD_MEMORY_MB * 1024 * 1024), knowledge_snapshot_bytes, release_knowledge_shard)
+# 同一司法辖区、同一组文件签名的快照同时只构建一次
+knowledge_flights = SingleFlight('knowledge', RESEARCH_COALESCE)
+
+def find_knowledge_files(jurisdiction):
+    """查找司法辖区分片的知识库文件（含 include 的公共分片，如欧盟成员国附加的GDPR）"""
+    return shard_catalog.files(jurisdiction)
+
+def record_shard_metrics():
+    metrics.KB_SHARDS_LOADED.set(len(loaded_shards))
+    metrics.KB_SHARD_BYTES.set(loaded_shards.total_bytes())
+
+# 知识库文件内容摘要: 路径 -> (签名, sha1)，签名不变时不重新读取文件
+_file_digests = {}
+
+def file_digest(filepath, signature):
+    """文件内容的SHA-1：优先取预编译语料中记录的摘要，否则读取文件计算；文件不存在时返回None"""
+    cached = _file_digests.get(filepath)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    entry = kb_corpus.entry_for(filepath, signature) if kb_corpus is not None and signature else None
+    try:
+        digest = entry['sha1'] if entry is not None else sha1_of_file(filepath)
+    except OSError:
+        return None
+    _file_digests[filepath] = (signature, digest)
+    return digest
+
+def knowledge_version(signatures):
+    """根据文件路径（相对知识库目录）和内容摘要计算知识库版本号
+
+    只取决于文件内容：重新部署或检出改变了mtime但内容不变时版本不变，答案缓存继续有效。
+    """
+    payload = repr([
+        (os.path.relpath(path, KNOWLEDGE_DIR), file_digest(path, signature)) for path, signature in signatures
+    ])
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+def get_knowledge_version(jurisdiction):
+    """返回司法辖区知识库的版本号；分片未加载或已被淘汰时按磁盘上的文件计算，与分片是否在内存中无关"""
+    snapshot = loaded_shards.peek(jurisdiction)
+    if snapshot is not None:
+        return snapshot['version']
+    return knowledge_version(tuple((path, file_signature(path)) for path in find_knowledge_files(jurisdiction)))
+
+def build_knowledge_snapshot(jurisdiction, signatures):
+    """组装司法辖区的知识库内容（未变化的文件直接命中解析缓存或语料映射），返回快照字典
+
+    内容为 KnowledgeText：每个文件一节，节内先是 '{司法辖区} - {法规名称}' 说明行和空行，之后是文件各行，
+    各行引用解析缓存的文本或语料映射，不拼接为整段字符串。
+    """
+    sections = []
+    for filepath, signature in signatures:
+        filename = os.path.basename(filepath)
+        file_start = time.time()
         
-        elif filename.lower().endswith('.docx'):
-            # 读取docx文件
-            doc = docx.Document(filepath)
-            return '\n'.join([para.text for para in doc.paragraphs])
+        # 从文件名提取法规名称
+        if filename.startswith(f"{jurisdiction}_"):
+            law_name = filename.replace(f"{jurisdiction}_", "").rsplit('.', 1)[0]
+        elif filename.startswith("欧盟_"):
+            law_name = filename.replace("欧盟_", "").rsplit('.', 1)[0]
+        else:
+            law_name = filename.rsplit('.', 1)[0]
         
-    except Exception as e:
-        print(f"读取文件 {filename} 失败: {e}")
-        return ""
+        lines = document_lines(filepath, signature, (f"{jurisdiction} - {law_name}", ''))
+        if lines is not None:
+            sections.append((filename, lines))
+            print(f"  ✓ 加载 {filename} 耗时: {time.time() - file_start:.2f}秒")
     
-    return ""
+    with stage('kb_articles'):
+        articles = ArticleIndex(jurisdiction, sections)
+    knowledge_content = KnowledgeText(sections, articles.spans)
+    return {
+        'signatures': signatures,
+        'version': knowledge_version(signatures),
+        'content': knowledge_content,
+        'articles': articles,
+        'bytes': knowledge_content.memory_bytes() + articles.memory_bytes(),
+        'checked_at': time.time()
+    }
+
+def publish_knowledge_snapshot(jurisdiction, snapshot):
+    """替换司法辖区的知识库快照，并清理基于旧版本知识库的答案缓存
 
+    快照整体替换而不是原地修改，正在处理的请求继续使用替换前取得的内容。
+    加入后已加载分片超出内存上限时淘汰最久未用的分片。
+    """
+    loaded_shards.put(jurisdiction, snapshot)
+    record_shard_metrics()
+    if answer_cache is not None:
+        answer_cache.invalidate_jurisdiction(jurisdiction, snapshot['version'])
+
+@timed('kb_load')
 def load_knowledge_base(jurisdiction=None):
-    """根据司法辖区加载对应的知识库文件"""
-    import time
+    """根据司法辖区加载对应的知识库文件
+
+    结果按司法辖区缓存。知识库监视线程运行时，文件变化由监视线程负责重新加载，请求不做任何文件I/O；
+    否则在 KB_CACHE_REVALIDATE_SECONDS 内重复请求不做I/O，超过间隔后只检查文件签名，
+    文件有变化时才重新解析变化的文件。
+    """
     start_time = time.time()
     
-    knowledge_content = ""
-    knowledge_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../knowledge-base')
-    
-    if not os.path.exists(knowledge_dir):
-        print(f"警告：知识库目录不存在: {knowledge_dir}")
-        return knowledge_content
+    if not os.path.exists(KNOWLEDGE_DIR):
+        print(f"警告：知识库目录不存在: {KNOWLEDGE_DIR}")
+        return ""
     
-    if not jurisdiction or jurisdiction not in JURISDICTIONS:
+    if not jurisdiction or jurisdiction not in shard_catalog:
         print("未指定有效的司法辖区")
-        return knowledge_content
+        return ""
     
-    print(f"开始加载 {jurisdiction} 的知识库文件...")
+    watcher = get_kb_watcher()
+    snapshot = loaded_shards.get(jurisdiction)
+    if snapshot and (watcher is not None or time.time() - snapshot['checked_at'] < KB_CACHE_REVALIDATE_SECONDS):
+        return snapshot['content']
+    
+    matching_files = find_knowledge_files(jurisdiction)
+    signatures = tuple((path, file_signature(path)) for path in matching_files)
     
-    # 1. 加载该司法辖区的所有文件（{国家}_{法规名称}.txt/docx）
-    txt_pattern = os.path.join(knowledge_dir, f"{jurisdiction}_*.txt")
-    docx_pattern = os.path.join(knowledge_dir, f"{jurisdiction}_*.docx")
-    matching_files = glob.glob(txt_pattern) + glob.glob(docx_pattern)
+    if snapshot and snapshot['signatures'] == signatures:
+        snapshot['checked_at'] = time.time()
+        return snapshot['content']
     
-    # 2. 如果是欧盟成员国，自动添加GDPR文件
-    if jurisdiction in EU_COUNTRIES:
-        gdpr_file = os.path.join(knowledge_dir, "欧盟_GDPR.docx")
-        if os.path.exists(gdpr_file) and gdpr_file not in matching_files:
-            matching_files.append(gdpr_file)
-            print(f"  自动添加欧盟GDPR文件")
+    print(f"开始加载 {jurisdiction} 的知识库文件...")
     
     if not matching_files:
         print(f"未找到 {jurisdiction} 的法律法规文件")
-        return knowledge_content
+        return ""
     
     print(f"找到 {len(matching_files)} 个匹配文件")
     
-    # 3. 加载所有匹配的文件
-    for filepath in matching_files:
-        filename = os.path.basename(filepath)
-        file_start = time.time()
-        
-        content = load_file_content(filepath)
-        if content:
-            # 从文件名提取法规名称
-            if filename.startswith(f"{jurisdiction}_"):
-                law_name = filename.replace(f"{jurisdiction}_", "").rsplit('.', 1)[0]
-            elif filename.startswith("欧盟_"):
-                law_name = filename.replace("欧盟_", "").rsplit('.', 1)[0]
-            else:
-                law_name = filename.rsplit('.', 1)[0]
-            
-            knowledge_content += f"""
-
-=== {filename} ===
-{jurisdiction} - {law_name}
-
-{content}
-"""
-            print(f"  ✓ 加载 {filename} 耗时: {time.time() - file_start:.2f}秒")
+    # 加载所有匹配的文件（未变化的文件直接命中解析缓存）；并发请求等待同一次构建
+    def build():
+        snapshot = build_knowledge_snapshot(jurisdiction, signatures)
+        publish_knowledge_snapshot(jurisdiction, snapshot)
+        return snapshot
+    snapshot = knowledge_flights.do((jurisdiction, signatures), build)
+    knowledge_content = snapshot['content']
     
     elapsed_time = time.time() - start_time
     print(f"知识库加载完成，耗时: {elapsed_time:.2f}秒，内容长度: {len(knowledge_content)} 字符")
     return knowledge_content
 
-def extract_relevant_content(knowledge_content, question_prompt, max_chars=8000):
+def scan_loaded_shards():
+    """监视线程的扫描范围：已加载分片的文件签名 {路径: 签名}
+
+    未加载的分片在首次请求时才读取文件，不需要监视；扫描开销只与已加载的文件数有关。
+    分片被淘汰后其文件不再出现在扫描结果中，按删除处理（释放解析缓存）。
     """
-    从知识库中提取与问题相关的内容片段
+    signatures = {}
+    for jurisdiction in loaded_shards.names():
+        for path in find_knowledge_files(jurisdiction):
+            if path not in signatures:
+                signature = file_signature(path)
+                if signature is not None:
+                    signatures[path] = signature
+    return signatures
+
+def reload_knowledge_changes(changes):
+    """监视线程回调：重建受影响的已加载分片（只重新解析变化的文件）后替换快照
+
+    新快照和索引在后台构建完成后才替换，期间请求继续使用旧快照，不会被阻塞。
+    尚未加载或已被淘汰的分片不在这里加载。
+    """
+    for path in changes.removed:
+        document_cache.invalidate(path)
+        _file_digests.pop(path, None)
+    
+    paths = list(changes.added) + list(changes.changed) + list(changes.removed)
+    for jurisdiction in sorted(shard_catalog.affected(paths)):
+        previous = loaded_shards.peek(jurisdiction)
+        if previous is None:
+            continue
+        matching_files = find_knowledge_files(jurisdiction)
+        signatures = tuple((path, file_signature(path)) for path in matching_files)
+        if not matching_files:
+            loaded_shards.pop(jurisdiction)
+            record_shard_metrics()
+            print(f"{jurisdiction} 的知识库文件已全部删除")
+            continue
+        if signatures == previous['signatures']:
+            continue
+        snapshot = build_knowledge_snapshot(jurisdiction, signatures)
+        prime_retrieval(jurisdiction, snapshot['content'])
+        publish_knowledge_snapshot(jurisdiction, snapshot)
+        print(f"{jurisdiction} 知识库已重新加载，版本 {snapshot['version']}")
+
+# 知识库监视线程（按进程懒启动，fork后的子进程各自启动）
+_kb_watcher = None
+_kb_watcher_pid = None
+_kb_watcher_lock = threading.Lock()
+
+def get_kb_watcher():
+    """获取当前进程的知识库监视线程；KB_WATCH_INTERVAL 为0时不启用，返回None"""
+    global _kb_watcher, _kb_watcher_pid
+    if KB_WATCH_INTERVAL <= 0:
+        return None
+    with _kb_watcher_lock:
+        if _kb_watcher is None or _kb_watcher_pid != os.getpid():
+            # 已有快照（fork 前预加载）时以快照的文件签名为基准，预加载之后发生的变化也能被发现
+            baseline = {
+                path: signature
+                for _, snapshot in loaded_shards.items()
+                for path, signature in snapshot['signatures']
+            } or None
+            _kb_watcher = KnowledgeWatcher(
+                KNOWLEDGE_DIR, reload_knowledge_changes, KB_WATCH_INTERVAL, baseline=baseline,
+                scan=scan_loaded_shards
+            ).start()
+            _kb_watcher_pid = os.getpid()
+        return _kb_watcher
+
+def preload_knowledge_base():
+    """解析并索引需要预热的司法辖区（分片清单中标记 preload 的分片）的知识库，同时构建Word报告模板
+
+    用于 PRELOAD_KB 模式：gunicorn master 在 fork worker 之前调用，worker 通过写时复制共享这些内存。
+    这里不启动监视线程和线程池（线程不会被 fork 继承），由各 worker 首次使用时自行启动。
+    返回 {'jurisdictions', 'files', 'chars', 'seconds'}。
     """
-    # 定义关键词映射
-    keyword_mapping = {
-        "准入要求": ["注册", "登记", "备案", "许可", "申请", "授权", "缴费", "费用", "通知"],
-        "适用主体": ["数据控制者", "数据处理者", "控制者", "处理者", "主体", "适用", "范围"],
-        "豁免情形": ["豁免", "例外", "不适用", "免除", "排除"],
-        "注册登记": ["注册", "登记", "备案", "申请", "机构", "平台", "网站", "系统"],
-        "缴费": ["费用", "缴费", "收费", "金额", "年费", "注册费", "许可费"],
-        "有效期": ["有效期", "续展", "更新", "延期", "到期", "证书"],
-        "法律责任": ["责任", "处罚", "罚款", "刑事", "民事", "行政", "违法", "制裁"]
+    start_time = time.time()
+    loaded, files, chars = [], set(), 0
+    for jurisdiction in shard_catalog.preload:
+        matching_files = find_knowledge_files(jurisdiction)
+        if not matching_files:
+            continue
+        signatures = tuple((path, file_signature(path)) for path in matching_files)
+        snapshot = build_knowledge_snapshot(jurisdiction, signatures)
+        prime_retrieval(jurisdiction, snapshot['content'])
+        publish_knowledge_snapshot(jurisdiction, snapshot)
+        loaded.append(jurisdiction)
+        files.update(matching_files)
+        chars += len(snapshot['content'])
+    get_word_template()
+    return {
+        'jurisdictions': loaded,
+        'files': len(files),
+        'chars': chars,
+        'seconds': round(time.time() - start_time, 3)
     }
+
+# 后台预热（每个进程一次）：worker 启动后立即可以响应 /health，预热完成后 /api/ready 才返回200
+_warmup_state = {'status': 'pending'}
+_warmup_pid = None
+_warmup_lock = threading.Lock()
+
+def start_warmup():
+    """在当前进程启动后台预热线程；已启动过或 KB_WARMUP 为0时不重复启动，返回是否新启动"""
+    global _warmup_state, _warmup_pid
+    if not KB_WARMUP or _warmup_pid == os.getpid():
+        return False
+    with _warmup_lock:
+        if _warmup_pid == os.getpid():
+            return False
+        _warmup_pid = os.getpid()
+        _warmup_state = {'status': 'running', 'started_at': time.time()}
+        state = _warmup_state
+    threading.Thread(target=run_warmup, args=(state,), name='warmup', daemon=True).start()
+    return True
+
+def run_warmup(state):
+    """预热：导入并创建Deepseek客户端，加载并索引需要预热的司法辖区，构建Word报告模板
+
+    已预加载（PRELOAD_KB）的司法辖区直接命中快照和索引，不会重复解析；其余分片在首次请求时加载。
+    """
+    start_time = time.time()
+    try:
+        get_deepseek_client()
+        for jurisdiction in shard_catalog.preload:
+            knowledge_content = load_knowledge_base(jurisdiction)
+            prime_retrieval(jurisdiction, knowledge_content)
+        get_word_template()
+        state['status'] = 'done'
+    except Exception as e:
+        print(f"后台预热失败: {e}")
+        state['status'] = 'failed'
+        state['error'] = str(e)
+    state['seconds'] = round(time.time() - start_time, 3)
+    print(f"后台预热{'完成' if state['status'] == 'done' else '结束'}，耗时: {state['seconds']:.2f}秒")
+
+@app.before_request
+def ensure_warmup():
+    # gunicorn 由 post_worker_init 启动预热；直接运行 app.py 等其他方式在首个请求时启动
+    start_warmup()
+
+def knowledge_readiness():
+    """需要预热的和已加载的司法辖区的加载和索引状态；没有知识库文件的司法辖区不影响就绪
+
+    按需加载的分片不列出文件，也不影响就绪。
+    """
+    preload = shard_catalog.preload
+    loaded = set(loaded_shards.names())
+    jurisdictions = {}
+    for jurisdiction in preload + [j for j in shard_catalog.jurisdictions if j in loaded and j not in preload]:
+        snapshot = loaded_shards.peek(jurisdiction)
+        has_files = snapshot is not None or bool(find_knowledge_files(jurisdiction))
+        jurisdictions[jurisdiction] = {
+            'has_files': has_files,
+            'loaded': snapshot is not None,
+            'indexed': snapshot is not None and has_knowledge_index(snapshot['content']),
+            'version': snapshot['version'] if snapshot else None
+        }
+    return jurisdictions
+
+# 问题类别关键词映射，用于扩展检索查询
+KEYWORD_MAPPING = {
+    "准入要求": ["注册", "登记", "备案", "许可", "申请", "授权", "缴费", "费用", "通知"],
+    "适用主体": ["数据控制者", "数据处理者", "控制者", "处理者", "主体", "适用", "范围"],
+    "豁免情形": ["豁免", "例外", "不适用", "免除", "排除"],
+    "注册登记": ["注册", "登记", "备案", "申请", "机构", "平台", "网站", "系统"],
+    "缴费": ["费用", "缴费", "收费", "金额", "年费", "注册费", "许可费"],
+    "有效期": ["有效期", "续展", "更新", "延期", "到期", "证书"],
+    "法律责任": ["责任", "处罚", "罚款", "刑事", "民事", "行政", "违法", "制裁"]
+}
+
+# 检索返回的候选段落数
+KB_RETRIEVAL_TOP_K = int(os.getenv('KB_RETRIEVAL_TOP_K', '20'))
+# 单个问题检索上下文的token预算（按估算token数计，而不是字符数）
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '1000'))
+# 检索打分方式：bm25（关键词加权BM25）/ tfidf（字符n元组TF-IDF）/ hybrid（两者加权），见 kb_vectors
+KB_RETRIEVAL_MODE = os.getenv('KB_RETRIEVAL_MODE', 'bm25')
+if KB_RETRIEVAL_MODE not in RETRIEVAL_MODES:
+    print(f"警告：未知的 KB_RETRIEVAL_MODE={KB_RETRIEVAL_MODE}，使用 bm25")
+    KB_RETRIEVAL_MODE = 'bm25'
+# hybrid 模式中 TF-IDF 得分的权重（其余为BM25）
+KB_HYBRID_WEIGHT = float(os.getenv('KB_HYBRID_WEIGHT', '0.5'))
+
+# 知识库索引缓存: (内容长度, 内容哈希) -> (内容, 索引, 打分器)
+# 已加载分片的索引随分片淘汰一起释放；其余（被替换的旧版本等）最多保留 _KB_INDEX_CACHE_SIZE 个
+_kb_indexes = OrderedDict()
+_kb_indexes_lock = threading.Lock()
+_KB_INDEX_CACHE_SIZE = 32
+index_flights = SingleFlight('index', RESEARCH_COALESCE)
+
+def knowledge_index_key(knowledge_content):
+    # 同一快照返回的是同一个 KnowledgeText 对象（按身份哈希）；字符串的 hash() 结果会被缓存，这里是O(1)
+    return (len(knowledge_content), hash(knowledge_content))
+
+def find_relevance_scorer(knowledge_content):
+    """已构建的打分器，没有时返回None（不触发构建）"""
+    entry = _kb_indexes.get(knowledge_index_key(knowledge_content))
+    return entry[2] if entry is not None and entry[0] == knowledge_content else None
+
+def drop_knowledge_index(knowledge_content):
+    with _kb_indexes_lock:
+        key = knowledge_index_key(knowledge_content)
+        entry = _kb_indexes.get(key)
+        if entry is not None and entry[0] == knowledge_content:
+            del _kb_indexes[key]
+
+def trim_knowledge_indexes():
+    """不属于已加载分片的索引超过 _KB_INDEX_CACHE_SIZE 个时，淘汰其中最久未用的（调用方持有锁）"""
+    owned = {knowledge_index_key(snapshot['content']) for _, snapshot in loaded_shards.items()}
+    orphans = [key for key in _kb_indexes if key not in owned]
+    for key in orphans[:max(0, len(orphans) - _KB_INDEX_CACHE_SIZE)]:
+        del _kb_indexes[key]
+
+def get_relevance_scorer(knowledge_content):
+    """获取知识库内容对应的相关性打分器（scorer.index 为BM25索引），同一内容只构建一次"""
+    key = knowledge_index_key(knowledge_content)
+    with _kb_indexes_lock:
+        entry = _kb_indexes.get(key)
+        if entry is not None and entry[0] == knowledge_content:
+            _kb_indexes.move_to_end(key)
+            return entry[2]
     
-    # 根据问题内容确定相关关键词
+    def build():
+        index = BM25Index(knowledge_content)
+        scorer = RelevanceScorer(index, KB_RETRIEVAL_MODE, KB_HYBRID_WEIGHT)
+        with _kb_indexes_lock:
+            _kb_indexes[key] = (knowledge_content, index, scorer)
+            trim_knowledge_indexes()
+        return scorer
+    # 冷启动时多个请求同时需要同一份索引，只构建一次
+    return index_flights.do(key, build)
+
+def has_knowledge_index(knowledge_content):
+    """知识库内容的索引是否已构建（不触发构建）"""
+    return find_relevance_scorer(knowledge_content) is not None
+
+@lru_cache(maxsize=256)
+def build_query_weights(question_prompt):
+    """根据问题内容构造检索词权重：类别关键词权重1.0，问题原文权重0.3
+
+    问题是固定的，结果按问题原文缓存；返回的字典为共享对象，调用方不要修改。
+    """
     relevant_keywords = []
-    for category, keywords in keyword_mapping.items():
+    for category, keywords in KEYWORD_MAPPING.items():
         if any(keyword in question_prompt for keyword in keywords):
             relevant_keywords.extend(keywords)
     
@@ -190,80 +695,115 @@ def extract_relevant_content(knowledge_content, question_prompt, max_chars=8000)
     if not relevant_keywords:
         relevant_keywords = ["数据", "个人", "保护", "法", "条", "规定"]
     
-    # 按文件分割知识库内容
-    file_sections = knowledge_content.split('\n===')
-    relevant_sections = []
-    
-    for section in file_sections:
-        if not section.strip():
-            continue
-            
-        # 检查是否包含相关关键词
-        section_lower = section.lower()
-        relevance_score = sum(1 for keyword in relevant_keywords if keyword in section_lower)
-        
-        if relevance_score > 0:
-            # 进一步提取相关段落
-            paragraphs = section.split('\n')
-            relevant_paragraphs = []
-            
-            for para in paragraphs:
-                if any(keyword in para for keyword in relevant_keywords):
-                    # 包含前后文上下文
-                    para_index = paragraphs.index(para)
-                    start_idx = max(0, para_index - 1)
-                    end_idx = min(len(paragraphs), para_index + 2)
-                    context = '\n'.join(paragraphs[start_idx:end_idx])
-                    relevant_paragraphs.append(context)
-            
-            if relevant_paragraphs:
-                # 获取文件标题
-                title_line = section.split('\n')[0] if section.split('\n') else "未知文件"
-                section_content = f"{title_line}\n" + '\n---\n'.join(set(relevant_paragraphs))
-                relevant_sections.append(section_content)
-    
-    # 合并相关内容并控制长度
-    filtered_content = '\n\n=== '.join(relevant_sections)
-    
-    # 如果内容仍然过长，进行智能截断
-    if len(filtered_content) > max_chars:
-        # 按重要性排序（包含更多关键词的段落优先）
-        sections_with_score = []
-        for section in relevant_sections:
-            score = sum(1 for keyword in relevant_keywords if keyword in section.lower())
-            sections_with_score.append((score, section))
-        
-        # 按分数排序，优先保留高分内容
-        sections_with_score.sort(key=lambda x: x[0], reverse=True)
-        
-        filtered_content = ""
-        for score, section in sections_with_score:
-            if len(filtered_content) + len(section) <= max_chars:
-                filtered_content += f"\n\n=== {section}"
-            else:
-                break
-    
-    return filtered_content if filtered_content else knowledge_content[:max_chars]
+    weights = {}
+    for token in tokenize(question_prompt):
+        weights[token] = 0.3
+    for keyword in relevant_keywords:
+        for token in tokenize(keyword):
+            weights[token] = 1.0
+    return weights
 
-def call_deepseek_api(prompt, knowledge_content, jurisdiction, max_retries=2):
-    """调用Deepseek API - 优化版本，智能筛选相关内容，带重试机制"""
-    if not DEEPSEEK_API_KEY:
-        return "错误：未配置 DEEPSEEK_API_KEY 环境变量，无法调用AI服务。请联系管理员配置API密钥。"
-    
-    # 提取与问题相关的内容，限制为3000字符以避免请求过大
-    relevant_content = extract_relevant_content(knowledge_content, prompt, max_chars=3000)
-    content_length = len(relevant_content)
+@timed('extract')
+def pack_relevant_content(knowledge_content, question_prompts, token_budget):
+    """
+    从知识库中选取与问题相关的内容片段，总量不超过 token_budget
+
+    对每个问题检索得分最高的段落（打分方式见 KB_RETRIEVAL_MODE），由 context_packing 按"得分/token"
+    在预算内选取，每个问题得分最高的段落总是保留。多个问题（批量模式）时按各自最高分归一化后合并候选。
+    返回 PackedContext(text, chunk_ids, tokens)。
+    """
+    if not knowledge_content:
+        return PackedContext("", [], 0)
     
-    print(f"原始内容长度: {len(knowledge_content)} 字符")
-    print(f"筛选后内容长度: {content_length} 字符")
+    scorer = get_relevance_scorer(knowledge_content)
+    index = scorer.index
+    scores = {}
+    required = []
+    for hits in retrieve(scorer, question_prompts):
+        if not hits:
+            continue
+        top_score = hits[0][0] or 1.0
+        if hits[0][1] not in required:
+            required.append(hits[0][1])
+        for score, chunk_id in hits:
+            scores[chunk_id] = max(scores.get(chunk_id, 0.0), score / top_score)
     
-    headers = {
-        'Authorization': f'Bearer {DEEPSEEK_API_KEY}',
-        'Content-Type': 'application/json',
-        'Connection': 'close'  # 避免连接复用问题
-    }
+    if not scores:
+        text = truncate_to_budget(str(knowledge_content), token_budget)
+        return PackedContext(text, [], estimate_tokens(text))
     
-    system_prompt = f"""你是一个专业的法律法规检索助手。请严格根据以下{jurisdiction}的法律法规知识库内容回答问题，不要添加知识库中没有的信息。
+    hits = [(score, chunk_id) for chunk_id, score in scores.items()]
+    return pack_context(index, hits, token_budget, required=required)
+
+def retrieve(scorer, question_prompts):
+    """返回每个问题的候选段落 [[(得分, chunk_id), ...], ...]；未缓存的问题一次矩阵乘积算出"""
+    return scorer.search(
+        [(prompt, build_query_weights(prompt)) for prompt in question_prompts], top_k=KB_RETRIEVAL_TOP_K
+    )
+
+def build_question_prompt(jurisdiction, question_id):
+    """单题模式发给AI的问题（也是检索使用的问题原文）"""
+    return f"针对{jurisdiction}，{QUESTIONS[question_id]['prompt']}。请仅回答此问题，不要涉及其他任何问题的内容。"
+
+@timed('retrieve')
+def prime_retrieval(jurisdiction, knowledge_content, question_ids=None, batch=False):
+    """一次计算一个司法辖区所选问题（默认全部问题）对全部段落的得分并缓存，之后各问题的检索直接命中缓存"""
+    if not knowledge_content:
+        return
+    question_ids = list(question_ids or QUESTIONS)
+    if batch:
+        prompts = [QUESTIONS[qid]['prompt'] for qid in question_ids]
+    else:
+        prompts = [build_question_prompt(jurisdiction, qid) for qid in question_ids]
+    retrieve(get_relevance_scorer(knowledge_content), prompts)
+    # 索引和矩阵构建后计入分片的内存，超出上限时淘汰其他分片
+    loaded_shards.enforce()
+    record_shard_metrics()
+
+# Deepseek 客户端（进程内共享连接池，首次使用时创建）
+_deepseek_client = None
+_deepseek_client_lock = threading.Lock()
+
+def get_deepseek_client():
+    """获取进程共享的Deepseek客户端"""
+    global _deepseek_client
+    if _deepseek_client is None:
+        with _deepseek_client_lock:
+            if _deepseek_client is None:
+                from backend.deepseek_client import DeepSeekClient
+                _deepseek_client = DeepSeekClient(
+                    DEEPSEEK_API_URL,
+                    DEEPSEEK_API_KEY,
+                    pool_size=DEEPSEEK_POOL_SIZE,
+                    idle_timeout=DEEPSEEK_POOL_IDLE_TIMEOUT,
+                    timeout=(10, 60)  # 连接超时10秒，读取超时60秒
+                )
+    return _deepseek_client
+
+# 上游保护（按进程创建，状态不跨进程共享）
+_upstream_guard = None
+_upstream_guard_pid = None
+_upstream_guard_lock = threading.Lock()
+
+def get_upstream_guard():
+    """获取当前进程的Deepseek上游保护"""
+    global _upstream_guard, _upstream_guard_pid
+    with _upstream_guard_lock:
+        if _upstream_guard is None or _upstream_guard_pid != os.getpid():
+            _upstream_guard = UpstreamGuard(
+                max_in_flight=DEEPSEEK_MAX_IN_FLIGHT,
+                acquire_timeout=DEEPSEEK_LIMIT_WAIT,
+                failure_threshold=DEEPSEEK_BREAKER_THRESHOLD,
+                reset_timeout=DEEPSEEK_BREAKER_RESET,
+                backoff_base=DEEPSEEK_BACKOFF_BASE,
+                backoff_max=DEEPSEEK_BACKOFF_MAX
+            )
+            _upstream_guard_pid = os.getpid()
+        return _upstream_guard
+
+def build_system_prompt(jurisdiction, relevant_content):
+    """构造包含筛选后知识库内容的系统提示词"""
+    return f"""你是一个专业的法律法规检索助手。请严格根据以下{jurisdiction}的法律法规知识库内容回答问题，不要添加知识库中没有的信息。
 
 {jurisdiction}法律法规知识库内容：
 {relevant_content}
@@ -279,43 +819,144 @@ def call_deepseek_api(prompt, knowledge_content, jurisdiction, max_retries=2):
 - 不要使用Markdown语法
 - 不要翻译法条原文
 """
+
+# 客户端全部断开、上游调用被中止时的错误信息
+LLM_CANCELLED = "错误：请求已取消。"
+
+class StreamCancelled(Exception):
+    """读取流式响应时发现任务已被放弃"""
+
+def read_completion_stream(response, request_start, stream=None):
+    """读取 SSE 格式的流式响应，返回 (完整答案, usage)；首个片段的等待时间计入 llm_first_token 阶段
+
+    每个内容片段转发给 stream；stream 被取消时抛出 StreamCancelled（调用方关闭连接，上游随之停止生成）。
+    """
+    parts = []
+    size = 0
+    usage = None
+    # 上游以 chunked 编码逐段发送，iter_lines 收到一段即产出，不会等满缓冲区
+    for line in response.iter_lines():
+        if stream is not None and stream.cancelled:
+            raise StreamCancelled()
+        if not line.startswith(b'data:'):
+            continue
+        payload = line[5:].strip()
+        if payload == b'[DONE]':
+            break
+        size += len(payload)
+        if size > DEEPSEEK_MAX_RESPONSE_BYTES:
+            raise ValueError('流式响应过大')
+        chunk = json.loads(payload)
+        usage = chunk.get('usage') or usage
+        for choice in chunk.get('choices') or ():
+            text = (choice.get('delta') or {}).get('content')
+            if text:
+                if not parts:
+                    stage_timer.record('llm_first_token', time.time() - request_start)
+                parts.append(text)
+                if stream is not None:
+                    stream.publish(text)
+    return ''.join(parts), usage
+
+def request_chat_completion(data, max_retries=2, mode='single', questions=1, stream=None):
+    """发送chat-completions请求（带重试）
+
+    请求经过上游保护：熔断器打开时直接失败，并发名额用完时排队等待；
+    429、5xx、超时和连接错误按退避重试（有 Retry-After 时按其等待），其他4xx不重试。
+    逐题调用且开启 DEEPSEEK_STREAM 时请求流式响应，片段实时写入 stream（AnswerStream），重试时先重置；
+    stream 被取消后关闭连接并返回 LLM_CANCELLED，不再重试。
+    返回 (答案文本, None)；失败时返回 (None, 错误信息)。成功调用的token用量计入 llm_usage。
+    """
+    import requests  # 首次调用时导入（通常已由后台预热导入）
+    guard = get_upstream_guard()
+    streaming = DEEPSEEK_STREAM and mode == 'single'
+    if streaming:
+        data = dict(data, stream=True, stream_options={'include_usage': True})
     
-    data = {
-        'model': 'deepseek-chat',
-        'messages': [
-            {'role': 'system', 'content': system_prompt},
-            {'role': 'user', 'content': prompt}
-        ],
-        'temperature': 0.1,
-        'max_tokens': 600  # 极度减少token数量，避免响应过大
-    }
+    def record_failure(reason, attempt, outcome):
+        metrics.LLM_ATTEMPTS.inc(mode=mode, outcome=outcome)
+        if attempt < max_retries:
+            metrics.LLM_RETRIES.inc(reason=reason)
     
-    # 重试机制
+    error = "错误：多次尝试后仍然失败，请稍后重试。"
+    retry_after = None
     for attempt in range(max_retries + 1):
+        if attempt > 0:
+            delay = guard.backoff_delay(attempt, retry_after)
+            if delay is None:
+                print(f"Retry-After {retry_after:.0f}秒超过退避上限，不再重试")
+                metrics.UPSTREAM_REJECTIONS.inc(reason='retry_after')
+                break
+            print(f"重试第 {attempt} 次（{delay:.2f}秒后）...")
+            with stage('llm_backoff'):
+                time.sleep(delay)
+            if stream is not None:
+                stream.reset()
+        retry_after = None
+        if stream is not None and stream.cancelled:
+            metrics.LLM_ATTEMPTS.inc(mode=mode, outcome='cancelled')
+            return None, LLM_CANCELLED
+        
+        try:
+            with stage('llm_queue'):
+                permit = guard.acquire()
+        except UpstreamUnavailable as e:
+            print(f"未调用Deepseek API: {e}")
+            metrics.LLM_ATTEMPTS.inc(mode=mode, outcome=e.reason)
+            return None, "错误：AI服务暂时不可用，请稍后重试。"
+        
+        outcome = OUTCOME_INVALID
         try:
-            if attempt > 0:
-                print(f"重试第 {attempt} 次...")
-                import time
-                time.sleep(2 * attempt)  # 指数退避
-            
             print(f"正在调用Deepseek API (尝试 {attempt + 1}/{max_retries + 1})...")
             
-            # 使用session来管理连接
-            with requests.Session() as session:
-                response = session.post(
-                    DEEPSEEK_API_URL, 
-                    headers=headers, 
-                    json=data, 
-                    timeout=(10, 60),  # 连接超时10秒，读取超时60秒
-                    stream=False
-                )
-                response.raise_for_status()
+            # 复用进程级连接池（keep-alive），重试也走同一个池
+            request_start = time.time()
+            metrics.LLM_IN_FLIGHT.inc()
+            try:
+                with stage('llm_request'):
+                    response = get_deepseek_client().post(data, stream=streaming)
+                    if streaming and response.status_code < 400:
+                        try:
+                            answer, usage = read_completion_stream(response, request_start, stream)
+                        finally:
+                            # 提前结束（取消或出错）时关闭连接，上游随之停止生成
+                            response.close()
+            finally:
+                metrics.LLM_IN_FLIGHT.dec()
+            
+            if response.status_code >= 400:
+                outcome = classify_status(response.status_code)
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                response.close()
+                print(f"API返回错误状态: {response.status_code}")
+                record_failure(f'HTTP{response.status_code}', attempt, outcome)
+                if outcome == OUTCOME_CLIENT_ERROR:
+                    return None, f"API请求失败: HTTP {response.status_code}"
+                if outcome == OUTCOME_RATE_LIMITED:
+                    error = "错误：AI服务繁忙，请稍后重试。"
+                else:
+                    error = f"API请求失败: HTTP {response.status_code}"
+                continue
+            
+            if streaming:
+                if not answer:
+                    print("API流式响应没有内容")
+                    record_failure('EmptyChoices', attempt, outcome)
+                    error = "错误：AI服务响应格式异常，请稍后重试。"
+                    continue
+                outcome = OUTCOME_OK
+                llm_usage.record(mode, usage, time.time() - request_start, questions)
+                metrics.LLM_ATTEMPTS.inc(mode=mode, outcome=outcome)
+                print(f"API调用成功（流式），答案长度: {len(answer)} 字符")
+                return answer, None
             
             # 检查响应大小
             content_length_header = response.headers.get('content-length')
-            if content_length_header and int(content_length_header) > 5 * 1024 * 1024:  # 5MB限制
+            if content_length_header and int(content_length_header) > DEEPSEEK_MAX_RESPONSE_BYTES:
                 print(f"警告：API响应过大: {content_length_header} bytes")
-                return "错误：AI服务响应数据过大，请简化问题或联系管理员。"
+                metrics.LLM_ATTEMPTS.inc(mode=mode, outcome='too_large')
+                response.close()
+                return None, "错误：AI服务响应数据过大，请简化问题或联系管理员。"
             
             result = response.json()
             print(f"API调用成功")
@@ -323,51 +964,566 @@ def call_deepseek_api(prompt, knowledge_content, jurisdiction, max_retries=2):
             # 验证响应结构
             if 'choices' not in result or not result['choices']:
                 print(f"API响应格式异常: {result}")
-                if attempt < max_retries:
-                    continue  # 重试
-                return "错误：AI服务响应格式异常，请稍后重试。"
+                record_failure('EmptyChoices', attempt, outcome)
+                error = "错误：AI服务响应格式异常，请稍后重试。"
+                continue  # 重试
             
             answer = result['choices'][0]['message']['content']
+            outcome = OUTCOME_OK
+            llm_usage.record(mode, result.get('usage'), time.time() - request_start, questions)
+            metrics.LLM_ATTEMPTS.inc(mode=mode, outcome=outcome)
             print(f"获取到答案，长度: {len(answer)} 字符")
+            return answer, None
             
-            # 清理所有大对象和变量
-            del result
-            del response
-            del data
-            del headers
-            del system_prompt
-            del relevant_content
-            
-            # 强制垃圾回收
-            import gc
-            gc.collect()
-            
-            return answer
-            
+        except StreamCancelled:
+            # 与上游健康状况无关：按 OUTCOME_INVALID 归还名额
+            print("请求已被放弃，中止AI调用")
+            metrics.LLM_ATTEMPTS.inc(mode=mode, outcome='cancelled')
+            return None, LLM_CANCELLED
         except requests.exceptions.Timeout as e:
             print(f"API调用超时: {str(e)}")
-            if attempt < max_retries:
-                continue
-            return "错误：AI服务响应超时，请稍后重试。"
+            outcome = OUTCOME_UNAVAILABLE
+            record_failure(type(e).__name__, attempt, outcome)
+            error = "错误：AI服务响应超时，请稍后重试。"
         except requests.exceptions.RequestException as e:
             print(f"API请求失败: {str(e)}")
-            if attempt < max_retries:
-                continue
-            return f"API请求失败: {str(e)}"
+            outcome = OUTCOME_UNAVAILABLE
+            record_failure(type(e).__name__, attempt, outcome)
+            error = f"API请求失败: {str(e)}"
         except (KeyError, ValueError) as e:
             print(f"API响应解析错误: {str(e)}")
-            if attempt < max_retries:
-                continue
-            return "错误：AI服务响应格式异常，请稍后重试。"
+            record_failure(type(e).__name__, attempt, outcome)
+            error = "错误：AI服务响应格式异常，请稍后重试。"
         except Exception as e:
             print(f"API调用失败: {str(e)}")
+            record_failure(type(e).__name__, attempt, outcome)
             import traceback
             traceback.print_exc()
-            if attempt < max_retries:
+            error = f"API调用失败: {str(e)}"
+        finally:
+            guard.release(permit, outcome)
+    
+    return None, error
+
+# 进行中的AI调用：相同请求（司法辖区、问题、检索上下文摘要、模型参数）并发时只调用一次
+answer_flights = SingleFlight('answer', RESEARCH_COALESCE)
+batch_flights = SingleFlight('batch', RESEARCH_COALESCE)
+
+def call_deepseek_api(prompt, knowledge_content, jurisdiction, max_retries=2, question_id=None, stream=None):
+    """调用Deepseek API - 优化版本，智能筛选相关内容，带重试机制
+
+    stream（AnswerStream）接收流式响应的片段；命中缓存或等待其他请求的相同调用时不产生片段。
+    """
+    if not DEEPSEEK_API_KEY:
+        return "错误：未配置 DEEPSEEK_API_KEY 环境变量，无法调用AI服务。请联系管理员配置API密钥。"
+    
+    # 在token预算内提取与问题相关的内容
+    packed = pack_relevant_content(knowledge_content, [prompt], CONTEXT_TOKEN_BUDGET)
+    relevant_content = packed.text
+    
+    print(f"原始内容长度: {len(knowledge_content)} 字符")
+    print(f"筛选后内容: {len(relevant_content)} 字符，约 {packed.tokens} tokens，段落 {packed.chunk_ids}")
+    
+    data = {
+        'model': 'deepseek-chat',
+        'messages': [
+            {'role': 'system', 'content': build_system_prompt(jurisdiction, relevant_content)},
+            {'role': 'user', 'content': prompt}
+        ],
+        'temperature': 0.1,
+        'max_tokens': 600  # 极度减少token数量，避免响应过大
+    }
+    
+    # 请求键：相同问题、相同检索上下文、相同模型参数。用于查询答案缓存和合并并发的相同调用
+    request_key = make_cache_key(
+        jurisdiction=jurisdiction,
+        question_id=question_id,
+        prompt=prompt,
+        context=content_hash(relevant_content),
+        model=data['model'],
+        temperature=data['temperature'],
+        max_tokens=data['max_tokens']
+    )
+    cache_key = None
+    if answer_cache is not None:
+        cache_key = request_key
+        cached_answer = answer_cache.get(cache_key, get_knowledge_version(jurisdiction))
+        metrics.ANSWER_CACHE_LOOKUPS.inc(jurisdiction=jurisdiction, result='hit' if cached_answer is not None else 'miss')
+        if cached_answer is not None:
+            print(f"命中答案缓存，长度: {len(cached_answer)} 字符")
+            return cached_answer
+    
+    def fetch():
+        answer, error = request_chat_completion(data, max_retries, stream=stream)
+        if not error and cache_key is not None:
+            answer_cache.put(cache_key, answer, jurisdiction, get_knowledge_version(jurisdiction))
+        return answer, error
+    
+    while True:
+        try:
+            answer, error = answer_flights.do(request_key, fetch, timeout=RESEARCH_QUESTION_TIMEOUT)
+        except FutureTimeoutError:
+            print("等待相同的进行中AI调用超时")
+            metrics.ERRORS.inc(jurisdiction=jurisdiction, kind='timeout')
+            return "错误：AI服务响应超时，请稍后重试。"
+        if error != LLM_CANCELLED:
+            break
+        if stream is not None and stream.cancelled:
+            return error
+        # 等待的是其他请求发起、随后被放弃的调用：自己重新调用
+        print("相同的进行中AI调用已被取消，重新调用")
+    if error:
+        metrics.ERRORS.inc(jurisdiction=jurisdiction, kind='llm')
+        return error
+    return answer
+
+def parse_batch_answers(content, question_ids):
+    """解析批量回答的JSON，返回 {question_id: 答案}；缺失、为空或格式错误的问题不包含在结果中"""
+    try:
+        payload = json.loads(content)
+    except (TypeError, ValueError):
+        print("批量回答不是有效的JSON")
+        return {}
+    if not isinstance(payload, dict):
+        return {}
+    
+    answers = {}
+    for question_id in question_ids:
+        value = payload.get(question_id, payload.get(f"Q{question_id}"))
+        if isinstance(value, dict):
+            value = value.get('answer')
+        if isinstance(value, str) and value.strip():
+            answers[question_id] = value.strip()
+    return answers
+
+def call_deepseek_batch(jurisdiction, question_ids, knowledge_content, max_retries=2):
+    """一次调用回答同一司法辖区的多个问题
+
+    发送各问题检索结果的并集作为上下文，要求模型返回以问题编号为键的JSON。
+    返回 {question_id: 答案}，未能得到有效答案的问题不在结果中（由调用方逐题补答）。
+    """
+    if not DEEPSEEK_API_KEY:
+        return {}
+    
+    packed = pack_relevant_content(
+        knowledge_content, [QUESTIONS[qid]['prompt'] for qid in question_ids], DEEPSEEK_BATCH_CONTEXT_TOKENS
+    )
+    relevant_content = packed.text
+    print(f"批量模式: {len(question_ids)} 个问题，合并后内容: {len(relevant_content)} 字符，"
+          f"约 {packed.tokens} tokens，段落 {packed.chunk_ids}")
+    
+    model, temperature = 'deepseek-chat', 0.1
+    kb_version = get_knowledge_version(jurisdiction)
+    answers = {}
+    cache_keys = {}
+    if answer_cache is not None:
+        for qid in question_ids:
+            cache_keys[qid] = make_cache_key(
+                mode='batch',
+                jurisdiction=jurisdiction,
+                question_id=qid,
+                prompt=QUESTIONS[qid]['prompt'],
+                context=content_hash(relevant_content),
+                model=model,
+                temperature=temperature
+            )
+            cached_answer = answer_cache.get(cache_keys[qid], kb_version)
+            metrics.ANSWER_CACHE_LOOKUPS.inc(jurisdiction=jurisdiction, result='hit' if cached_answer is not None else 'miss')
+            if cached_answer is not None:
+                answers[qid] = cached_answer
+    
+    remaining = [qid for qid in question_ids if qid not in answers]
+    if not remaining:
+        return answers
+    
+    system_prompt = build_system_prompt(jurisdiction, relevant_content) + f"""
+本次需要同时回答多个问题。请只输出一个JSON对象，不要输出其他内容：
+- 键为问题编号（{', '.join(f'"{qid}"' for qid in remaining)}）
+- 值为该问题的完整回答文本，回答格式同上
+- 每个回答只针对对应的问题，不要涉及其他问题的内容
+"""
+    user_prompt = f"针对{jurisdiction}，请分别回答以下问题：\n" + '\n'.join(
+        f"问题{qid}：{QUESTIONS[qid]['prompt']}" for qid in remaining
+    )
+    data = {
+        'model': model,
+        'messages': [
+            {'role': 'system', 'content': system_prompt},
+            {'role': 'user', 'content': user_prompt}
+        ],
+        'temperature': temperature,
+        'max_tokens': min(600 * len(remaining), 8000),
+        'response_format': {'type': 'json_object'}
+    }
+    
+    def fetch():
+        """调用一次并解析，有效答案写入缓存；返回 ({问题ID: 答案}, 错误信息)"""
+        content, error = request_chat_completion(data, max_retries, mode='batch', questions=len(remaining))
+        if error:
+            return {}, error
+        parsed = parse_batch_answers(content, remaining)
+        for qid, answer in parsed.items():
+            if qid in cache_keys:
+                answer_cache.put(cache_keys[qid], answer, jurisdiction, kb_version)
+        return parsed, None
+    
+    # 相同问题组合、相同上下文的批量调用并发时只调用一次
+    request_key = make_cache_key(
+        mode='batch',
+        jurisdiction=jurisdiction,
+        question_ids=remaining,
+        context=content_hash(relevant_content),
+        model=model,
+        temperature=temperature
+    )
+    try:
+        parsed, error = batch_flights.do(request_key, fetch, timeout=RESEARCH_QUESTION_TIMEOUT)
+    except FutureTimeoutError:
+        parsed, error = {}, "等待相同的进行中批量调用超时"
+    if error:
+        print(f"批量调用失败，改为逐题回答: {error}")
+        return answers
+    
+    missing = [qid for qid in remaining if qid not in parsed]
+    if missing:
+        print(f"批量回答缺少或无效的问题: {missing}，将逐题补答")
+    answers.update(parsed)
+    return answers
+
+# 问题处理线程池（按进程懒加载，避免fork后继承父进程的线程池）
+_question_executor = None
+_question_executor_pid = None
+_question_executor_lock = threading.Lock()
+
+def get_question_executor():
+    """获取当前进程的问题处理线程池"""
+    global _question_executor, _question_executor_pid
+    with _question_executor_lock:
+        if _question_executor is None or _question_executor_pid != os.getpid():
+            _question_executor = ThreadPoolExecutor(
+                max_workers=max(1, RESEARCH_MAX_CONCURRENCY),
+                thread_name_prefix='research-question'
+            )
+            _question_executor_pid = os.getpid()
+        return _question_executor
+
+def answer_question(jurisdiction, question_id, knowledge_content, stream=None):
+    """回答单个问题，返回结果字典；出错时将错误信息作为答案返回，不影响其他问题
+
+    stream（AnswerStream）接收生成过程中的答案片段，见 submit_research。
+    """
+    question = QUESTIONS[question_id]
+    start_time = time.time()
+    metrics.QUESTIONS_IN_FLIGHT.inc()
+    try:
+        prompt = build_question_prompt(jurisdiction, question_id)
+        with profiling.span('question', jurisdiction=jurisdiction, question_id=question_id):
+            answer = call_deepseek_api(prompt, knowledge_content, jurisdiction, question_id=question_id, stream=stream)
+    except Exception as e:
+        print(f"处理问题 {question_id} 时出错: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        answer = f"处理此问题时出现错误: {str(e)}"
+        metrics.ERRORS.inc(jurisdiction=jurisdiction, kind='exception')
+    finally:
+        metrics.QUESTIONS_IN_FLIGHT.dec()
+    metrics.QUESTIONS.inc(jurisdiction=jurisdiction, mode='single')
+    
+    elapsed = time.time() - start_time
+    print(f"{jurisdiction} 问题 {question_id} 处理完成，耗时: {elapsed:.2f}秒")
+    return {
+        'jurisdiction': jurisdiction,
+        'question_id': question_id,
+        'question_title': question['title'],
+        'answer': answer,
+        'elapsed': round(elapsed, 3)
+    }
+
+def timeout_result(jurisdiction, question_id):
+    """问题超时时返回的结果"""
+    metrics.ERRORS.inc(jurisdiction=jurisdiction, kind='timeout')
+    return {
+        'jurisdiction': jurisdiction,
+        'question_id': question_id,
+        'question_title': QUESTIONS[question_id]['title'],
+        'answer': "错误：处理此问题超时，请稍后重试。",
+        'elapsed': RESEARCH_QUESTION_TIMEOUT
+    }
+
+def research_timeout(task_count):
+    """整份报告的等待上限：按并发上限分批，每批最多 RESEARCH_QUESTION_TIMEOUT 秒"""
+    waves = max(1, math.ceil(task_count / max(1, RESEARCH_MAX_CONCURRENCY)))
+    return RESEARCH_QUESTION_TIMEOUT * waves
+
+# 已提交、尚未完成的问题任务，相同问题的并发请求共享同一个任务
+question_flights = SingleFlight('question', RESEARCH_COALESCE)
+
+def submit_research(context, skip=(), mailbox=None):
+    """将所有 (司法辖区, 问题) 组合提交到共享线程池
+
+    返回 [((jurisdiction, question_id), future), ...]；skip 中的组合不再提交。
+    其他请求已提交、尚未完成的相同问题（同一司法辖区、问题和知识库内容）不再重复提交，直接共享其结果。
+    提供 mailbox（DeltaMailbox）时订阅各问题生成过程中的答案片段。
+    批量模式下每个司法辖区只提交一个批量任务，各问题的 future 在批量任务完成后得到结果（没有片段）。
+    """
+    executor = get_question_executor()
+    tasks = []
+    for section in context['sections']:
+        jurisdiction = section['jurisdiction']
+        question_ids = [qid for qid in context['question_ids'] if (jurisdiction, qid) not in skip]
+        batch = context.get('batch') and len(question_ids) > 1
+        if question_ids:
+            # 所选问题的检索一次算完，各问题任务直接使用缓存的结果
+            prime_retrieval(jurisdiction, section['knowledge_content'], question_ids, batch)
+        if batch:
+            tasks.extend(submit_batch(executor, jurisdiction, question_ids, section['knowledge_content']))
+            continue
+        knowledge_content = section['knowledge_content']
+        for question_id in question_ids:
+            # 检索上下文由知识库内容和问题决定，内容相同即上下文相同（同一快照的 hash() 已缓存）
+            key = (jurisdiction, question_id, len(knowledge_content), hash(knowledge_content))
+            join = None
+            if mailbox is not None:
+                join = lambda task, key=(jurisdiction, question_id): task.stream.subscribe(mailbox, key)
+            future = question_flights.share(
+                key, lambda: submit_question(executor, jurisdiction, question_id, knowledge_content), join
+            )
+            tasks.append(((jurisdiction, question_id), future))
+    return tasks
+
+def submit_question(executor, jurisdiction, question_id, knowledge_content):
+    """提交单个问题，返回 StreamingTask：执行中被取消时中止上游请求"""
+    task = StreamingTask()
+    
+    def run():
+        if not task.set_running_or_notify_cancel():
+            return
+        try:
+            result = answer_question(jurisdiction, question_id, knowledge_content, task.stream)
+        except BaseException as e:
+            task.set_exception(e)
+        else:
+            task.set_result(result)
+        finally:
+            task.stream.close()
+    
+    executor.submit(profiling.bind(run))
+    return task
+
+def _forward_future(source, target):
+    """将补答任务的结果转交给对应问题的 future"""
+    try:
+        target.set_result(source.result())
+    except BaseException as e:
+        target.set_exception(e)
+
+def submit_batch(executor, jurisdiction, question_ids, knowledge_content):
+    """提交一个批量任务；批量结果中缺失的问题在同一线程池中逐题补答"""
+    futures = OrderedDict((qid, Future()) for qid in question_ids)
+    
+    def run_batch():
+        start_time = time.time()
+        metrics.QUESTIONS_IN_FLIGHT.inc(len(question_ids))
+        try:
+            with profiling.span('batch', jurisdiction=jurisdiction, question_ids=question_ids):
+                answers = call_deepseek_batch(jurisdiction, question_ids, knowledge_content)
+        except Exception as e:
+            print(f"{jurisdiction} 批量回答出错，改为逐题回答: {str(e)}")
+            answers = {}
+        finally:
+            metrics.QUESTIONS_IN_FLIGHT.dec(len(question_ids))
+        elapsed = round(time.time() - start_time, 3)
+        
+        for qid, future in futures.items():
+            if not future.set_running_or_notify_cancel():
                 continue
-            return f"API调用失败: {str(e)}"
+            if qid in answers:
+                metrics.QUESTIONS.inc(jurisdiction=jurisdiction, mode='batch')
+                future.set_result({
+                    'jurisdiction': jurisdiction,
+                    'question_id': qid,
+                    'question_title': QUESTIONS[qid]['title'],
+                    'answer': answers[qid],
+                    'elapsed': elapsed
+                })
+            else:
+                fallback = executor.submit(profiling.bind(answer_question), jurisdiction, qid, knowledge_content)
+                fallback.add_done_callback(lambda source, target=future: _forward_future(source, target))
+    
+    executor.submit(profiling.bind(run_batch))
+    return [((jurisdiction, qid), future) for qid, future in futures.items()]
+
+def iter_research_results(tasks):
+    """按完成顺序产出 ((jurisdiction, question_id), 结果)
+
+    单个问题失败或超时只影响该问题的答案；生成器提前关闭时取消尚未开始的问题。
+    """
+    pending = {future: key for key, future in tasks}
+    done = set()
+    try:
+        try:
+            for future in as_completed(list(pending), timeout=research_timeout(len(tasks))):
+                key = pending[future]
+                done.add(key)
+                yield key, future.result()
+        except FutureTimeoutError:
+            for future, key in pending.items():
+                if key not in done:
+                    future.cancel()
+                    print(f"{key[0]} 问题 {key[1]} 处理超时")
+                    done.add(key)
+                    yield key, timeout_result(*key)
+    finally:
+        for future in pending:
+            future.cancel()
+
+def iter_research_stream(tasks, mailbox):
+    """按完成顺序产出 ('answer', key, 结果)，期间产出进行中问题的答案片段 ('delta', key, (文本, 是否重置))
+
+    超时和提前关闭的处理同 iter_research_results；关闭时取消的问题若已在调用AI，会中止上游请求。
+    两次片段事件之间至少间隔 RESEARCH_STREAM_FLUSH_INTERVAL，间隔内同一问题的片段合并；
+    客户端读得慢时 yield 阻塞，新片段在 mailbox 中合并等待，不会堆积。
+    """
+    pending = {future: key for key, future in tasks}
+    for future in pending:
+        future.add_done_callback(lambda done: mailbox.wake())
+    deadline = time.monotonic() + research_timeout(len(tasks))
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            deltas = mailbox.drain(remaining)
+            finished = [future for future in pending if future.done()]
+            answered = {pending[future] for future in finished}
+            for key, text, reset in deltas:
+                if key not in answered:
+                    yield 'delta', key, (text, reset)
+            for future in finished:
+                key = pending.pop(future)
+                yield 'answer', key, future.result()
+            if deltas and pending:
+                time.sleep(RESEARCH_STREAM_FLUSH_INTERVAL)
+        for future, key in list(pending.items()):
+            future.cancel()
+            del pending[future]
+            print(f"{key[0]} 问题 {key[1]} 处理超时")
+            yield 'answer', key, timeout_result(*key)
+    finally:
+        mailbox.close()
+        for future in pending:
+            future.cancel()
+
+def run_research(context):
+    """并发处理所有 (司法辖区, 问题) 组合，返回 {(jurisdiction, question_id): 结果}"""
+    return dict(iter_research_results(submit_research(context)))
+
+def chinese_numeral(number):
+    """将1-99转换为中文数字，用于报告的章节编号"""
+    digits = "零一二三四五六七八九"
+    if number < 10:
+        return digits[number]
+    tens, ones = divmod(number, 10)
+    return (digits[tens] if tens > 1 else "") + "十" + (digits[ones] if ones else "")
+
+def research_introduction(jurisdiction):
+    # 生成引言（简化，不调用API，直接使用固定文本）
+    return f"以下是基于{jurisdiction}相关法律法规的数据隐私准入制度检索结果。"
+
+def parse_research_request(data):
+    """校验检索请求参数
+
+    支持 jurisdiction（单个）或 jurisdictions（列表）。
+    返回 (参数, None)；请求无效时返回 (None, (错误信息, 状态码))。
+    """
+    data = data or {}
+    jurisdictions = data.get('jurisdictions') or data.get('jurisdiction')
+    question_ids = data.get('questions', [])
+    
+    if isinstance(jurisdictions, str):
+        jurisdictions = [jurisdictions]
+    
+    print(f"收到检索请求: 司法辖区={jurisdictions}, 问题={question_ids}")
     
-    return "错误：多次尝试后仍然失败，请稍后重试。"
+    if not jurisdictions:
+        return None, ('请选择司法辖区', 400)
+    
+    # 去重并保持请求中的顺序
+    jurisdictions = list(dict.fromkeys(jurisdictions))
+    for jurisdiction in jurisdictions:
+        if jurisdiction not in shard_catalog:
+            return None, (f'不支持的司法辖区: {jurisdiction}', 400)
+    
+    if not question_ids:
+        return None, ('请选择问题', 400)
+    
+    # 检查API密钥
+    if not DEEPSEEK_API_KEY:
+        print("错误：API密钥未配置")
+        return None, ('服务配置错误：API密钥未设置，请联系管理员', 500)
+    
+    # 按问题ID的数字顺序排序，确保输出顺序正确
+    question_ids = sorted(dict.fromkeys(question_ids), key=lambda x: int(x))
+    print(f"问题处理顺序: {question_ids}")
+    
+    # 是否使用批量模式（同一司法辖区的问题合并为一次AI调用）
+    batch = data.get('batch')
+    if batch is None:
+        batch = DEEPSEEK_BATCH_MODE
+    
+    return {'jurisdictions': jurisdictions, 'question_ids': question_ids, 'batch': bool(batch)}, None
+
+def load_research_context(params):
+    """加载各司法辖区的知识库，返回 (上下文, None) 或 (None, (错误信息, 状态码))
+
+    多个欧盟成员国共用的GDPR等文件由解析缓存保证只解析一次。
+    """
+    question_ids = [qid for qid in params['question_ids'] if qid in QUESTIONS]
+    sections = []
+    for jurisdiction in params['jurisdictions']:
+        # 加载指定司法辖区的知识库
+        print(f"开始处理 {jurisdiction} 的检索请求，问题数量: {len(question_ids)}")
+        knowledge_content = load_knowledge_base(jurisdiction)
+        if not knowledge_content:
+            print(f"错误：未找到{jurisdiction}的知识库内容")
+            return None, (f'未找到{jurisdiction}的法律法规文件，请在知识库目录的"{jurisdiction}/"子目录中添加.txt或.docx文件'
+                          f'（或添加以"{jurisdiction}_"开头的文件）', 404)
+        sections.append({
+            'jurisdiction': jurisdiction,
+            'knowledge_content': knowledge_content,
+            'introduction': research_introduction(jurisdiction)
+        })
+    
+    return {
+        'jurisdictions': params['jurisdictions'],
+        'question_ids': question_ids,
+        'batch': params.get('batch', False),
+        'sections': sections
+    }, None
+
+def prepare_research(data):
+    """校验检索请求并加载知识库，返回 (上下文, None) 或 (None, (错误信息, 状态码))"""
+    params, error = parse_research_request(data)
+    if error:
+        return None, error
+    return load_research_context(params)
+
+@timed('report_build')
+def build_report(jurisdictions, question_ids, results):
+    """按司法辖区分节、按问题顺序拼接报告文本
+
+    results 为 {(jurisdiction, question_id): 结果}，缺少的问题（尚未完成）不输出。
+    """
+    report = "出海目标国数据隐私准入法律检索报告\n\n具体要求请见下文"
+    
+    for index, jurisdiction in enumerate(jurisdictions, 1):
+        report += f"\n\n({chinese_numeral(index)}) {jurisdiction}\n\n{research_introduction(jurisdiction)}"
+        for question_id in question_ids:
+            result = results.get((jurisdiction, question_id))
+            if result is not None:
+                report += f"\n\nQ{result['question_id']}: {result['question_title']}\nA: {result['answer']}"
+    
+    return report
 
 @app.route('/api/questions', methods=['GET'])
 def get_questions():
@@ -379,7 +1535,62 @@ def get_questions():
 def get_jurisdictions():
     """获取所有司法辖区列表"""
     app.logger.info('Received request for jurisdictions list')
-    return jsonify(JURISDICTIONS)
+    return jsonify(shard_catalog.jurisdictions)
+
+def article_to_dict(article):
+    return {
+        'law': article.law,
+        'source': article.source,
+        'number': article.number,
+        'label': article.label,
+        'heading': article.heading,
+        'text': article.text
+    }
+
+def get_article_index(jurisdiction):
+    """返回司法辖区知识库的条文索引（随知识库快照一起构建），未加载到知识库时返回 None"""
+    if not load_knowledge_base(jurisdiction):
+        return None
+    snapshot = loaded_shards.peek(jurisdiction)
+    return snapshot['articles'] if snapshot else None
+
+@app.route('/api/articles', methods=['GET'])
+def get_articles():
+    """按条文编号查询法规原文
+
+    参数：jurisdiction（必填）；article 为条文引用，可用逗号分隔多个（137、Article 3、第十二条、MADDE 16）；
+    law 按法规名称或文件名筛选。不带 article 时返回各法规的条文目录。
+    """
+    jurisdiction = request.args.get('jurisdiction', '')
+    citations = request.args.get('article', '')
+    law = request.args.get('law', '').strip() or None
+
+    if jurisdiction not in shard_catalog:
+        return jsonify({'error': '无效的司法辖区'}), 400
+
+    index = get_article_index(jurisdiction)
+    if index is None:
+        return jsonify({'error': f'未找到 {jurisdiction} 的法律法规文件'}), 404
+
+    if not citations.strip():
+        laws = [
+            {'law': name, 'source': source, 'articles': labels}
+            for name, source, labels in index.laws()
+            if not law or law.lower() in name.lower() or law.lower() in source.lower()
+        ]
+        return jsonify({'jurisdiction': jurisdiction, 'laws': laws})
+
+    articles = []
+    for citation in citations.split(','):
+        if not citation.strip():
+            continue
+        number = parse_citation(citation)
+        if number is None:
+            return jsonify({'error': f'无法识别的条文引用: {citation.strip()}'}), 400
+        articles.extend(article_to_dict(article) for article in index.lookup(number, law))
+    if not articles:
+        return jsonify({'error': '未找到对应条文'}), 404
+    return jsonify({'jurisdiction': jurisdiction, 'articles': articles})
 
 @app.route('/health', methods=['GET'])
 @app.route('/api/health', methods=['GET'])
@@ -391,11 +1602,41 @@ def health_check():
         'api_configured': DEEPSEEK_API_KEY is not None
     })
 
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """就绪检查：所有有知识库文件的司法辖区都已加载并建立索引、且后台预热不在进行中时返回200，否则返回503
+
+    关闭预热（KB_WARMUP=0）时没有后台加载，各司法辖区与按需加载的分片一样在首次请求时加载，不影响就绪。
+    """
+    jurisdictions = knowledge_readiness()
+    if KB_WARMUP:
+        pending = sorted(j for j, status in jurisdictions.items() if status['has_files'] and not status['indexed'])
+    else:
+        pending = []
+    if _warmup_pid == os.getpid():
+        warmup = dict(_warmup_state)
+    else:
+        warmup = {'status': 'pending' if KB_WARMUP else 'disabled'}
+    ready = not pending and warmup['status'] != 'running'
+    return jsonify({
+        'ready': ready,
+        'pid': os.getpid(),
+        'warmup': warmup,
+        'loaded': sorted(j for j, status in jurisdictions.items() if status['loaded']),
+        'indexed': sorted(j for j, status in jurisdictions.items() if status['indexed']),
+        'pending': pending,
+        'jurisdictions': jurisdictions,
+        'components': {
+            'deepseek_client': _deepseek_client is not None,
+            'word_template': word_template_ready(),
+            'knowledge_watcher': _kb_watcher is not None and _kb_watcher_pid == os.getpid()
+        }
+    }), 200 if ready else 503
+
 @app.route('/api/debug', methods=['GET'])
 def debug_info():
     """调试信息端点"""
-    import sys
-    knowledge_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../knowledge-base')
+    knowledge_dir = KNOWLEDGE_DIR
     
     debug_data = {
         'python_version': sys.version,
@@ -403,22 +1644,48 @@ def debug_info():
         'api_key_length': len(DEEPSEEK_API_KEY) if DEEPSEEK_API_KEY else 0,
         'knowledge_dir_exists': os.path.exists(knowledge_dir),
         'knowledge_dir_path': knowledge_dir,
-        'supported_jurisdictions': JURISDICTIONS,
+        'supported_jurisdictions': shard_catalog.jurisdictions,
         'environment': os.environ.get('RENDER', 'local'),
-        'working_directory': os.getcwd()
+        'working_directory': os.getcwd(),
+        'knowledge_cache': document_cache.stats(),
+        'stage_timings': stage_timer.snapshot(),
+        'llm_usage': llm_usage.snapshot(),
+        'context_packing': packing_stats.snapshot(),
+        'retrieval': [entry[2].stats() for entry in list(_kb_indexes.values())],
+        'word_export_cache': word_render_cache.stats(),
+        'answer_cache': answer_cache.stats() if answer_cache is not None else None,
+        'deepseek_pool': _deepseek_client.stats() if _deepseek_client is not None else None,
+        'upstream_guard': _upstream_guard.stats() if _upstream_guard is not None else None,
+        'coalescing': {
+            flights.name: flights.stats()
+            for flights in (question_flights, answer_flights, batch_flights, knowledge_flights, index_flights)
+        },
+        'knowledge_corpus': {
+            'path': kb_corpus.path,
+            'files': len(kb_corpus.toc['files']),
+            'created_at': kb_corpus.toc['created_at']
+        } if kb_corpus is not None else None,
+        'cached_jurisdictions': loaded_shards.names(),
+        'articles': {j: len(snapshot['articles']) for j, snapshot in loaded_shards.items()},
+        'knowledge_shards': {'catalog': shard_catalog.stats(), 'loaded': loaded_shards.stats()},
+        'knowledge_watcher': _kb_watcher.stats() if _kb_watcher is not None else None
     }
     
     # 检查知识库文件
     if os.path.exists(knowledge_dir):
         try:
-            files = os.listdir(knowledge_dir)
-            debug_data['knowledge_files'] = [f for f in files if f.endswith(('.txt', '.docx'))]
+            debug_data['knowledge_files'] = list(iter_knowledge_files(knowledge_dir))
             debug_data['total_files'] = len(debug_data['knowledge_files'])
         except Exception as e:
             debug_data['knowledge_files_error'] = str(e)
     
     return jsonify(debug_data)
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus 文本格式指标"""
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/', methods=['GET'])
 def serve_frontend():
     """提供前端页面访问"""
@@ -431,92 +1698,19 @@ def serve_frontend_assets(path):
 
 @app.route('/api/research', methods=['POST'])
 def research():
-    """执行法律法规检索"""
+    """执行法律法规检索，支持一次检索多个司法辖区"""
     try:
-        data = request.json
-        jurisdiction = data.get('jurisdiction')
-        question_ids = data.get('questions', [])
-        
-        print(f"收到检索请求: 司法辖区={jurisdiction}, 问题={question_ids}")
-        
-        if not jurisdiction:
-            return jsonify({'error': '请选择司法辖区'}), 400
-        
-        if jurisdiction not in JURISDICTIONS:
-            return jsonify({'error': f'不支持的司法辖区: {jurisdiction}'}), 400
-        
-        if not question_ids:
-            return jsonify({'error': '请选择问题'}), 400
-        
-        # 检查API密钥
-        if not DEEPSEEK_API_KEY:
-            print("错误：API密钥未配置")
-            return jsonify({'error': '服务配置错误：API密钥未设置，请联系管理员'}), 500
-        
-        # 按问题ID的数字顺序排序，确保输出顺序正确
-        question_ids = sorted(question_ids, key=lambda x: int(x))
-        print(f"问题处理顺序: {question_ids}")
-        
-        # 加载指定司法辖区的知识库
-        print(f"开始处理 {jurisdiction} 的检索请求，问题数量: {len(question_ids)}")
-        knowledge_content = load_knowledge_base(jurisdiction)
-        if not knowledge_content:
-            print(f"错误：未找到{jurisdiction}的知识库内容")
-            return jsonify({'error': f'未找到{jurisdiction}的法律法规文件，请添加以"{jurisdiction}_"开头的.txt或.docx文件'}), 404
+        context, error = prepare_research(request.json)
+        if error:
+            return jsonify({'error': error[0]}), error[1]
         
-        # 生成引言（简化，不调用API，直接使用固定文本）
-        introduction = f"以下是基于{jurisdiction}相关法律法规的数据隐私准入制度检索结果。"
-        
-        results = []
-        for idx, question_id in enumerate(question_ids, 1):
-            if question_id in QUESTIONS:
-                question = QUESTIONS[question_id]
-                print(f"处理问题 {idx}/{len(question_ids)}: {question['title']}")
-                
-                try:
-                    prompt = f"针对{jurisdiction}，{question['prompt']}。请仅回答此问题，不要涉及其他任何问题的内容。"
-                    
-                    # 调用AI API
-                    answer = call_deepseek_api(prompt, knowledge_content, jurisdiction)
-                    
-                    results.append({
-                        'question_id': question_id,
-                        'question_title': question['title'],
-                        'answer': answer
-                    })
-                    print(f"问题 {idx} 处理完成")
-                    
-                    # 强制垃圾回收，释放内存
-                    import gc
-                    gc.collect()
-                    
-                    # 在问题之间添加延迟，让系统有时间清理
-                    if idx < len(question_ids):
-                        import time
-                        time.sleep(2)  # 增加到2秒，给更多清理时间
-                    
-                except Exception as e:
-                    print(f"处理问题 {idx} 时出错: {str(e)}")
-                    import traceback
-                    traceback.print_exc()
-                    # 即使出错也继续处理，添加错误信息
-                    results.append({
-                        'question_id': question_id,
-                        'question_title': question['title'],
-                        'answer': f"处理此问题时出现错误: {str(e)}"
-                    })
-                    
-                    # 出错后也进行垃圾回收
-                    import gc
-                    gc.collect()
+        # 所有 (司法辖区, 问题) 组合在同一个有界线程池中并发处理
+        results = run_research(context)
         
         print(f"所有问题处理完成，共 {len(results)} 个问题")
         
-        # 构建报告格式
-        report = f"出海目标国数据隐私准入法律检索报告\n\n具体要求请见下文\n\n(一) {jurisdiction}\n\n{introduction}"
-        
-        for result in results:
-            report += f"\n\nQ{result['question_id']}: {result['question_title']}\nA: {result['answer']}"
+        # 构建报告格式：按司法辖区分节，结果仍按问题ID顺序排列
+        report = build_report(context['jurisdictions'], context['question_ids'], results)
         
         print(f"报告生成成功，长度: {len(report)} 字符")
         return jsonify({'report': report})
@@ -527,82 +1721,299 @@ def research():
         traceback.print_exc()
         return jsonify({'error': f'服务器内部错误: {str(e)}'}), 500
 
-def create_word_document(report_data, jurisdiction):
-    """创建Word文档"""
-    # 创建新的Word文档
-    doc = docx.Document()
+@app.route('/api/research/stream', methods=['POST'])
+def research_stream():
+    """流式执行法律法规检索（NDJSON），答案边生成边推送
+
+    事件类型：
+    - start: 各司法辖区的引言和问题列表，请求校验通过后立即发送
+    - delta: 生成中答案的新增片段 jurisdiction、question_id、text；reset 为 true 时先清空已收到的片段（上游重试）
+    - answer: 单个问题的 jurisdiction、question_id、question_title、answer、elapsed（完整答案，替换片段）
+    - done: 按司法辖区和问题顺序拼接的完整报告
+    """
+    try:
+        context, error = prepare_research(request.json)
+        if error:
+            return jsonify({'error': error[0]}), error[1]
+    except Exception as e:
+        print(f"检索请求处理失败: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': f'服务器内部错误: {str(e)}'}), 500
     
-    # 设置文档标题
-    title = doc.add_heading('出海目标国数据隐私准入法律检索报告', 0)
-    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    question_ids = context['question_ids']
     
-    # 添加副标题
-    subtitle = doc.add_paragraph(f'司法辖区：{jurisdiction}')
-    subtitle.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    def event(payload):
+        return json.dumps(payload, ensure_ascii=False) + '\n'
     
-    # 添加生成时间
-    from datetime import datetime
-    time_para = doc.add_paragraph(f'生成时间：{datetime.now().strftime("%Y年%m月%d日 %H:%M:%S")}')
-    time_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    def generate():
+        start_time = time.time()
+        yield event({
+            'type': 'start',
+            'jurisdictions': context['jurisdictions'],
+            'sections': [
+                {
+                    'jurisdiction': section['jurisdiction'],
+                    'introduction': section['introduction'],
+                    'questions': [
+                        {'question_id': qid, 'question_title': QUESTIONS[qid]['title']} for qid in question_ids
+                    ]
+                }
+                for section in context['sections']
+            ]
+        })
+        
+        results = {}
+        mailbox = DeltaMailbox()
+        # 客户端断开时生成器被关闭，iter_research_stream 取消尚未完成的问题，正在进行的AI调用随之中止
+        for kind, key, payload in iter_research_stream(submit_research(context, mailbox=mailbox), mailbox):
+            if kind == 'delta':
+                text, reset = payload
+                delta = {'type': 'delta', 'jurisdiction': key[0], 'question_id': key[1], 'text': text}
+                if reset:
+                    delta['reset'] = True
+                yield event(delta)
+                continue
+            results[key] = payload
+            yield event(dict(payload, type='answer'))
+        
+        report = build_report(context['jurisdictions'], question_ids, results)
+        print(f"流式报告生成成功，长度: {len(report)} 字符")
+        done = {'type': 'done', 'report': report, 'elapsed': round(time.time() - start_time, 3)}
+        profile = profiling.current_profile()
+        if profile is not None:
+            profile.finish()
+            done['profile'] = profile.to_dict()
+        yield event(done)
     
-    # 添加分隔线
-    doc.add_paragraph('=' * 50).alignment = WD_ALIGN_PARAGRAPH.CENTER
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# 异步任务存储与执行线程池
+def open_job_store():
+    """打开任务存储，无法创建时返回None（异步任务接口不可用）"""
+    try:
+        return JobStore(RESEARCH_JOB_DB, RESEARCH_JOB_LEASE_SECONDS)
+    except Exception as e:
+        print(f"任务存储初始化失败，异步任务不可用: {e}")
+        return None
+
+job_store = open_job_store()
+_job_executor = None
+_job_executor_pid = None
+_job_executor_lock = threading.Lock()
+# 本进程持有租约的任务（排队或执行中），由租约线程续期
+_held_jobs = set()
+
+def get_job_executor():
+    """获取当前进程的任务执行线程池；每个进程首次创建时启动租约线程，并接管租约已过期的任务"""
+    global _job_executor, _job_executor_pid, _held_jobs
+    with _job_executor_lock:
+        if _job_executor is not None and _job_executor_pid == os.getpid():
+            return _job_executor
+        _job_executor = ThreadPoolExecutor(
+            max_workers=max(1, RESEARCH_JOB_WORKERS),
+            thread_name_prefix='research-job'
+        )
+        _job_executor_pid = os.getpid()
+        # fork 继承的集合属于父进程的任务，子进程不续期
+        _held_jobs = set()
+        executor = _job_executor
+        threading.Thread(target=maintain_job_leases, name='research-job-lease', daemon=True).start()
     
-    # 解析报告内容
-    report_lines = report_data.split('\n')
-    current_section = None
+    try:
+        job_store.purge(RESEARCH_JOB_RETENTION)
+        reclaim_research_jobs(executor)
+    except Exception as e:
+        print(f"恢复检索任务失败: {e}")
+    return executor
+
+def submit_research_job(job_id, executor=None):
+    """在本进程执行已持有租约的任务"""
+    executor = executor or get_job_executor()
+    with _job_executor_lock:
+        _held_jobs.add(job_id)
+    executor.submit(run_research_job, job_id)
+
+def reclaim_research_jobs(executor=None):
+    """接管租约已过期的未完成任务（持有进程已退出），返回接管的任务数"""
+    claimed = job_store.claim_expired()
+    for job_id in claimed:
+        print(f"恢复未完成的检索任务: {job_id}")
+        submit_research_job(job_id, executor)
+    return len(claimed)
+
+def maintain_job_leases():
+    """租约线程：每隔1/3租约为本进程持有的任务续期，并接管其他进程遗留的过期任务"""
+    while True:
+        time.sleep(RESEARCH_JOB_LEASE_SECONDS / 3)
+        try:
+            with _job_executor_lock:
+                held = list(_held_jobs)
+            job_store.renew(held)
+            reclaim_research_jobs()
+        except Exception as e:
+            print(f"检索任务续期失败: {e}")
+
+def job_result_key(jurisdiction, question_id):
+    """任务结果在存储中的键"""
+    return f"{jurisdiction}:{question_id}"
+
+def run_research_job(job_id):
+    """在后台执行检索任务，每完成一个问题就持久化一次结果；租约被其他进程接管后停止"""
+    try:
+        job = job_store.get(job_id)
+        if job is None or job['status'] in (JOB_COMPLETED, JOB_FAILED):
+            return
+        
+        context, error = load_research_context(job['request'])
+        if error:
+            job_store.fail(job_id, error[0])
+            return
+        
+        if not job_store.mark_running(job_id):
+            print(f"检索任务 {job_id} 已由其他进程接管")
+            return
+        results = {}
+        for section in context['sections']:
+            for question_id in context['question_ids']:
+                key = (section['jurisdiction'], question_id)
+                stored = job['results'].get(job_result_key(*key))
+                if stored is not None:
+                    results[key] = stored
+        
+        # 只处理尚未完成的问题（任务被其他worker恢复时跳过已有结果）
+        for key, result in iter_research_results(submit_research(context, skip=results)):
+            results[key] = result
+            if not job_store.save_result(job_id, job_result_key(*key), result):
+                print(f"检索任务 {job_id} 已由其他进程接管")
+                return
+        
+        report = build_report(context['jurisdictions'], context['question_ids'], results)
+        if job_store.complete(job_id, report):
+            print(f"检索任务 {job_id} 完成，报告长度: {len(report)} 字符")
+    except Exception as e:
+        print(f"检索任务 {job_id} 执行失败: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        try:
+            job_store.fail(job_id, f'服务器内部错误: {str(e)}')
+        except Exception:
+            pass
+    finally:
+        with _job_executor_lock:
+            _held_jobs.discard(job_id)
+
+@app.route('/api/research/jobs', methods=['POST'])
+def create_research_job():
+    """创建异步检索任务，立即返回任务ID"""
+    if job_store is None:
+        return jsonify({'error': '异步任务不可用，请使用 /api/research'}), 503
+    try:
+        params, error = parse_research_request(request.json)
+        if error:
+            return jsonify({'error': error[0]}), error[1]
+        
+        job_id = job_store.create(params)
+        submit_research_job(job_id)
+        print(f"已创建检索任务 {job_id}")
+        return jsonify({
+            'job_id': job_id,
+            'status': job_store.get(job_id)['status'],
+            'status_url': f'/api/research/jobs/{job_id}'
+        }), 202
+    except Exception as e:
+        print(f"创建检索任务失败: {str(e)}")
+        return jsonify({'error': f'服务器内部错误: {str(e)}'}), 500
+
+@app.route('/api/research/jobs/<job_id>', methods=['GET'])
+def get_research_job(job_id):
+    """查询检索任务进度，返回各问题状态以及部分或最终报告"""
+    if job_store is None:
+        return jsonify({'error': '异步任务不可用'}), 503
     
-    for line in report_lines:
-        line = line.strip()
-        if not line:
-            continue
-            
-        if line.startswith('(一)'):
-            # 主标题
-            heading = doc.add_heading(line, level=1)
-        elif line.startswith('Q') and ':' in line:
-            # 问题标题
-            question_heading = doc.add_heading(line, level=2)
-        elif line.startswith('A:'):
-            # 答案内容
-            answer_text = line[2:].strip()  # 移除 "A:" 前缀
-            
-            # 分析答案结构
-            if '法律依据：' in answer_text:
-                # 分离主要内容和法律依据
-                parts = answer_text.split('法律依据：')
-                main_content = parts[0].strip()
-                legal_basis = '法律依据：' + parts[1].strip() if len(parts) > 1 else ''
-                
-                # 添加主要内容
-                if main_content:
-                    content_para = doc.add_paragraph(main_content)
-                    content_para.style = 'Normal'
-                
-                # 添加法律依据（使用不同样式）
-                if legal_basis:
-                    doc.add_paragraph()  # 空行
-                    legal_para = doc.add_paragraph(legal_basis)
-                    legal_para.style = 'Intense Quote'
+    # 确保本进程已启动任务线程池和租约线程；查询的任务租约已过期（持有进程已退出）时立即接管
+    get_job_executor()
+    job = job_store.get(job_id)
+    if job is not None and job_store.expired(job):
+        reclaim_research_jobs()
+        job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    
+    jurisdictions = job['request']['jurisdictions']
+    question_ids = [qid for qid in job['request']['question_ids'] if qid in QUESTIONS]
+    results = {}
+    questions = []
+    for jurisdiction in jurisdictions:
+        for qid in question_ids:
+            stored = job['results'].get(job_result_key(jurisdiction, qid))
+            if stored is not None:
+                results[(jurisdiction, qid)] = stored
+                questions.append(dict(stored, status='completed'))
             else:
-                # 没有法律依据分离的情况
-                content_para = doc.add_paragraph(answer_text)
-                content_para.style = 'Normal'
-        elif line.startswith('以下是基于'):
-            # 引言
-            intro_para = doc.add_paragraph(line)
-            intro_para.style = 'Normal'
-        elif not line.startswith('出海目标国') and not line.startswith('具体要求'):
-            # 其他内容
-            if line:
-                doc.add_paragraph(line)
-    
-    # 添加页脚
-    doc.add_page_break()
-    footer_para = doc.add_paragraph('本报告由法律法规检索应用自动生成')
-    footer_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    
-    return doc
+                questions.append({
+                    'jurisdiction': jurisdiction,
+                    'question_id': qid,
+                    'question_title': QUESTIONS[qid]['title'],
+                    'status': 'pending'
+                })
+    
+    report = job['report']
+    if report is None and results:
+        # 部分报告：只包含已完成的问题
+        report = build_report(jurisdictions, question_ids, results)
+    
+    return jsonify({
+        'job_id': job['id'],
+        'status': job['status'],
+        'jurisdictions': jurisdictions,
+        'questions': questions,
+        'completed': len(results),
+        'total': len(questions),
+        'report': report,
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at']
+    })
+
+# Word 导出：渲染结果按报告内容缓存，较大的报告可交给进程池渲染
+word_render_cache = RenderCache(WORD_EXPORT_CACHE_BYTES)
+_word_export_pool = None
+_word_export_pool_pid = None
+_word_export_pool_lock = threading.Lock()
+
+def get_word_export_pool():
+    """获取当前进程的Word渲染进程池；WORD_EXPORT_PROCESSES 为0时返回None（在请求线程中渲染）"""
+    global _word_export_pool, _word_export_pool_pid
+    if WORD_EXPORT_PROCESSES <= 0:
+        return None
+    with _word_export_pool_lock:
+        if _word_export_pool is None or _word_export_pool_pid != os.getpid():
+            # spawn：gunicorn worker 是多线程进程，fork 后子进程可能继承被占用的锁
+            _word_export_pool = ProcessPoolExecutor(
+                max_workers=WORD_EXPORT_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _word_export_pool_pid = os.getpid()
+        return _word_export_pool
+
+def render_word_report(report_content, jurisdiction, generated_at=None):
+    """返回报告的 .docx 字节：相同报告的正文直接命中缓存，只填入生成时间并打包；
+    超过 WORD_EXPORT_POOL_MIN_CHARS 的报告在进程池中渲染"""
+    key = report_cache_key(report_content, jurisdiction)
+    body = word_render_cache.get(key)
+    if body is None:
+        pool = get_word_export_pool() if len(report_content) >= WORD_EXPORT_POOL_MIN_CHARS else None
+        if pool is not None:
+            with stage('docx_render_pool'):
+                body = pool.submit(render_report_body, report_content, jurisdiction).result()
+        else:
+            body = render_report_body(report_content, jurisdiction)
+        word_render_cache.put(key, body)
+    return package_report(body, generated_at)
 
 @app.route('/api/export-word', methods=['POST'])
 def export_word():
@@ -615,23 +2026,21 @@ def export_word():
         if not report_content:
             return jsonify({'error': '报告内容不能为空'}), 400
         
-        # 创建Word文档
-        doc = create_word_document(report_content, jurisdiction)
+        # 文档中的生成时间与文件名使用同一时刻
+        from datetime import datetime
+        now = datetime.now()
         
-        # 保存到内存
-        doc_io = BytesIO()
-        doc.save(doc_io)
-        doc_io.seek(0)
+        # 渲染Word文档（重复下载同一份报告直接使用缓存的正文）
+        doc_io = BytesIO(render_word_report(report_content, jurisdiction, now.strftime(GENERATED_AT_FORMAT)))
         
         # 生成文件名
-        from datetime import datetime
-        filename = f"法律检索报告_{jurisdiction}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.docx"
+        filename = f"法律检索报告_{jurisdiction}_{now.strftime('%Y%m%d_%H%M%S')}.docx"
         
         return send_file(
             doc_io,
             as_attachment=True,
             download_name=filename,
-            mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+            mimetype=DOCX_MIMETYPE
         )
         
     except Exception as e:
@@ -641,4 +2050,5 @@ def export_word():
 if __name__ == '__main__':
     import os
     port = int(os.environ.get('PORT', 5001))
+    start_warmup()
     app.run(debug=False, host='0.0.0.0', port=port)
\ No newline at end of file
@@ -0,0 +1,159 @@
+"""检索上下文打包 - 按token预算选取知识库片段
+
+每个检索命中的段落连同前后各一行上下文（不跨出所在条文）构成一个候选窗口，按"得分 / 新增token数"
+从高到低贪心选取，直到达到token预算。得分最高的命中总是保留；与已选窗口重叠的行不重复计入，相邻窗口合并输出。
+不含条文标记行的片段前标注所在条文（如 [MADDE 16]），便于模型引用准确的法条。
+"""
+import math
+import threading
+from collections import namedtuple
+
+# 按 Deepseek 官方换算：1个中文字符约0.6个token，1个英文字符约0.3个token
+CJK_TOKENS_PER_CHAR = 0.6
+OTHER_TOKENS_PER_CHAR = 0.3
+
+# 打包结果：上下文文本、入选的段落块ID（按入选顺序）、估算token数
+PackedContext = namedtuple('PackedContext', ['text', 'chunk_ids', 'tokens'])
+
+
+class PackingStats:
+    """累计打包次数、平均入选片段数和平均token数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.packs = 0
+        self.chunks = 0
+        self.tokens = 0
+
+    def record(self, chunks, tokens):
+        with self._lock:
+            self.packs += 1
+            self.chunks += chunks
+            self.tokens += tokens
+
+    def snapshot(self):
+        with self._lock:
+            packs = self.packs or 1
+            return {
+                'packs': self.packs,
+                'avg_chunks': round(self.chunks / packs, 2),
+                'avg_tokens': round(self.tokens / packs, 1)
+            }
+
+
+packing_stats = PackingStats()
+
+
+def _is_cjk(char):
+    return '一' <= char <= '鿿' or '　' <= char <= '〿' or '＀' <= char <= '￯'
+
+
+def estimate_tokens(text):
+    """估算文本的token数（不依赖分词器）"""
+    if not text:
+        return 0
+    cjk = sum(1 for char in text if _is_cjk(char))
+    return int(math.ceil(cjk * CJK_TOKENS_PER_CHAR + (len(text) - cjk) * OTHER_TOKENS_PER_CHAR))
+
+
+def truncate_to_budget(text, budget):
+    """截取文本开头不超过 budget 个token的部分"""
+    used = 0.0
+    for position, char in enumerate(text):
+        used += CJK_TOKENS_PER_CHAR if _is_cjk(char) else OTHER_TOKENS_PER_CHAR
+        if used > budget:
+            return text[:position]
+    return text
+
+
+def _section_header(title):
+    return f"=== {title} ===\n"
+
+
+def _article_prefix(index, section_id, line_no):
+    """片段从条文中间开始时，在前面标注所在条文"""
+    span = index.articles.find(section_id, line_no)
+    if span is None or line_no <= span.line:
+        return ''
+    return f"[{span.label}]\n"
+
+
+def pack_context(index, hits, budget, required=()):
+    """在 budget 个token内从检索结果中选取上下文
+
+    index: BM25Index
+    hits: [(得分, chunk_id), ...]
+    required: 无论性价比如何都优先选入的段落块（通常是得分最高的命中）
+    返回 PackedContext；输出格式与知识库一致：'=== 文件名 ===' 后接片段，片段之间用 '---' 分隔。
+    """
+    line_tokens = {}
+
+    def cost(section_id, line_no):
+        key = (section_id, line_no)
+        if key not in line_tokens:
+            # +1 计入换行符
+            line_tokens[key] = estimate_tokens(index.sections[section_id][1][line_no]) + 1
+        return line_tokens[key]
+
+    scores = dict((chunk_id, score) for score, chunk_id in hits)
+    candidates = []
+    for chunk_id in scores:
+        section_id, start, end = index.window(chunk_id)
+        size = sum(cost(section_id, i) for i in range(start, end)) or 1
+        candidates.append((chunk_id, section_id, start, end, size))
+
+    required = [chunk_id for chunk_id in required if chunk_id in scores]
+    order = {chunk_id: position for position, chunk_id in enumerate(required)}
+    # 必选项在前，其余按 得分/token 降序，相同时按文档位置保证结果稳定
+    candidates.sort(key=lambda c: (order.get(c[0], len(order)), -scores[c[0]] / c[4], c[0]))
+
+    covered = {}  # section_id -> set(行号)
+    section_order = []
+    chunk_ids = []
+    used = 0
+    for chunk_id, section_id, start, end, _ in candidates:
+        lines = covered.get(section_id, set())
+        new_lines = [i for i in range(start, end) if i not in lines]
+        if not new_lines:
+            # 窗口已被其他片段完整覆盖，直接记为入选
+            chunk_ids.append(chunk_id)
+            continue
+        header = 0 if section_id in covered else estimate_tokens(_section_header(index.sections[section_id][0]))
+        size = sum(cost(section_id, i) for i in new_lines) + header
+        if used + size > budget:
+            line_no = index.chunks[chunk_id].line
+            if chunk_id not in order or line_no in lines:
+                continue
+            # 必选项放不下完整窗口时只保留命中行本身；第一个必选项即使超出预算也保留（输出时截断）
+            new_lines = [line_no]
+            size = cost(section_id, line_no) + header
+            if used + size > budget and chunk_ids:
+                continue
+        if section_id not in covered:
+            covered[section_id] = set()
+            section_order.append(section_id)
+        covered[section_id].update(new_lines)
+        chunk_ids.append(chunk_id)
+        used += size
+
+    blocks = []
+    for section_id in section_order:
+        title, lines = index.sections[section_id]
+        snippets, current = [], []
+        for line_no in sorted(covered[section_id]):
+            # 连续的行合并为一个片段，避免相邻窗口重复输出分隔符
+            if current and line_no != current[-1] + 1:
+                snippets.append(current)
+                current = []
+            current.append(line_no)
+        if current:
+            snippets.append(current)
+        blocks.append(_section_header(title) + '\n---\n'.join(
+            _article_prefix(index, section_id, snippet[0]) + '\n'.join(lines[i] for i in snippet)
+            for snippet in snippets
+        ))
+
+    text = truncate_to_budget('\n\n'.join(blocks), budget)
+    tokens = estimate_tokens(text)
+    packing_stats.record(len(chunk_ids), tokens)
+    return PackedContext(text, chunk_ids, tokens)
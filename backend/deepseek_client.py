@@ -0,0 +1,151 @@
+"""Deepseek API HTTP客户端 - 每个进程一个长连接池"""
+import os
+import threading
+import time
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class DeepSeekClient:
+    """线程安全的连接池客户端
+
+    - 同一进程内所有请求复用一个 requests.Session，连接保持 keep-alive
+    - 连接池大小可配置；没有进行中的请求、且距最后一个请求结束超过 idle_timeout 秒时关闭连接池，
+      下次请求重新建立（流式响应读完或关闭才算结束，读取中的连接不会被关闭）
+    - fork 之后自动在子进程内重建连接池，不与父进程共享socket
+    """
+
+    def __init__(self, url, api_key, pool_size=10, idle_timeout=60, timeout=(10, 60)):
+        self.url = url
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._session = None
+        self._session_pid = None
+        self._last_used = 0.0
+        self._in_flight = 0
+        self._requests = 0
+        self._retired_connections = 0
+        self._retired_requests = 0
+        self._idle_evictions = 0
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json'
+        })
+        return session
+
+    def _acquire(self):
+        """取得连接池并记为进行中的请求，请求结束后必须调用 _release()"""
+        with self._lock:
+            now = time.time()
+            if self._session is not None and self._session_pid == os.getpid():
+                if self._in_flight == 0 and now - self._last_used > self.idle_timeout:
+                    # 空闲过久，服务端大概率已关闭连接，主动丢弃
+                    self._retire_session()
+                    self._idle_evictions += 1
+            elif self._session is not None:
+                # fork后的子进程：不关闭父进程的socket，直接丢弃引用，也不继承父进程的计数
+                self._session = None
+                self._in_flight = 0
+            if self._session is None:
+                self._session = self._new_session()
+                self._session_pid = os.getpid()
+            self._last_used = now
+            self._in_flight += 1
+            self._requests += 1
+            return self._session
+
+    def _release(self):
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+            self._last_used = time.time()
+
+    def _retire_session(self):
+        pool_stats = self._pool_stats(self._session)
+        self._retired_connections += pool_stats[0]
+        self._retired_requests += pool_stats[1]
+        self._session.close()
+        self._session = None
+
+    @staticmethod
+    def _pool_stats(session):
+        """返回 (已建立连接数, 已发送请求数)"""
+        connections = 0
+        sent = 0
+        if session is None:
+            return connections, sent
+        # http/https 挂载的是同一个适配器，去重后再统计
+        adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+        for adapter in adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    connections += pool.num_connections
+                    sent += pool.num_requests
+        return connections, sent
+
+    def post(self, payload, timeout=None, stream=False):
+        """发送JSON请求，返回 requests.Response（调用方负责检查状态码）
+
+        stream=True 时请求在 response.close() 时结束（响应对象被回收时兜底结束）。
+        """
+        session = self._acquire()
+        try:
+            response = session.post(self.url, json=payload, timeout=timeout or self.timeout, stream=stream)
+        except BaseException:
+            self._release()
+            raise
+        if not stream:
+            self._release()
+            return response
+
+        pid = os.getpid()
+        released = threading.Lock()
+
+        def release():
+            # 只结束一次；fork 后的子进程不结束父进程的请求
+            if released.acquire(blocking=False) and os.getpid() == pid:
+                self._release()
+
+        close = response.close
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                release()
+        response.close = close_and_release
+        weakref.finalize(response, release)
+        return response
+
+    def close(self):
+        with self._lock:
+            if self._session is not None and self._session_pid == os.getpid():
+                self._retire_session()
+
+    def stats(self):
+        with self._lock:
+            connections, sent = self._pool_stats(self._session)
+            connections += self._retired_connections
+            sent += self._retired_requests
+            return {
+                'url': self.url,
+                'pool_size': self.pool_size,
+                'idle_timeout': self.idle_timeout,
+                'requests': self._requests,
+                'in_flight': self._in_flight,
+                'connections_created': connections,
+                'connections_reused': max(0, sent - connections),
+                'idle_evictions': self._idle_evictions
+            }
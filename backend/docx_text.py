@@ -0,0 +1,137 @@
+"""docx 文本流式提取 - 不构建 python-docx 对象模型
+
+从 zip 中流式解压 word/document.xml，用 lxml（python-docx 的依赖）的 iterparse 增量解析，
+只有文本和结构相关的标签回调到Python；每解析完一个段落或表格行立即产出，处理过的元素随即删除，
+峰值内存与单个段落/表格的大小有关，与文档大小无关。
+
+- 段落：w:t 文本，w:tab 为制表符，w:br（换行类型）/ w:cr 为换行；
+  段落属性中的制表位定义和修订中删除的文字（w:delText）不计入
+- 表格：每行输出一行，单元格之间用 " | " 分隔，单元格内多个段落用空格连接；嵌套表格的行并入所在单元格
+- 文本框等嵌套在段落中的段落单独成行；mc:Fallback 中与 mc:Choice 重复的内容跳过
+- 页眉、页脚（word/header*.xml、word/footer*.xml）去重后分别放在正文之前和之后
+"""
+import re
+import zipfile
+
+from lxml import etree
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_MC_FALLBACK = '{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback'
+_P, _T, _BR, _PPR = _W + 'p', _W + 't', _W + 'br', _W + 'pPr'
+_TBL, _TR, _TC = _W + 'tbl', _W + 'tr', _W + 'tc'
+_BREAK_TYPE = _W + 'type'
+# 行内的特殊元素（与 python-docx 的 Run.text 一致）；w:br 只有换行类型计为换行，分页、分栏不计
+_INLINE = {_W + 'tab': '\t', _W + 'ptab': '\t', _W + 'cr': '\n', _W + 'noBreakHyphen': '-'}
+_TAGS = [_P, _T, _BR, _PPR, _TBL, _TR, _TC, _MC_FALLBACK] + list(_INLINE)
+_PART_RE = re.compile(r'word/(header|footer)(\d*)\.xml$')
+
+CELL_SEPARATOR = ' | '
+
+
+def _release(elem):
+    """删除已处理的顶层元素及其之前的兄弟元素"""
+    elem.clear(keep_tail=True)
+    parent = elem.getparent()
+    if parent is not None:
+        while elem.getprevious() is not None:
+            del parent[0]
+
+
+def _iter_part(stream):
+    """逐行产出一个 WordprocessingML 部件（正文、页眉或页脚）的文本"""
+    paragraphs = []  # 正在解析的段落（嵌套时有多个），每个是文本片段列表
+    tables = []  # 正在解析的表格：[[当前行的单元格...], ...]
+    cells = []  # 正在解析的单元格：[段落文本...]
+    fallback = 0
+    properties = 0  # 位于 w:pPr 内（其中的 w:tab 是制表位定义，不是文本）
+
+    events = etree.iterparse(stream, events=('start', 'end'), tag=_TAGS,
+                             resolve_entities=False, no_network=True, huge_tree=True)
+    for event, elem in events:
+        tag = elem.tag
+        if event == 'start':
+            if tag == _P:
+                paragraphs.append([])
+            elif tag == _PPR:
+                properties += 1
+            elif tag == _TBL:
+                tables.append([])
+            elif tag == _TR:
+                tables[-1].append([])
+            elif tag == _TC:
+                cells.append([])
+            elif tag == _MC_FALLBACK:
+                fallback += 1
+            continue
+
+        if tag == _T:
+            if paragraphs and elem.text and not fallback:
+                paragraphs[-1].append(elem.text)
+        elif tag in _INLINE:
+            if paragraphs and not fallback and not properties:
+                paragraphs[-1].append(_INLINE[tag])
+        elif tag == _BR:
+            if paragraphs and not fallback and elem.get(_BREAK_TYPE, 'textWrapping') == 'textWrapping':
+                paragraphs[-1].append('\n')
+        elif tag == _PPR:
+            properties -= 1
+        elif tag == _P:
+            text = ''.join(paragraphs.pop())
+            if not fallback:
+                if cells:
+                    if text.strip():
+                        cells[-1].append(text.strip())
+                else:
+                    yield text
+        elif tag == _TC:
+            tables[-1][-1].append(' '.join(cells.pop()))
+        elif tag == _TR:
+            row = tables[-1].pop()
+            if not fallback and any(row):
+                line = CELL_SEPARATOR.join(cell.replace('\n', ' ') for cell in row)
+                if cells:
+                    # 嵌套表格：整行并入外层单元格
+                    cells[-1].append(line)
+                else:
+                    yield line
+        elif tag == _TBL:
+            tables.pop()
+        elif tag == _MC_FALLBACK:
+            fallback -= 1
+
+        if (tag == _P or tag == _TBL) and not paragraphs and not tables:
+            _release(elem)
+
+
+def _part_names(archive, kind):
+    """按序号排列的页眉或页脚部件名"""
+    parts = []
+    for name in archive.namelist():
+        match = _PART_RE.match(name)
+        if match and match.group(1) == kind:
+            parts.append((int(match.group(2) or 0), name))
+    return [name for _, name in sorted(parts)]
+
+
+def _unique_lines(archive, names):
+    seen = set()
+    for name in names:
+        with archive.open(name) as stream:
+            for line in _iter_part(stream):
+                if line.strip() and line not in seen:
+                    seen.add(line)
+                    yield line
+
+
+def iter_paragraphs(filepath):
+    """逐行产出 docx 文件的文本：页眉、正文（段落和表格行）、页脚"""
+    with zipfile.ZipFile(filepath) as archive:
+        yield from _unique_lines(archive, _part_names(archive, 'header'))
+        with archive.open('word/document.xml') as stream:
+            yield from _iter_part(stream)
+        yield from _unique_lines(archive, _part_names(archive, 'footer'))
+
+
+def extract_text(filepath):
+    """docx 文件的全部文本，各段落之间用换行分隔"""
+    return '\n'.join(iter_paragraphs(filepath))
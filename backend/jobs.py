@@ -0,0 +1,185 @@
+"""异步检索任务 - SQLite持久化的任务存储
+
+任务状态：queued -> running -> completed / failed
+每完成一个问题就写入一次部分结果。未完成的任务由持有租约的进程执行，持有者定期续期；
+进程退出后租约不再续期，过期后由其他进程认领，只继续处理剩余问题。
+持有者用每个进程随机生成的标识区分，不依赖容器重启后可能被复用的PID。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+
+
+class JobStore:
+    """检索任务存储，线程安全，多进程通过 SQLite WAL 共享
+
+    lease_seconds: 任务租约时长，持有者需在到期前调用 renew() 续期
+    """
+
+    def __init__(self, path, lease_seconds=30):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        self._owner = None
+        self._owner_pid = None
+        self._owner_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    request TEXT NOT NULL,
+                    results TEXT NOT NULL,
+                    report TEXT,
+                    error TEXT,
+                    owner TEXT NOT NULL,
+                    lease_until REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @property
+    def owner(self):
+        """当前进程的租约持有者标识（fork 后的子进程重新生成）"""
+        with self._owner_lock:
+            if self._owner_pid != os.getpid():
+                self._owner = uuid.uuid4().hex
+                self._owner_pid = os.getpid()
+            return self._owner
+
+    def create(self, request_data):
+        """创建任务并由当前进程持有租约，返回任务ID"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT INTO jobs (id, status, request, results, owner, lease_until, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, JOB_QUEUED, json.dumps(request_data, ensure_ascii=False), '{}',
+                 self.owner, now + self.lease_seconds, now, now)
+            )
+        return job_id
+
+    def get(self, job_id):
+        row = self._connect().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            'id': row['id'],
+            'status': row['status'],
+            'request': json.loads(row['request']),
+            'results': json.loads(row['results']),
+            'report': row['report'],
+            'error': row['error'],
+            'lease_until': row['lease_until'],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at']
+        }
+
+    # 以下写操作只在当前进程仍持有租约时生效，返回是否写入；租约已被其他进程接管时返回False
+
+    def mark_running(self, job_id):
+        return self._update(job_id, status=JOB_RUNNING)
+
+    def save_result(self, job_id, key, result):
+        """写入单个问题的结果（读-改-写在一个事务内完成）"""
+        conn = self._connect()
+        with conn:
+            row = conn.execute(
+                'SELECT results FROM jobs WHERE id = ? AND owner = ?', (job_id, self.owner)
+            ).fetchone()
+            if row is None:
+                return False
+            results = json.loads(row['results'])
+            results[key] = result
+            conn.execute(
+                'UPDATE jobs SET results = ?, updated_at = ? WHERE id = ?',
+                (json.dumps(results, ensure_ascii=False), time.time(), job_id)
+            )
+        return True
+
+    def complete(self, job_id, report):
+        return self._update(job_id, status=JOB_COMPLETED, report=report)
+
+    def fail(self, job_id, error):
+        return self._update(job_id, status=JOB_FAILED, error=error)
+
+    def _update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        conn = self._connect()
+        with conn:
+            return conn.execute(
+                f'UPDATE jobs SET {assignments} WHERE id = ? AND owner = ?', (*fields.values(), job_id, self.owner)
+            ).rowcount > 0
+
+    def renew(self, job_ids):
+        """为当前进程持有的未完成任务续期，返回续期成功的任务数"""
+        job_ids = list(job_ids)
+        if not job_ids:
+            return 0
+        placeholders = ', '.join('?' for _ in job_ids)
+        conn = self._connect()
+        with conn:
+            return conn.execute(
+                f'UPDATE jobs SET lease_until = ? WHERE owner = ? AND status IN (?, ?) AND id IN ({placeholders})',
+                (time.time() + self.lease_seconds, self.owner, JOB_QUEUED, JOB_RUNNING, *job_ids)
+            ).rowcount
+
+    def claim_expired(self):
+        """认领租约已过期（持有进程已退出或失去响应）的未完成任务，返回认领到的任务ID列表"""
+        now = time.time()
+        conn = self._connect()
+        rows = conn.execute(
+            'SELECT id, owner FROM jobs WHERE status IN (?, ?) AND lease_until < ?',
+            (JOB_QUEUED, JOB_RUNNING, now)
+        ).fetchall()
+        claimed = []
+        for row in rows:
+            with conn:
+                # 以原持有者和租约仍过期为条件更新，多个进程同时认领时只有一个成功
+                updated = conn.execute(
+                    'UPDATE jobs SET owner = ?, lease_until = ?, updated_at = ? '
+                    'WHERE id = ? AND owner = ? AND lease_until < ?',
+                    (self.owner, now + self.lease_seconds, now, row['id'], row['owner'], now)
+                ).rowcount
+            if updated:
+                claimed.append(row['id'])
+        return claimed
+
+    def expired(self, job):
+        """get() 返回的未完成任务的租约是否已过期"""
+        return job['status'] in (JOB_QUEUED, JOB_RUNNING) and job['lease_until'] < time.time()
+
+    def purge(self, older_than):
+        """删除早于指定秒数前结束的任务"""
+        conn = self._connect()
+        with conn:
+            return conn.execute(
+                'DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?',
+                (JOB_COMPLETED, JOB_FAILED, time.time() - older_than)
+            ).rowcount
@@ -0,0 +1,258 @@
+"""法条切分 - 把知识库文件按条文（第X条 / Article / Section / Regulation / MADDE）切分
+
+两类条文标记：
+- 明确标记：第十二条、Article 3、ARTICULO 3°、MADDE 16 –、Maddə 15.、Section 137、Regulation 2、§ 5
+- 编号行：70. Every...、137 Charges payable...、2.—(1) ...（英国、魁北克等只有编号的法规）
+
+同一文件中出现明确标记时只按明确标记切分，条文内部的 1. 2. 款项编号不再拆开；
+否则按编号行切分：1.1. 这类子编号归入所在的条，没有对应上级条文的插入条款（如魁北克法规的 90.1.）
+单独成条。条文标记前紧邻的短标题行（如土耳其法规的"Kapsam"）归入下一条。
+没有任何标记的文件（指南、表格）不产生条文。
+"""
+import re
+import sys
+from bisect import bisect_right
+from collections import defaultdict, namedtuple
+
+_CN_DIGITS = {'零': 0, '〇': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4,
+              '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+_CN_UNITS = {'十': 10, '百': 100, '千': 1000}
+
+# 条文编号之后允许的内容：行尾、分隔符、° 或大写开头的标题；排除 "Section 2 of the Act" 这类正文引用
+_MARKER_END = r'(?=$|\s*[.．:：°º—–\-]|\s+[(（\[]|\s+[^\W\d_a-z])'
+_STRONG_MARKERS = [
+    ('条', re.compile(r'(第)([零〇一二两三四五六七八九十百千\d]+)条(?![规的中至和及或、，,])')),
+    ('Article', re.compile(r'(Article|ARTICLE|Art\.|Artículo|ARTÍCULO|Articulo|ARTICULO)\s*(\d+[A-Za-z]?)' + _MARKER_END)),
+    ('Madde', re.compile(r'(MADDE|Madde|Maddə|MADDƏ)\s*(\d+[A-Za-z]?)' + _MARKER_END)),
+    ('Section', re.compile(r'(Section|SECTION|Sec\.|§)\s*(\d+[A-Za-z]?)' + _MARKER_END)),
+    ('Regulation', re.compile(r'(Regulation|REGULATION|Reg\.)\s*(\d+[A-Za-z]?)' + _MARKER_END)),
+]
+# 编号行：最多3位编号（可带一级子编号），后接 ". 正文"、".—"、"—" 或空格加大写标题（排除 2013. 这类年份）
+_NUMBERED_LINE = re.compile(
+    r'(\d{1,3}[A-Z]?(?:\.\d{1,3})?)(?:\.(?!\d)\s*[—–]?|\s*[—–]|\s+(?=[^\W\d_a-z]))\s*(?=\S)'
+)
+_HEADING_END = re.compile(r'[。；;：:.!?！？,，]$')
+
+# 条文在文件行列表中的位置：[start, end) 行号（含归入本条的标题行）、标记所在行、编号、引用标签、标题
+ArticleSpan = namedtuple('ArticleSpan', ['start', 'end', 'line', 'number', 'label', 'heading'])
+# 条文记录：司法辖区、法规名称、来源文件、编号、引用标签、标题、正文
+Article = namedtuple('Article', ['jurisdiction', 'law', 'source', 'number', 'label', 'heading', 'text'])
+
+# 内存估算用的对象大小（CPython 64位）：条文元组、编号和标签字符串、按编号查找的表项；条文位置元组和起始行号
+_ARTICLE_BYTES = 300
+_SPAN_BYTES = 150
+
+
+def chinese_to_int(text):
+    """中文数字（一百二十三）或阿拉伯数字转为整数"""
+    if text.isdigit():
+        return int(text)
+    total, current = 0, 0
+    for char in text:
+        if char in _CN_DIGITS:
+            current = _CN_DIGITS[char]
+        elif char in _CN_UNITS:
+            total += (current or 1) * _CN_UNITS[char]
+            current = 0
+    return total + current
+
+
+def _normalize_number(kind, raw):
+    if kind == '条':
+        return str(chinese_to_int(raw))
+    return raw.upper().lstrip('0') or '0'
+
+
+def article_label(word, number):
+    """条文的引用标签，沿用原文的写法：第12条、Article 3、ARTICULO 3、MADDE 16；只有编号的条文为 §70"""
+    if word == '第':
+        return f"第{number}条"
+    if word is None:
+        return f"§{number}"
+    return f"{word} {number}"
+
+
+def match_strong(line):
+    """明确的条文标记，返回 (编号, 引用标签, 标记之后的文本) 或 None"""
+    for kind, pattern in _STRONG_MARKERS:
+        match = pattern.match(line)
+        if match:
+            number = _normalize_number(kind, match.group(2))
+            return number, article_label(match.group(1), number), line[match.end():]
+    return None
+
+
+def match_numbered(line):
+    """编号行，返回 (编号, 引用标签, 编号之后的文本) 或 None"""
+    match = _NUMBERED_LINE.match(line)
+    if match:
+        number = _normalize_number(None, match.group(1))
+        return number, article_label(None, number), line[match.end():]
+    return None
+
+
+def _numbered_markers(stripped):
+    """编号行标记；子编号（15.1）所属的条文已出现时不单独成条"""
+    markers = []
+    seen = set()
+    for i, line in enumerate(stripped):
+        match = match_numbered(line) if line else None
+        if match is None:
+            continue
+        parent = match[0].split('.', 1)[0]
+        if '.' in match[0] and parent in seen:
+            continue
+        seen.add(parent)
+        markers.append((i, match))
+    return markers
+
+
+def _heading_of(rest):
+    """标记行其余部分像标题（短、不以句读结尾、不是款项编号）时作为标题"""
+    rest = rest.strip(' \t.．:：°º—–-')
+    if not rest or len(rest) > 80 or rest[0] in '(（' or _HEADING_END.search(rest):
+        return ''
+    return rest
+
+
+def _is_heading_line(line):
+    line = line.strip()
+    return 0 < len(line) <= 40 and not _HEADING_END.search(line)
+
+
+def parse_articles(lines):
+    """切分一个文件的行列表，返回 [ArticleSpan, ...]（按行号升序）"""
+    stripped = [line.strip() for line in lines]
+    markers = [(i, match_strong(line)) for i, line in enumerate(stripped) if line]
+    markers = [(i, m) for i, m in markers if m] or _numbered_markers(stripped)
+
+    spans = []
+    previous_marker = -1
+    for line_no, (number, label, rest) in markers:
+        start = line_no
+        heading = _heading_of(rest)
+        before = line_no - 1
+        if not heading and before > previous_marker and _is_heading_line(stripped[before]):
+            # 标记前的短标题行归入本条
+            heading = stripped[before]
+            start = before
+        previous_marker = line_no
+        if spans:
+            previous = spans[-1]
+            spans[-1] = previous._replace(end=min(previous.end, start))
+        spans.append(ArticleSpan(start, len(lines), line_no, number, label, heading))
+
+    # 去掉条文末尾的空行
+    trimmed = []
+    for span in spans:
+        end = span.end
+        while end > span.start + 1 and not stripped[end - 1]:
+            end -= 1
+        trimmed.append(span._replace(end=end))
+    return trimmed
+
+
+def parse_citation(citation):
+    """把引用（137、Article 3、第十二条、MADDE 16、s.137）解析为条文编号；无法识别时返回 None"""
+    citation = citation.strip()
+    if not citation:
+        return None
+    match = match_strong(citation)
+    if match:
+        return match[0]
+    match = re.fullmatch(r'(?:s\.|sec|reg\.?|art\.?|no\.?|§)?\s*(\d+[A-Za-z]?(?:\.\d+)?)\.?', citation, re.IGNORECASE)
+    if match:
+        return _normalize_number(None, match.group(1))
+    match = re.fullmatch(r'第?([零〇一二两三四五六七八九十百千]+)条?', citation)
+    if match:
+        return str(chinese_to_int(match.group(1)))
+    return None
+
+
+def _law_name(title, lines, jurisdiction):
+    """文件标记后的第一行是 '{司法辖区} - {法规名称}'"""
+    for line in lines:
+        if line.strip():
+            prefix = f"{jurisdiction} - "
+            return line.strip()[len(prefix):] if line.strip().startswith(prefix) else line.strip()
+    return title.rsplit('.', 1)[0]
+
+
+class ArticleIndex:
+    """一个司法辖区知识库的条文记录，按编号查找
+
+    sections: kb_index.split_sections() 的结果 [(文件标题, [行...]), ...]
+    """
+
+    def __init__(self, jurisdiction, sections):
+        self.jurisdiction = jurisdiction
+        self.articles = []
+        self._by_number = defaultdict(list)
+        section_spans = [parse_articles(lines) for _, lines in sections]
+        for (title, lines), spans in zip(sections, section_spans):
+            law = _law_name(title, lines, jurisdiction)
+            for span in spans:
+                article = Article(
+                    jurisdiction=jurisdiction,
+                    law=law,
+                    source=title,
+                    number=span.number,
+                    label=span.label,
+                    heading=span.heading,
+                    text='\n'.join(line.strip() for line in lines[span.start:span.end] if line.strip())
+                )
+                self._by_number[span.number].append(len(self.articles))
+                self.articles.append(article)
+        # 同一次切分的条文位置，BM25 索引直接复用，每个快照只切分一次
+        self.spans = ArticleSpans(section_spans)
+
+    def __len__(self):
+        return len(self.articles)
+
+    def memory_bytes(self):
+        """条文记录和条文位置占用内存的估算（字节）"""
+        return (sum(sys.getsizeof(article.text) + _ARTICLE_BYTES for article in self.articles)
+                + self.spans.memory_bytes())
+
+    def lookup(self, number, law=None):
+        """返回编号为 number 的条文；law 按法规名称或文件名（不区分大小写的子串）筛选"""
+        found = [self.articles[i] for i in self._by_number.get(number, ())]
+        if law:
+            law = law.lower()
+            found = [a for a in found if law in a.law.lower() or law in a.source.lower()]
+        return found
+
+    def laws(self):
+        """各法规的条文目录：[(法规名称, 来源文件, [引用标签...]), ...]"""
+        catalog = {}
+        for article in self.articles:
+            entry = catalog.setdefault(article.source, (article.law, article.source, []))
+            entry[2].append(article.label)
+        return list(catalog.values())
+
+
+class ArticleSpans:
+    """按 (文件序号, 行号) 查找所在条文，供检索窗口裁剪和片段标注使用
+
+    section_spans: 各文件 parse_articles() 的结果，顺序与 sections 一致
+    """
+
+    def __init__(self, section_spans):
+        self._spans = section_spans
+        self._starts = [[span.start for span in spans] for spans in self._spans]
+
+    @classmethod
+    def parse(cls, sections):
+        """切分 [(文件标题, [行...]), ...] 中的各文件"""
+        return cls([parse_articles(lines) for _, lines in sections])
+
+    def memory_bytes(self):
+        return sum(len(spans) for spans in self._spans) * _SPAN_BYTES
+
+    def find(self, section_id, line_no):
+        """返回行所在的 ArticleSpan；在第一条之前或文件没有条文时返回 None"""
+        position = bisect_right(self._starts[section_id], line_no) - 1
+        if position < 0:
+            return None
+        span = self._spans[section_id][position]
+        return span if line_no < span.end else None
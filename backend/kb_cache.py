@@ -0,0 +1,106 @@
+"""知识库文件解析缓存 - 按 (路径, mtime, 大小) 缓存解析结果，带内存上限与LRU淘汰"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+
+def file_signature(filepath):
+    """返回文件签名 (mtime_ns, size)，文件不存在时返回None"""
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class DocumentCache:
+    """已解析文档的进程内缓存
+
+    - 以文件路径为键，条目记录解析时的 mtime 和大小，文件变化后自动失效
+    - 按内容占用的内存估算做LRU淘汰，总量不超过 max_bytes
+    - 线程安全，统计命中/未命中/淘汰次数
+
+    loader(filepath, signature) 负责实际读取并返回文本。
+    """
+
+    def __init__(self, loader, max_bytes):
+        self._loader = loader
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # path -> (signature, content, size)
+        self._lock = threading.Lock()
+        self._current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, filepath, signature=None):
+        """获取文件内容，缓存未命中或文件已变化时重新解析"""
+        if signature is None:
+            signature = file_signature(filepath)
+        if signature is None:
+            self.invalidate(filepath)
+            return ""
+
+        with self._lock:
+            entry = self._entries.get(filepath)
+            if entry is not None:
+                if entry[0] == signature:
+                    self._entries.move_to_end(filepath)
+                    self.hits += 1
+                    return entry[1]
+                # 文件已在磁盘上变化，丢弃旧条目
+                self._remove(filepath)
+                self.invalidations += 1
+            self.misses += 1
+
+        # 解析在锁外进行，避免阻塞其他文件的读取
+        content = self._loader(filepath, signature)
+        if content:
+            self._store(filepath, signature, content)
+        return content
+
+    def invalidate(self, filepath):
+        with self._lock:
+            if filepath in self._entries:
+                self._remove(filepath)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+    def _store(self, filepath, signature, content):
+        size = sys.getsizeof(content)
+        if size > self.max_bytes:
+            # 单个文件超过缓存上限，不缓存
+            return
+        with self._lock:
+            if filepath in self._entries:
+                self._remove(filepath)
+            self._entries[filepath] = (signature, content, size)
+            self._current_bytes += size
+            while self._current_bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, filepath):
+        _, _, size = self._entries.pop(filepath)
+        self._current_bytes -= size
@@ -0,0 +1,257 @@
+"""预编译知识库语料文件
+
+将 knowledge-base/ 下（含分片子目录）的 txt/docx 文件离线编译为单个二进制语料文件，运行时以只读 mmap 方式加载，
+多个 gunicorn worker 共享同一份页缓存，冷启动和 worker 重启时无需再解析 docx。
+运行时不把文件解码为整段字符串：CorpusLines 直接引用映射中的文本和段落偏移表，只在取某一行时解码该行，
+检索索引和上下文拼装只为用到的行生成字符串。
+
+文件格式（小端序）：
+    8字节魔数 | uint32 版本号 | uint32 目录长度 | 目录(UTF-8 JSON) | 数据区
+目录以相对知识库目录的路径（/ 分隔，平铺目录中即文件名）为键，记录每个文件的签名、文本在数据区中的偏移/长度，
+以及段落起始偏移表（uint32 数组）的位置；并按司法辖区（子目录名或文件名前缀）给出文件列表。
+
+编译命令不导入应用（不创建数据库、不启动线程），可在部署的构建步骤中运行。
+
+用法：
+    python -m backend.kb_corpus [--knowledge-dir DIR] [--output PATH]
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+from array import array
+
+from backend.kb_index import LineView
+from backend.kb_shards import iter_knowledge_files
+
+MAGIC = b'LRKBCORP'
+VERSION = 1
+_HEADER = struct.Struct('<8sII')
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CORPUS_PATH = os.path.join(_ROOT, 'build', 'knowledge.corpus')
+DEFAULT_KNOWLEDGE_DIR = os.path.join(_ROOT, 'knowledge-base')
+
+
+def normalize_text(text):
+    """统一换行符和不间断空格，语料文件和直接解析得到的文本保持一致"""
+    return text.replace('\r\n', '\n').replace('\r', '\n').replace('\xa0', ' ')
+
+
+def load_file_content(filepath):
+    """加载单个文件内容，支持txt和docx格式"""
+    filename = os.path.basename(filepath)
+    
+    try:
+        if filename.lower().endswith('.txt'):
+            # 读取txt文件
+            try:
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    return f.read()
+            except UnicodeDecodeError:
+                with open(filepath, 'r', encoding='gbk') as f:
+                    return f.read()
+        
+        elif filename.lower().endswith('.docx'):
+            # 流式解析docx（含表格、页眉页脚），不构建完整的文档对象模型；有预编译语料时通常不会走到这里
+            from backend.docx_text import extract_text
+            return extract_text(filepath)
+        
+    except Exception as e:
+        print(f"读取文件 {filename} 失败: {e}")
+        return ""
+    
+    return ""
+
+
+def sha1_of_file(filepath):
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _paragraph_offsets(encoded):
+    """返回每个段落在UTF-8字节串中的起始偏移"""
+    offsets = array('I', [0])
+    pos = encoded.find(b'\n')
+    while pos != -1:
+        offsets.append(pos + 1)
+        pos = encoded.find(b'\n', pos + 1)
+    return offsets
+
+
+def compile_corpus(knowledge_dir, output_path, load_file=load_file_content):
+    """编译知识库目录为语料文件，load_file(filepath) 返回文件文本"""
+    # 子目录中的文件不要求 {司法辖区}_ 前缀
+    filenames = [name for name in iter_knowledge_files(knowledge_dir) if '/' in name or '_' in name]
+
+    toc = {'version': VERSION, 'created_at': time.time(), 'files': {}, 'jurisdictions': {}}
+    blobs = []
+    offset = 0
+    for name in filenames:
+        filepath = os.path.join(knowledge_dir, *name.split('/'))
+        st = os.stat(filepath)
+        text = normalize_text(load_file(filepath) or '')
+        encoded = text.encode('utf-8')
+        offsets = _paragraph_offsets(encoded).tobytes()
+
+        toc['files'][name] = {
+            'mtime_ns': st.st_mtime_ns,
+            'size': st.st_size,
+            'sha1': sha1_of_file(filepath),
+            'offset': offset,
+            'length': len(encoded),
+            'paragraphs_offset': offset + len(encoded),
+            'paragraphs_count': len(offsets) // 4
+        }
+        blobs.append(encoded)
+        blobs.append(offsets)
+        offset += len(encoded) + len(offsets)
+
+        jurisdiction = name.split('/', 1)[0] if '/' in name else name.split('_', 1)[0]
+        toc['jurisdictions'].setdefault(jurisdiction, []).append(name)
+
+    toc_bytes = json.dumps(toc, ensure_ascii=False).encode('utf-8')
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(toc_bytes)))
+        f.write(toc_bytes)
+        for blob in blobs:
+            f.write(blob)
+    # 原子替换，正在运行的进程继续使用旧文件的映射
+    os.replace(tmp_path, output_path)
+    return toc
+
+
+class CorpusLines(LineView):
+    """语料文件中一个文件的按行视图：引用映射中的文本和段落偏移表，取行时才解码"""
+
+    def __init__(self, buffer, start, length, offsets, header=()):
+        super().__init__(header)
+        self._buffer = buffer
+        self._start = start
+        self._length = length
+        self._offsets = offsets  # 映射上的 uint32 视图，不复制
+        self._count = len(offsets)
+
+    def _line(self, i):
+        begin = self._start + self._offsets[i]
+        end = self._start + (self._offsets[i + 1] - 1 if i + 1 < self._count else self._length)
+        return str(self._buffer[begin:end], 'utf-8')
+
+    def _iter_body(self):
+        # 顺序遍历（构建索引）时整段解码一次，比逐行切片快；结果不保留
+        return iter(str(self._buffer[self._start:self._start + self._length], 'utf-8').split('\n'))
+
+    def memory_bytes(self):
+        """文本和偏移表都在共享的映射中，不占私有内存"""
+        return 0
+
+
+class CorpusReader:
+    """只读 mmap 语料文件读取器
+
+    knowledge_dir 为编译时的知识库目录，用于把文件路径换算为目录中的键；不传时按文件名查找（平铺目录）。
+    """
+
+    def __init__(self, path, knowledge_dir=None):
+        self.path = path
+        self.knowledge_dir = knowledge_dir
+        self._file = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+
+        magic, version, toc_length = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"语料文件格式不匹配: {path}")
+        toc_start = _HEADER.size
+        self.toc = json.loads(self._mm[toc_start:toc_start + toc_length].decode('utf-8'))
+        self._data_start = toc_start + toc_length
+        self._view = memoryview(self._mm)
+
+    @property
+    def jurisdictions(self):
+        return self.toc['jurisdictions']
+
+    def entry_for(self, filepath, signature=None):
+        """返回与磁盘文件一致的目录项；文件在编译后被修改则返回None"""
+        if self.knowledge_dir:
+            name = os.path.relpath(filepath, self.knowledge_dir).replace(os.sep, '/')
+        else:
+            name = os.path.basename(filepath)
+        entry = self.toc['files'].get(name)
+        if entry is None:
+            return None
+        if signature is None:
+            try:
+                st = os.stat(filepath)
+            except OSError:
+                return None
+            signature = (st.st_mtime_ns, st.st_size)
+        if signature == (entry['mtime_ns'], entry['size']):
+            return entry
+        # 部署时复制文件可能改变mtime，大小一致时再比较内容摘要
+        if signature[1] == entry['size']:
+            try:
+                if sha1_of_file(filepath) == entry['sha1']:
+                    return entry
+            except OSError:
+                return None
+        return None
+
+    def lines(self, filepath, signature=None, header=()):
+        """文件的按行视图（CorpusLines），header 为放在文件各行之前的说明行；语料中不存在或已过期时返回None"""
+        entry = self.entry_for(filepath, signature)
+        if entry is None:
+            return None
+        start = self._data_start + entry['offset']
+        table_start = self._data_start + entry['paragraphs_offset']
+        offsets = self._view[table_start:table_start + entry['paragraphs_count'] * 4].cast('I')
+        return CorpusLines(self._view, start, entry['length'], offsets, header)
+
+    def close(self):
+        """关闭映射；仍被引用的 CorpusLines 会使映射无法关闭，只在不再使用语料时调用"""
+        try:
+            self._view.release()
+            self._mm.close()
+        finally:
+            self._file.close()
+
+
+def open_corpus(path, knowledge_dir=None):
+    """打开语料文件，不存在或格式错误时返回None（回退到直接解析源文件）"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        reader = CorpusReader(path, knowledge_dir)
+    except Exception as e:
+        print(f"加载知识库语料文件失败 {path}: {e}")
+        return None
+    print(f"已映射知识库语料文件: {path}，共 {len(reader.toc['files'])} 个文件")
+    return reader
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='编译知识库为预解析语料文件')
+    parser.add_argument('--knowledge-dir', default=os.getenv('KNOWLEDGE_DIR', DEFAULT_KNOWLEDGE_DIR), help='知识库目录')
+    parser.add_argument('--output', default=os.getenv('KB_CORPUS_PATH') or DEFAULT_CORPUS_PATH, help='输出文件路径')
+    args = parser.parse_args(argv)
+
+    start_time = time.time()
+    toc = compile_corpus(args.knowledge_dir, args.output)
+    print(f"语料编译完成: {args.output}，{len(toc['files'])} 个文件，"
+          f"{len(toc['jurisdictions'])} 个司法辖区，耗时 {time.time() - start_time:.2f}秒")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+"""知识库倒排索引 - 段落级分块 + BM25 排序
+
+中文按字二元组(bigram)切分，其他文字按单词切分并转小写。
+索引对每个司法辖区的知识库内容只构建一次，检索时只访问查询词命中的倒排列表。
+同时记录每行所在的条文（kb_articles），命中行的上下文窗口不跨出所在条文。
+"""
+import math
+import re
+import sys
+from array import array
+from collections import Counter, defaultdict, namedtuple
+from collections.abc import Sequence
+
+from backend.kb_articles import ArticleSpans
+
+_TOKEN_RE = re.compile(r'[一-鿿]+|[^\W_一-鿿]+')
+_SECTION_RE = re.compile(r'^=== (.+) ===$')
+
+# 段落块：所属文件标题、文件序号、在文件内的行号（文本按需从 sections 取）
+Chunk = namedtuple('Chunk', ['title', 'section', 'line'])
+
+# 内存估算用的对象大小（CPython 64位）：每行的列表槽位（split_sections 的行列表）；段落块元组、序号和长度；
+# 倒排项 (chunk_id, tf) 元组和列表槽位；每个词的倒排表、idf 表条目（不含词本身的字符串）
+_LINE_SLOT_BYTES = 8
+_CHUNK_BYTES = 112
+_POSTING_BYTES = 62
+_TERM_BYTES = 170
+
+
+def tokenize(text):
+    """中文字符二元组 + 其他文字的小写单词"""
+    tokens = []
+    for run in _TOKEN_RE.findall(text):
+        if '一' <= run[0] <= '鿿':
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run.lower())
+    return tokens
+
+
+class LineView(Sequence):
+    """一个知识库文件的按行视图：header（文件标记后的说明行）在前，之后是文件各行
+
+    不为每行保留字符串，取行时才生成；子类实现 _count / _line(i) / _iter_body() / memory_bytes()。
+    """
+
+    def __init__(self, header=()):
+        self._header = tuple(header)
+
+    def __len__(self):
+        return len(self._header) + self._count
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        if position < len(self._header):
+            return self._header[position]
+        return self._line(position - len(self._header))
+
+    def __iter__(self):
+        yield from self._header
+        yield from self._iter_body()
+
+
+class TextLines(LineView):
+    """字符串的按行视图（与 text.split('\n') 的各行一致），只保存每行的起始偏移"""
+
+    def __init__(self, text, header=()):
+        super().__init__(header)
+        self._text = text
+        offsets = array('I', [0])
+        position = text.find('\n')
+        while position != -1:
+            offsets.append(position + 1)
+            position = text.find('\n', position + 1)
+        self._offsets = offsets
+        self._count = len(offsets)
+
+    def _line(self, i):
+        end = self._offsets[i + 1] - 1 if i + 1 < self._count else len(self._text)
+        return self._text[self._offsets[i]:end]
+
+    def _iter_body(self):
+        return iter(self._text.split('\n'))
+
+    def memory_bytes(self):
+        return sys.getsizeof(self._text) + self._offsets.itemsize * len(self._offsets)
+
+
+class KnowledgeText:
+    """一个司法辖区的知识库内容：按文件分节的行视图 [(文件标题, LineView), ...]
+
+    各节直接引用解析缓存中的文件文本或语料文件的映射，不拼接为整段字符串；
+    str() 生成 '=== 文件名 ===' 格式的完整文本（只在需要整段文本的回退路径使用）。
+    len() 为完整文本的字符数；比较和哈希按对象身份，同一快照始终返回同一个对象。
+    article_spans 为快照的 ArticleIndex 已切分出的条文位置（ArticleSpans），构建索引时直接复用。
+    """
+
+    def __init__(self, sections, article_spans=None):
+        self.sections = sections
+        self.article_spans = article_spans
+        # 每节的标记行、各行和换行符，与 str() 的长度一致
+        self._length = sum(len(title) + 11 + sum(len(line) + 1 for line in lines) for title, lines in sections)
+
+    def __len__(self):
+        return self._length
+
+    def __bool__(self):
+        return bool(self.sections)
+
+    def __str__(self):
+        return ''.join(f"\n\n=== {title} ===\n" + '\n'.join(lines) + '\n' for title, lines in self.sections)
+
+    def memory_bytes(self):
+        """各节行视图的私有内存（语料映射的页缓存由所有进程共享，不计入）"""
+        return sum(lines.memory_bytes() + sys.getsizeof(title) for title, lines in self.sections)
+
+
+def split_sections(knowledge_content):
+    """按 '=== 文件名 ===' 标记切分知识库内容，返回 [(标题, [行...]), ...]；KnowledgeText 直接返回其各节"""
+    if isinstance(knowledge_content, KnowledgeText):
+        return knowledge_content.sections
+    sections = []
+    title, lines = None, []
+    for line in knowledge_content.split('\n'):
+        match = _SECTION_RE.match(line)
+        if match:
+            if title is not None:
+                sections.append((title, lines))
+            title, lines = match.group(1), []
+        elif title is not None:
+            lines.append(line)
+    if title is not None:
+        sections.append((title, lines))
+    elif knowledge_content.strip():
+        sections.append(('知识库', knowledge_content.split('\n')))
+    return sections
+
+
+class BM25Index:
+    """段落级 BM25 倒排索引"""
+
+    def __init__(self, knowledge_content, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.sections = split_sections(knowledge_content)
+        # 快照的条文记录已切分过各文件时直接复用，不再解析一遍；其内存计入快照
+        shared = knowledge_content.article_spans if isinstance(knowledge_content, KnowledgeText) else None
+        self._owns_articles = shared is None
+        self.articles = ArticleSpans.parse(self.sections) if shared is None else shared
+        self.chunks = []
+        self._postings = defaultdict(list)  # token -> [(chunk_id, tf), ...]
+        self._memory_bytes = None
+        lengths = []
+
+        for section_id, (title, lines) in enumerate(self.sections):
+            header_skipped = False
+            for line_no, line in enumerate(lines):
+                if not line.strip():
+                    continue
+                if not header_skipped:
+                    # 文件标记后的第一行是 '{司法辖区} - {法规名称}' 说明行，不参与检索
+                    header_skipped = True
+                    continue
+                tokens = tokenize(line)
+                if not tokens:
+                    continue
+                chunk_id = len(self.chunks)
+                self.chunks.append(Chunk(title, section_id, line_no))
+                lengths.append(len(tokens))
+                for token, tf in Counter(tokens).items():
+                    self._postings[token].append((chunk_id, tf))
+
+        self._lengths = lengths
+        self._avg_length = (sum(lengths) / len(lengths)) if lengths else 0.0
+        n = len(self.chunks)
+        self._idf = {
+            token: math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for token, postings in self._postings.items()
+        }
+
+    def search(self, query_weights, top_k=20):
+        """按 BM25 得分检索
+
+        query_weights: {token: 权重}
+        返回 [(得分, chunk_id), ...]，得分降序、得分相同时按文档位置升序，结果稳定可复现
+        """
+        scores = defaultdict(float)
+        k1, b, avg = self.k1, self.b, self._avg_length or 1.0
+        for token, weight in query_weights.items():
+            postings = self._postings.get(token)
+            if not postings:
+                continue
+            idf = self._idf[token] * weight
+            for chunk_id, tf in postings:
+                norm = k1 * (1 - b + b * self._lengths[chunk_id] / avg)
+                scores[chunk_id] += idf * tf * (k1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [(score, chunk_id) for chunk_id, score in ranked[:top_k]]
+
+    def term_weights(self):
+        """按词产出 (token, [(chunk_id, BM25权重), ...])；查询权重与之相乘求和即 search() 的得分"""
+        k1, b, avg = self.k1, self.b, self._avg_length or 1.0
+        for token, postings in self._postings.items():
+            idf = self._idf[token]
+            yield token, [
+                (chunk_id, idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * self._lengths[chunk_id] / avg)))
+                for chunk_id, tf in postings
+            ]
+
+    def memory_bytes(self):
+        """索引占用内存的估算（字节）：各行文本、段落块、倒排列表、idf 表和自行切分的条文位置；索引构建后不变，只计算一次"""
+        if self._memory_bytes is None:
+            # KnowledgeText 的行视图计入快照本身，这里只计 split_sections 切出的行
+            lines = sum(sys.getsizeof(line) + _LINE_SLOT_BYTES
+                        for _, lines in self.sections if not isinstance(lines, LineView) for line in lines)
+            postings = sum(len(postings) for postings in self._postings.values())
+            terms = sum(sys.getsizeof(token) + _TERM_BYTES for token in self._postings)
+            self._memory_bytes = (lines + len(self.chunks) * _CHUNK_BYTES + postings * _POSTING_BYTES
+                                  + terms + (self.articles.memory_bytes() if self._owns_articles else 0))
+        return self._memory_bytes
+
+    def chunk_text(self, chunk_id):
+        chunk = self.chunks[chunk_id]
+        return self.sections[chunk.section][1][chunk.line]
+
+    def window(self, chunk_id, before=1, after=1):
+        """返回段落块及其前后各若干行所在的 (section_id, 起始行, 结束行)，不超出段落块所在条文的范围"""
+        chunk = self.chunks[chunk_id]
+        lines = self.sections[chunk.section][1]
+        start, end = max(0, chunk.line - before), min(len(lines), chunk.line + after + 1)
+        span = self.articles.find(chunk.section, chunk.line)
+        if span is not None:
+            start, end = max(start, span.start), min(end, span.end)
+        return chunk.section, start, end
@@ -0,0 +1,394 @@
+"""知识库分片 - 按司法辖区划分的文件集合，首次请求时才加载，已加载的分片按LRU保留在内存上限内
+
+分片清单（knowledge-base/manifest.json，JSON 对象的顺序即 /api/jurisdictions 的顺序）：
+    {
+      "shards": {
+        "欧盟": {"shared": true},
+        "英国": {"preload": true},
+        "法国": {"include": ["欧盟"], "preload": true},
+        "日本": {"files": ["日本/**/*", "JP_*"]}
+      }
+    }
+- files：相对知识库目录的 glob 模式（支持 * ? 和跨目录的 **），只取 txt/docx 文件；
+  默认为 "{名称}_*"（平铺目录的命名方式）和 "{名称}/**/*"（分片子目录）
+- include：附加其他分片的文件，如欧盟成员国附加 GDPR
+- shared：只供其他分片引用的公共分片，不作为可选的司法辖区
+- preload：启动后的预热中加载；未标记的分片在首次请求时加载
+
+没有清单时按目录布局发现：顶层文件名前缀（{司法辖区}_*.txt/docx）和顶层子目录名各为一个分片，
+shared_defaults 中的公共分片（欧盟）自动附加给对应的司法辖区，所有分片都预热，与平铺目录的原有行为一致。
+
+启动时只读取清单（或列出顶层目录），不访问分片内的文件；分片的文件列表在加载时才列出。
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+
+from backend.kb_cache import file_signature
+from backend.kb_watcher import KNOWLEDGE_EXTENSIONS
+
+MANIFEST_NAME = 'manifest.json'
+
+# 分片：名称、文件 glob 模式、附加的其他分片、是否为公共分片、是否预热
+Shard = namedtuple('Shard', ['name', 'files', 'include', 'shared', 'preload'])
+
+
+def default_patterns(name):
+    return (f"{name}_*", f"{name}/**/*")
+
+
+def is_knowledge_file(filename):
+    """txt/docx 文件；Word临时文件（~$开头）不计入"""
+    return filename.lower().endswith(KNOWLEDGE_EXTENSIONS) and not filename.startswith('~$')
+
+
+@lru_cache(maxsize=None)
+def _pattern_regex(pattern):
+    """glob 模式转正则：**/ 匹配零到多层目录，* 和 ? 不跨越目录"""
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            parts.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            parts.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            parts.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            parts.append('[^/]')
+            i += 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return re.compile(''.join(parts) + r'\Z')
+
+
+def iter_knowledge_files(directory, base=None):
+    """递归列出目录下的知识库文件，产出相对 base（默认即 directory）的路径（用 / 分隔）"""
+    base = base or directory
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        relative_root = os.path.relpath(root, base).replace(os.sep, '/')
+        for filename in sorted(files):
+            if is_knowledge_file(filename):
+                yield filename if relative_root == '.' else f"{relative_root}/{filename}"
+
+
+def load_manifest(path):
+    """读取分片清单，返回 OrderedDict(名称 -> Shard)"""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f, object_pairs_hook=OrderedDict)
+    shards = OrderedDict()
+    for name, spec in (data.get('shards') or {}).items():
+        spec = spec or {}
+        files = spec.get('files') or default_patterns(name)
+        shards[name] = Shard(
+            name=name,
+            files=tuple([files] if isinstance(files, str) else files),
+            include=tuple(spec.get('include') or ()),
+            shared=bool(spec.get('shared', False)),
+            preload=bool(spec.get('preload', False))
+        )
+    unknown = {inc for shard in shards.values() for inc in shard.include if inc not in shards}
+    if unknown:
+        raise ValueError(f"清单引用了不存在的分片: {', '.join(sorted(unknown))}")
+    return shards
+
+
+def discover_shards(directory, shared_defaults=None):
+    """按目录布局发现分片，返回 OrderedDict(名称 -> Shard)
+
+    shared_defaults: {公共分片名: [附加该分片的司法辖区, ...]}，如 {'欧盟': EU_COUNTRIES}
+    """
+    shared_defaults = shared_defaults or {}
+    names = set()
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        entries = []
+    for entry in entries:
+        if entry.name.startswith('.'):
+            continue
+        if entry.is_dir():
+            names.add(entry.name)
+        elif is_knowledge_file(entry.name) and '_' in entry.name:
+            names.add(entry.name.split('_', 1)[0])
+
+    members = {}
+    for shared, jurisdictions in shared_defaults.items():
+        if shared in names:
+            for jurisdiction in jurisdictions:
+                members.setdefault(jurisdiction, []).append(shared)
+    shards = OrderedDict()
+    for name in sorted(names | set(members)):
+        shards[name] = Shard(
+            name=name,
+            files=default_patterns(name),
+            include=tuple(members.get(name, ())),
+            shared=name in shared_defaults,
+            preload=True
+        )
+    return shards
+
+
+class ShardCatalog:
+    """知识库分片目录：有清单时读取清单，否则按目录布局发现
+
+    清单文件变化（或无清单时目录中出现新的前缀、子目录）在 revalidate_seconds 内生效，
+    期间重复访问不做文件I/O。清单格式错误时保留上一次成功读取的目录。
+    """
+
+    def __init__(self, directory, manifest_path=None, shared_defaults=None, revalidate_seconds=5.0):
+        self.directory = directory
+        self.manifest_path = manifest_path or os.path.join(directory, MANIFEST_NAME)
+        self.shared_defaults = shared_defaults or {}
+        self.revalidate_seconds = revalidate_seconds
+        self._lock = threading.Lock()
+        self._shards = OrderedDict()
+        self._manifest_signature = None
+        self._checked_at = None
+        self.source = None  # 'manifest' / 'discovered'
+        self.error = None
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        """按需重新读取清单或目录；返回目录是否有变化"""
+        now = time.time()
+        if not force and self._checked_at is not None and now - self._checked_at < self.revalidate_seconds:
+            return False
+        with self._lock:
+            if not force and self._checked_at is not None and now - self._checked_at < self.revalidate_seconds:
+                return False
+            self._checked_at = now
+            signature = file_signature(self.manifest_path)
+            if signature is not None and signature == self._manifest_signature:
+                return False
+            try:
+                if signature is not None:
+                    shards, source = load_manifest(self.manifest_path), 'manifest'
+                else:
+                    shards, source = discover_shards(self.directory, self.shared_defaults), 'discovered'
+            except (OSError, ValueError) as e:
+                # 记下出错的清单签名，清单再次修改前不重复读取
+                print(f"读取知识库分片清单失败，继续使用上一次的分片目录: {e}")
+                self._manifest_signature = signature
+                self.error = str(e)
+                return False
+            self._manifest_signature = signature
+            self.error = None
+            changed = shards != self._shards
+            if changed:
+                self._shards = shards
+            self.source = source
+            return changed
+
+    @property
+    def jurisdictions(self):
+        """可选的司法辖区（不含公共分片），按清单顺序"""
+        self.refresh()
+        return [name for name, shard in self._shards.items() if not shard.shared]
+
+    @property
+    def preload(self):
+        """需要预热的司法辖区"""
+        self.refresh()
+        return [name for name, shard in self._shards.items() if shard.preload and not shard.shared]
+
+    def __contains__(self, name):
+        self.refresh()
+        shard = self._shards.get(name)
+        return shard is not None and not shard.shared
+
+    def __len__(self):
+        return len(self.jurisdictions)
+
+    def _own_files(self, shard):
+        """分片自身 files 模式匹配的文件（相对路径，按模式顺序、模式内按路径排序）"""
+        found = []
+        for pattern in shard.files:
+            regex = _pattern_regex(pattern)
+            components = pattern.split('/')
+            fixed = []
+            for component in components[:-1]:
+                if '*' in component or '?' in component:
+                    break
+                fixed.append(component)
+            root = os.path.join(self.directory, *fixed)
+            if len(fixed) == len(components) - 1:
+                # 只有文件名部分含通配符，不需要遍历子目录
+                prefix = '/'.join(fixed)
+                try:
+                    names = sorted(entry.name for entry in os.scandir(root) if entry.is_file())
+                except OSError:
+                    continue
+                candidates = (f"{prefix}/{name}" if prefix else name for name in names if is_knowledge_file(name))
+            else:
+                candidates = iter_knowledge_files(root, self.directory) if os.path.isdir(root) else ()
+            found.extend(path for path in candidates if regex.match(path))
+        return found
+
+    def files(self, name):
+        """分片的全部文件的绝对路径（自身文件在前，include 的公共分片在后，去重）；分片不存在时返回 []"""
+        self.refresh()
+        shards = self._shards
+        if name not in shards:
+            return []
+        order, seen = [name], {name}
+        position = 0
+        while position < len(order):
+            for included in shards[order[position]].include:
+                if included not in seen:
+                    seen.add(included)
+                    order.append(included)
+            position += 1
+        paths, found = [], set()
+        for shard_name in order:
+            for relative in self._own_files(shards[shard_name]):
+                if relative not in found:
+                    found.add(relative)
+                    paths.append(os.path.join(self.directory, *relative.split('/')))
+        return paths
+
+    def owners(self, path):
+        """文件所属的分片（按 files 模式匹配，可能属于多个）"""
+        relative = os.path.relpath(path, self.directory).replace(os.sep, '/')
+        return {
+            name for name, shard in self._shards.items()
+            if any(_pattern_regex(pattern).match(relative) for pattern in shard.files)
+        }
+
+    def affected(self, paths):
+        """文件变化影响的司法辖区：文件所属的分片，以及直接或间接 include 了这些分片的司法辖区"""
+        self.refresh()
+        affected = set()
+        for path in paths:
+            affected |= self.owners(path)
+        grew = True
+        while grew:
+            grew = False
+            for name, shard in self._shards.items():
+                if name not in affected and affected.intersection(shard.include):
+                    affected.add(name)
+                    grew = True
+        return {name for name in affected if name in self._shards and not self._shards[name].shared}
+
+    def stats(self):
+        shards = list(self._shards.values())
+        return {
+            'directory': self.directory,
+            'manifest': self.manifest_path if self.source == 'manifest' else None,
+            'source': self.source,
+            'jurisdictions': sum(1 for shard in shards if not shard.shared),
+            'shared': [shard.name for shard in shards if shard.shared],
+            'preload': sum(1 for shard in shards if shard.preload and not shard.shared),
+            'error': self.error
+        }
+
+
+class ShardCache:
+    """已加载分片的LRU：分片名 -> 知识库快照
+
+    sizer(快照) 返回快照当前占用内存的估算（字节，含已构建的检索索引）。总量超过 max_bytes 时
+    从最久未用的分片开始淘汰；最近加载或访问的分片始终保留，即使它单独超过上限。
+    on_evict(分片名, 快照) 在淘汰后（锁外）调用，用于释放检索索引等关联数据。
+    正在处理的请求持有快照内容的引用，淘汰不影响这些请求。
+    """
+
+    def __init__(self, max_bytes, sizer, on_evict=None):
+        self.max_bytes = max_bytes
+        self._sizer = sizer
+        self._on_evict = on_evict
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def get(self, name):
+        """返回已加载的快照并标记为最近使用，未加载时返回None"""
+        with self._lock:
+            snapshot = self._entries.get(name)
+            if snapshot is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+            return snapshot
+
+    def peek(self, name):
+        """返回已加载的快照，不改变LRU顺序"""
+        return self._entries.get(name)
+
+    def put(self, name, snapshot):
+        """加入或替换分片快照，返回被淘汰的分片名"""
+        with self._lock:
+            self._entries[name] = snapshot
+            self._entries.move_to_end(name)
+            self.loads += 1
+        return self.enforce()
+
+    def pop(self, name):
+        with self._lock:
+            return self._entries.pop(name, None)
+
+    def items(self):
+        with self._lock:
+            return list(self._entries.items())
+
+    def names(self):
+        """已加载的分片名，最久未用的在前"""
+        with self._lock:
+            return list(self._entries)
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def total_bytes(self):
+        return sum(self._sizer(snapshot) for _, snapshot in self.items())
+
+    def enforce(self):
+        """按当前估算淘汰超出上限的分片（检索索引构建后调用，计入索引的内存），返回被淘汰的分片名"""
+        evicted = []
+        with self._lock:
+            sizes = OrderedDict((name, self._sizer(snapshot)) for name, snapshot in self._entries.items())
+            total = sum(sizes.values())
+            while total > self.max_bytes and len(self._entries) > 1:
+                name, snapshot = self._entries.popitem(last=False)
+                total -= sizes[name]
+                self.evictions += 1
+                self.evicted_bytes += sizes[name]
+                evicted.append((name, snapshot))
+        for name, snapshot in evicted:
+            if self._on_evict is not None:
+                self._on_evict(name, snapshot)
+        return [name for name, _ in evicted]
+
+    def stats(self):
+        entries = self.items()
+        sizes = {name: self._sizer(snapshot) for name, snapshot in entries}
+        total = self.hits + self.misses
+        return {
+            'loaded': [name for name, _ in entries],
+            'entries': len(entries),
+            'bytes': sum(sizes.values()),
+            'max_bytes': self.max_bytes,
+            'shard_bytes': sizes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'loads': self.loads,
+            'evictions': self.evictions,
+            'evicted_bytes': self.evicted_bytes
+        }
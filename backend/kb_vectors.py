@@ -0,0 +1,368 @@
+"""问题相关性打分 - 稀疏矩阵一次乘积计算多个问题对全部段落的得分
+
+每个知识库索引构建一次"段落 × 特征"稀疏矩阵（按特征列存储），一批问题向量与之相乘得到 问题数 × 段落数 的得分：
+- bm25：特征为检索词，矩阵元素为该词在段落中的 BM25 权重，与查询权重相乘求和即 BM25Index.search() 的得分
+- tfidf：特征为单词内字符 2-3 元组的哈希值（带符号的特征哈希，哈希种子固定，结果可复现），TF-IDF 加权后 L2 归一化，
+  得分为余弦相似度，不依赖分词，对未收录关键词的问题和外文法规也有效
+- hybrid：tfidf 与 bm25（含类别关键词加权）各自按最高分归一化后加权求和
+
+安装 numpy 时用向量化实现（一次 bincount 完成整批乘积），否则退回纯Python实现，两者结果相同。
+numpy 在首次构建矩阵时才导入（load_numpy），导入应用时不加载。
+同一索引上相同问题的候选段落只计算一次。
+"""
+import math
+import re
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict, defaultdict
+from itertools import chain
+
+np = None  # numpy 模块，由 load_numpy() 在首次构建矩阵时设置
+_numpy_loaded = False
+
+RETRIEVAL_MODES = ('bm25', 'tfidf', 'hybrid')
+
+DEFAULT_FEATURES = 1 << 20  # 矩阵只保存出现过的特征，哈希空间大小不影响内存
+DEFAULT_NGRAM_RANGE = (2, 3)
+DEFAULT_SEED = 0
+_QUERY_CACHE_SIZE = 256
+# 内存估算用的对象大小（CPython 64位）：特征到列号（或 idf）的字典条目；纯Python实现中每个矩阵元素的元组和浮点数；
+# 缓存的一个候选段落
+_FEATURE_BYTES = 90
+_ELEMENT_BYTES = 90
+_HIT_BYTES = 90
+_WORD_RE = re.compile(r'[^\W_]+')
+
+
+def load_numpy():
+    """导入 numpy 并返回；可选依赖，未安装时返回None（使用纯Python实现）"""
+    global np, _numpy_loaded
+    if not _numpy_loaded:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        np = numpy
+        _numpy_loaded = True
+    return np
+
+
+class HashedNgramVectorizer:
+    """字符 n 元组特征哈希：特征号为 crc32(n元组, seed) 的低位，符号取最高位，不需要保存词表"""
+
+    def __init__(self, n_features=DEFAULT_FEATURES, ngram_range=DEFAULT_NGRAM_RANGE, seed=DEFAULT_SEED):
+        if n_features & (n_features - 1):
+            raise ValueError('n_features 必须是2的幂')
+        self.n_features = n_features
+        self.ngram_range = ngram_range
+        self.seed = seed
+        self._mask = n_features - 1
+
+    def _feature(self, gram):
+        """带符号的特征号（+1 避免 0 无法带符号）"""
+        digest = zlib.crc32(gram.encode('utf-8'), self.seed)
+        feature = (digest & self._mask) + 1
+        return -feature if digest & 0x80000000 else feature
+
+    def counts_many(self, texts):
+        """返回每段文本的 {特征号: 带符号的出现次数}；同一批文本中重复的 n 元组只计算一次哈希"""
+        memo = {}
+        low, high = self.ngram_range
+        results = []
+        for text in texts:
+            # n 元组只取自单词内部（两端补空格标记词边界），标点、空白不产生特征
+            grams = Counter()
+            for word in _WORD_RE.findall(text.lower()):
+                word = f" {word} "
+                for n in range(low, high + 1):
+                    grams.update(word[i:i + n] for i in range(len(word) - n + 1))
+            counts = defaultdict(int)
+            for gram, count in grams.items():
+                feature = memo.get(gram)
+                if feature is None:
+                    feature = memo[gram] = self._feature(gram)
+                if feature > 0:
+                    counts[feature - 1] += count
+                else:
+                    counts[-feature - 1] -= count
+            # 正负抵消为0的特征视为未出现
+            results.append({feature: count for feature, count in counts.items() if count})
+        return results
+
+
+class SparseColumns:
+    """按特征列存储的 "文档 × 特征" 稀疏矩阵
+
+    columns: 可迭代的 (特征, [(文档号, 值), ...])
+    """
+
+    def __init__(self, columns, n_docs):
+        self.n_docs = n_docs
+        if np is None:
+            self._columns = {feature: postings for feature, postings in columns}
+            self.nnz = sum(len(postings) for postings in self._columns.values())
+            return
+        self._features = {}
+        counts, rows, values = [], [], []
+        for feature, postings in columns:
+            self._features[feature] = len(counts)
+            counts.append(len(postings))
+            for doc, value in postings:
+                rows.append(doc)
+                values.append(value)
+        self._set_arrays(counts, np.array(rows, dtype=np.int64), np.array(values, dtype=np.float64))
+
+    @classmethod
+    def from_arrays(cls, features, counts, rows, values, n_docs):
+        """由已按列排好的数组构建（需要 numpy）：features 为各列的特征，counts 为各列元素数"""
+        matrix = cls.__new__(cls)
+        matrix.n_docs = n_docs
+        matrix._features = {feature: column for column, feature in enumerate(features)}
+        matrix._set_arrays(counts, rows, values)
+        return matrix
+
+    def _set_arrays(self, counts, rows, values):
+        self._indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self._indptr[1:])
+        self._rows = rows
+        self._values = values
+        self.nnz = len(rows)
+
+    def memory_bytes(self):
+        """矩阵占用内存的估算（字节）"""
+        if np is None:
+            return self.nnz * _ELEMENT_BYTES + len(self._columns) * _FEATURE_BYTES
+        return (self._indptr.nbytes + self._rows.nbytes + self._values.nbytes
+                + len(self._features) * _FEATURE_BYTES)
+
+    def product(self, queries):
+        """queries: [{特征: 权重}, ...]
+
+        返回每个查询对每个文档的得分：numpy 时为 (查询数, 文档数) 数组，否则为 [{文档号: 得分}, ...]。
+        """
+        if np is None:
+            results = []
+            for query in queries:
+                scores = defaultdict(float)
+                for feature, weight in query.items():
+                    for doc, value in self._columns.get(feature, ()):
+                        scores[doc] += weight * value
+                results.append(scores)
+            return results
+
+        columns, weights, owners = [], [], []
+        for position, query in enumerate(queries):
+            for feature, weight in query.items():
+                column = self._features.get(feature)
+                if column is not None:
+                    columns.append(column)
+                    weights.append(weight)
+                    owners.append(position)
+        n = self.n_docs
+        if not columns:
+            return np.zeros((len(queries), n))
+        columns = np.array(columns, dtype=np.int64)
+        starts = self._indptr[columns]
+        lengths = self._indptr[columns + 1] - starts
+        # 选中各列的全部元素在 _rows/_values 中的位置
+        before = np.cumsum(lengths) - lengths
+        offsets = np.repeat(starts - before, lengths) + np.arange(int(lengths.sum()))
+        contributions = np.repeat(np.array(weights, dtype=np.float64), lengths) * self._values[offsets]
+        targets = np.repeat(np.array(owners, dtype=np.int64) * n, lengths) + self._rows[offsets]
+        return np.bincount(targets, weights=contributions, minlength=len(queries) * n).reshape(len(queries), n)
+
+
+def top_hits(scores, top_k):
+    """一个查询的得分中取前 top_k 个正分文档，返回 [(得分, 文档号)]（得分降序，相同时按文档号升序）"""
+    if np is not None and isinstance(scores, np.ndarray):
+        candidates = np.flatnonzero(scores > 0)
+        values = scores[candidates]
+        if len(candidates) > top_k:
+            # 先按第 top_k 大的得分筛选（保留并列项），再精确排序
+            threshold = np.partition(values, len(values) - top_k)[len(values) - top_k]
+            keep = values >= threshold
+            candidates, values = candidates[keep], values[keep]
+        order = np.lexsort((candidates, -values))[:top_k]
+        return [(float(values[i]), int(candidates[i])) for i in order]
+    ranked = sorted(((doc, score) for doc, score in scores.items() if score > 0), key=lambda item: (-item[1], item[0]))
+    return [(score, doc) for doc, score in ranked[:top_k]]
+
+
+def _normalized(scores):
+    """按最高分归一化到 [0, 1]"""
+    if np is not None and isinstance(scores, np.ndarray):
+        peak = scores.max(axis=1, keepdims=True) if scores.size else scores
+        return scores / np.where(peak > 0, peak, 1.0)
+    rows = []
+    for row in scores:
+        peak = max(row.values(), default=0.0)
+        rows.append({doc: score / peak for doc, score in row.items()} if peak > 0 else dict(row))
+    return rows
+
+
+def _blend(tfidf, bm25, weight):
+    if np is not None and isinstance(tfidf, np.ndarray):
+        return weight * tfidf + (1 - weight) * bm25
+    rows = []
+    for left, right in zip(tfidf, bm25):
+        row = defaultdict(float)
+        for doc, score in left.items():
+            row[doc] += weight * score
+        for doc, score in right.items():
+            row[doc] += (1 - weight) * score
+        rows.append(row)
+    return rows
+
+
+class RelevanceScorer:
+    """一个 BM25Index 上的问题相关性打分
+
+    mode: bm25 / tfidf / hybrid；hybrid_weight 为 hybrid 模式中 tfidf 得分的权重。
+    矩阵在首次使用时构建（构建期间其他线程等待同一次构建），之后只读。
+    """
+
+    def __init__(self, index, mode='bm25', hybrid_weight=0.5, n_features=DEFAULT_FEATURES, seed=DEFAULT_SEED):
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"未知的检索模式: {mode}")
+        self.index = index
+        self.mode = mode
+        self.hybrid_weight = hybrid_weight
+        self.vectorizer = HashedNgramVectorizer(n_features, seed=seed)
+        self._bm25 = None
+        self._tfidf = None
+        self._idf = None
+        self._build_lock = threading.Lock()
+        self._cache = OrderedDict()  # (问题原文, top_k) -> 候选段落
+        self._cache_lock = threading.Lock()
+        self.build_seconds = 0.0
+        self.batches = 0
+        self.scored_queries = 0
+        self.hits = 0
+
+    def build(self):
+        """构建打分所需的矩阵（首次打分时自动调用）；矩阵和得分的格式取决于此时能否导入 numpy"""
+        if (self._bm25 is not None or self.mode == 'tfidf') and (self._tfidf is not None or self.mode == 'bm25'):
+            return
+        with self._build_lock:
+            start = time.perf_counter()
+            load_numpy()
+            n = len(self.index.chunks)
+            if self._bm25 is None and self.mode != 'tfidf':
+                self._bm25 = SparseColumns(self.index.term_weights(), n)
+            if self._tfidf is None and self.mode != 'bm25':
+                self._tfidf = self._build_tfidf(n)
+            self.build_seconds += time.perf_counter() - start
+
+    def _build_tfidf(self, n):
+        rows = self.vectorizer.counts_many([self.index.chunk_text(i) for i in range(n)])
+        if np is not None:
+            return self._build_tfidf_arrays(rows, n)
+        df = Counter()
+        for counts in rows:
+            df.update(counts.keys())
+        # 平滑 idf，与常见 TF-IDF 实现一致
+        self._idf = {feature: math.log((1 + n) / (1 + count)) + 1 for feature, count in df.items()}
+        columns = defaultdict(list)
+        for doc, counts in enumerate(rows):
+            vector = self._weigh(counts)
+            for feature, value in vector.items():
+                columns[feature].append((doc, value))
+        return SparseColumns(columns.items(), n)
+
+    def _build_tfidf_arrays(self, rows, n):
+        """与 _weigh 相同的加权，整个矩阵一次用数组运算完成"""
+        sizes = np.fromiter((len(counts) for counts in rows), dtype=np.int64, count=len(rows))
+        total = int(sizes.sum())
+        docs = np.repeat(np.arange(len(rows), dtype=np.int64), sizes)
+        features = np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=total)
+        counts = np.fromiter(chain.from_iterable(counts.values() for counts in rows), dtype=np.float64, count=total)
+        unique, column, df = np.unique(features, return_inverse=True, return_counts=True)
+        idf = np.log((1 + n) / (1 + df)) + 1
+        self._idf = dict(zip(unique.tolist(), idf.tolist()))
+        values = np.sign(counts) * (1 + np.log(np.abs(counts))) * idf[column]
+        norms = np.sqrt(np.bincount(docs, weights=values * values, minlength=len(rows)))
+        values /= np.where(norms > 0, norms, 1.0)[docs]
+        order = np.argsort(column, kind='stable')
+        return SparseColumns.from_arrays(unique.tolist(), df, docs[order], values[order], n)
+
+    def _weigh(self, counts):
+        """次线性 TF × IDF，L2 归一化；不在语料中的特征忽略"""
+        vector = {}
+        for feature, count in counts.items():
+            idf = self._idf.get(feature)
+            if idf is None or count == 0:
+                continue
+            magnitude = 1 + math.log(abs(count))
+            vector[feature] = (magnitude if count > 0 else -magnitude) * idf
+        norm = sum(value * value for value in vector.values()) ** 0.5
+        return {feature: value / norm for feature, value in vector.items()} if norm else vector
+
+    def score(self, queries):
+        """queries: [(问题原文, 检索词权重), ...]，返回所有问题对全部段落的得分（格式见 SparseColumns.product）"""
+        self.build()
+        if self.mode == 'bm25':
+            return self._bm25.product([weights for _, weights in queries])
+        counts = self.vectorizer.counts_many([text for text, _ in queries])
+        tfidf = self._tfidf.product([self._weigh(row) for row in counts])
+        if self.mode == 'tfidf':
+            return tfidf
+        bm25 = self._bm25.product([weights for _, weights in queries])
+        return _blend(_normalized(tfidf), _normalized(bm25), self.hybrid_weight)
+
+    def search(self, queries, top_k=20):
+        """返回每个问题的候选段落 [[(得分, chunk_id), ...], ...]
+
+        缓存中没有的问题合并为一批，与矩阵做一次乘积。
+        """
+        results = [None] * len(queries)
+        missing = []
+        with self._cache_lock:
+            for position, (text, _) in enumerate(queries):
+                cached = self._cache.get((text, top_k))
+                if cached is None:
+                    missing.append(position)
+                else:
+                    self._cache.move_to_end((text, top_k))
+                    results[position] = cached
+            self.hits += len(queries) - len(missing)
+        if not missing:
+            return results
+
+        batch = [queries[position] for position in missing]
+        scores = self.score(batch)
+        with self._cache_lock:
+            self.batches += 1
+            self.scored_queries += len(batch)
+            for row, position in enumerate(missing):
+                hits = top_hits(scores[row], top_k)
+                results[position] = hits
+                self._cache[(queries[position][0], top_k)] = hits
+            while len(self._cache) > _QUERY_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return results
+
+    def memory_bytes(self):
+        """索引、已构建的矩阵和问题缓存占用内存的估算（字节）"""
+        total = self.index.memory_bytes() + len(self._idf or ()) * _FEATURE_BYTES
+        for matrix in (self._bm25, self._tfidf):
+            if matrix is not None:
+                total += matrix.memory_bytes()
+        with self._cache_lock:
+            total += sum(len(hits) for hits in self._cache.values()) * _HIT_BYTES
+        return total
+
+    def stats(self):
+        with self._cache_lock:
+            return {
+                'mode': self.mode,
+                'numpy': load_numpy() is not None,
+                'chunks': len(self.index.chunks),
+                'bm25_nnz': self._bm25.nnz if self._bm25 is not None else None,
+                'tfidf_nnz': self._tfidf.nnz if self._tfidf is not None else None,
+                'build_seconds': round(self.build_seconds, 3),
+                'batches': self.batches,
+                'scored_queries': self.scored_queries,
+                'cache_hits': self.hits,
+                'cached_queries': len(self._cache)
+            }
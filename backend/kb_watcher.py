@@ -0,0 +1,135 @@
+"""知识库目录监视 - 轮询文件签名，发现新增、修改、删除的文件后回调重新加载
+
+使用轮询而不是 inotify：不依赖额外的系统库，在容器和网络文件系统上同样可用。
+每次扫描只对目录做一次 stat，变化集合交给回调处理，回调耗时记为一次重新加载的耗时。
+扫描范围可以由调用方指定（如只扫描已加载分片的文件），默认为目录顶层的知识库文件。
+"""
+import os
+import threading
+import time
+from collections import namedtuple
+
+from backend.kb_cache import file_signature
+
+KNOWLEDGE_EXTENSIONS = ('.txt', '.docx')
+
+# 一次扫描发现的变化：{路径: 签名}（新增、修改）与 [路径]（删除）
+KnowledgeChanges = namedtuple('KnowledgeChanges', ['added', 'changed', 'removed'])
+
+
+def scan_directory(directory):
+    """返回目录下所有知识库文件的 {路径: (mtime_ns, size)}；Word临时文件（~$开头）不计入"""
+    signatures = {}
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return signatures
+    for entry in entries:
+        name = entry.name
+        if name.startswith('~$') or not name.endswith(KNOWLEDGE_EXTENSIONS) or not entry.is_file():
+            continue
+        signature = file_signature(entry.path)
+        if signature is not None:
+            signatures[entry.path] = signature
+    return signatures
+
+
+def diff_signatures(previous, current):
+    added = {path: sig for path, sig in current.items() if path not in previous}
+    changed = {path: sig for path, sig in current.items() if path in previous and previous[path] != sig}
+    removed = [path for path in previous if path not in current]
+    return KnowledgeChanges(added, changed, removed)
+
+
+class KnowledgeWatcher:
+    """后台轮询线程
+
+    on_change(changes) 在监视线程中调用，负责重新解析、重建索引并替换快照；
+    回调抛出的异常会被记录，下一轮仍以新的签名为准继续监视。
+    baseline 为已加载内容对应的 {路径: 签名}（如 fork 前预加载的快照），
+    与当前目录不一致的文件在第一轮扫描时即被当作变化处理；不传时以启动时的扫描结果为基准。
+    scan() 返回要监视的 {路径: 签名}，默认为 scan_directory(directory)。
+    """
+
+    def __init__(self, directory, on_change, interval=2.0, baseline=None, scan=None):
+        self.directory = directory
+        self.on_change = on_change
+        self.interval = interval
+        self._scan = scan or (lambda: scan_directory(directory))
+        self._signatures = dict(baseline) if baseline is not None else self._scan()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.scans = 0
+        self.reloads = 0
+        self.errors = 0
+        self.last_reload_at = None
+        self.last_reload_duration = None
+        self.last_changes = None
+        self.last_error = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='kb-watcher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    def poll(self):
+        """扫描一次目录，有变化时调用回调；返回本次发现的变化（无变化时返回None）"""
+        current = self._scan()
+        with self._lock:
+            self.scans += 1
+            changes = diff_signatures(self._signatures, current)
+            self._signatures = current
+        if not (changes.added or changes.changed or changes.removed):
+            return None
+
+        start = time.perf_counter()
+        try:
+            self.on_change(changes)
+        except Exception as e:
+            print(f"知识库重新加载失败: {e}")
+            with self._lock:
+                self.errors += 1
+                self.last_error = str(e)
+            return changes
+        duration = time.perf_counter() - start
+
+        with self._lock:
+            self.reloads += 1
+            self.last_reload_at = time.time()
+            self.last_reload_duration = duration
+            self.last_changes = {
+                'added': sorted(os.path.basename(path) for path in changes.added),
+                'changed': sorted(os.path.basename(path) for path in changes.changed),
+                'removed': sorted(os.path.basename(path) for path in changes.removed)
+            }
+        return changes
+
+    def stats(self):
+        with self._lock:
+            return {
+                'directory': self.directory,
+                'interval': self.interval,
+                'running': self.running,
+                'files': len(self._signatures),
+                'scans': self.scans,
+                'reloads': self.reloads,
+                'errors': self.errors,
+                'last_reload_at': self.last_reload_at,
+                'last_reload_duration': round(self.last_reload_duration, 4)
+                if self.last_reload_duration is not None else None,
+                'last_changes': self.last_changes,
+                'last_error': self.last_error
+            }
@@ -0,0 +1,227 @@
+"""Prometheus 文本格式指标 - 计数器、仪表和直方图
+
+不依赖 prometheus_client：指标数量少、只需要文本导出，自带实现足够且没有额外依赖。
+每个指标一把锁，记录一次只是几次字典查找和加法；指标按进程独立，多 worker 部署时由 Prometheus 按实例汇总。
+"""
+import bisect
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 覆盖从毫秒级的检索到分钟级的AI调用
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_samples(items))
+        return lines
+
+    def _render_samples(self, items):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}' for key, value in items]
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # [各桶计数(不累计)..., +Inf桶, 总和]
+                entry = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[index] += 1
+            entry[-1] += value
+
+    def count(self, **labels):
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return sum(entry[:-1]) if entry else 0
+
+    def _render_samples(self, items):
+        lines = []
+        for key, entry in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), entry[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(float(bound))))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(entry[-1])}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Registry:
+    """指标注册表，按注册顺序导出"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if any(existing.name == metric.name for existing in self._metrics):
+                raise ValueError(f"指标 {metric.name} 已注册")
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# 进程级默认注册表和应用指标
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    'legal_research_stage_seconds',
+    '各处理阶段耗时（kb_load/extract/llm_request/report_build/docx_build/docx_save）',
+    ['stage']
+)
+HTTP_REQUESTS = registry.counter(
+    'legal_research_http_requests_total', 'HTTP请求数', ['endpoint', 'method', 'status']
+)
+HTTP_REQUEST_SECONDS = registry.histogram(
+    'legal_research_http_request_seconds', 'HTTP请求处理耗时（流式响应只计到开始输出）', ['endpoint']
+)
+QUESTIONS = registry.counter(
+    'legal_research_questions_total', '已回答的问题数', ['jurisdiction', 'mode']
+)
+QUESTIONS_IN_FLIGHT = registry.gauge(
+    'legal_research_questions_in_flight', '正在处理的问题数（接近并发上限说明线程池已饱和）'
+)
+ANSWER_CACHE_LOOKUPS = registry.counter(
+    'legal_research_answer_cache_lookups_total', '答案缓存查询次数', ['jurisdiction', 'result']
+)
+LLM_ATTEMPTS = registry.counter(
+    'legal_research_llm_attempts_total', 'AI调用尝试次数（含重试）', ['mode', 'outcome']
+)
+LLM_RETRIES = registry.counter(
+    'legal_research_llm_retries_total', '触发重试的失败次数，按异常类型', ['reason']
+)
+LLM_IN_FLIGHT = registry.gauge(
+    'legal_research_llm_requests_in_flight', '正在进行的AI请求数'
+)
+COALESCED = registry.counter(
+    'legal_research_coalesced_total', '等待相同的进行中工作而未重复执行的次数（question/answer/batch/knowledge/index）', ['kind']
+)
+UPSTREAM_CONCURRENCY_LIMIT = registry.gauge(
+    'legal_research_upstream_concurrency_limit', 'Deepseek 自适应并发上限（过载时减半，成功后逐步恢复）'
+)
+UPSTREAM_CIRCUIT_STATE = registry.gauge(
+    'legal_research_upstream_circuit_state', 'Deepseek 熔断器状态（0=关闭，1=半开，2=打开）'
+)
+UPSTREAM_CIRCUIT_TRANSITIONS = registry.counter(
+    'legal_research_upstream_circuit_transitions_total', '熔断器状态切换次数，按切换后的状态', ['state']
+)
+UPSTREAM_REJECTIONS = registry.counter(
+    'legal_research_upstream_rejections_total', '未发送即失败的AI调用（circuit_open/limit_timeout/retry_after）', ['reason']
+)
+KB_SHARDS_LOADED = registry.gauge(
+    'legal_research_kb_shards_loaded', '内存中已加载的知识库分片（司法辖区）数'
+)
+KB_SHARD_BYTES = registry.gauge(
+    'legal_research_kb_shard_bytes', '已加载分片（内容、条文记录和检索索引）占用内存的估算（字节）'
+)
+KB_SHARD_EVICTIONS = registry.counter(
+    'legal_research_kb_shard_evictions_total', '超出 KB_SHARD_MEMORY_MB 而被淘汰的分片数'
+)
+ERRORS = registry.counter(
+    'legal_research_errors_total', '以错误信息作为答案返回的问题数', ['jurisdiction', 'kind']
+)
@@ -0,0 +1,118 @@
+"""分阶段耗时统计 - 知识库加载、内容筛选、AI调用、Word生成等各阶段的累计耗时"""
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from backend.profiling import span
+
+
+class StageTimer:
+    """线程安全的分阶段耗时累加器"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}  # name -> [count, total, max]
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """注册回调 listener(name, seconds)，每次记录阶段耗时时调用（如导出到指标直方图）"""
+        self._listeners.append(listener)
+
+    def record(self, name, seconds):
+        with self._lock:
+            entry = self._stages.get(name)
+            if entry is None:
+                self._stages[name] = [1, seconds, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                if seconds > entry[2]:
+                    entry[2] = seconds
+        for listener in self._listeners:
+            listener(name, seconds)
+
+    @contextmanager
+    def stage(self, name):
+        """记录一个阶段的耗时；请求开启剖析时同时写入该请求的耗时树"""
+        start = time.perf_counter()
+        try:
+            with span(name):
+                yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        """函数装饰器：每次调用计入指定阶段"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        """返回 {阶段: {'count', 'total', 'avg', 'max'}}"""
+        with self._lock:
+            return {
+                name: {
+                    'count': count,
+                    'total': round(total, 6),
+                    'avg': round(total / count, 6) if count else 0.0,
+                    'max': round(maximum, 6)
+                }
+                for name, (count, total, maximum) in self._stages.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+
+# 进程级默认实例
+stage_timer = StageTimer()
+stage = stage_timer.stage
+timed = stage_timer.timed
+
+
+class UsageTracker:
+    """按调用模式（逐题/批量）统计AI调用次数、token用量和耗时，用于比较两种模式的开销"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._modes = {}
+
+    def record(self, mode, usage, seconds, questions=1):
+        usage = usage or {}
+        with self._lock:
+            entry = self._modes.setdefault(mode, {
+                'calls': 0, 'questions': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'seconds': 0.0
+            })
+            entry['calls'] += 1
+            entry['questions'] += questions
+            entry['prompt_tokens'] += int(usage.get('prompt_tokens') or 0)
+            entry['completion_tokens'] += int(usage.get('completion_tokens') or 0)
+            entry['seconds'] += seconds
+
+    def snapshot(self):
+        """返回各模式的累计值以及每个问题的平均token数和耗时"""
+        with self._lock:
+            result = {}
+            for mode, entry in self._modes.items():
+                questions = entry['questions'] or 1
+                result[mode] = dict(
+                    entry,
+                    seconds=round(entry['seconds'], 3),
+                    prompt_tokens_per_question=round(entry['prompt_tokens'] / questions, 1),
+                    completion_tokens_per_question=round(entry['completion_tokens'] / questions, 1),
+                    seconds_per_question=round(entry['seconds'] / questions, 3)
+                )
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._modes.clear()
+
+
+llm_usage = UsageTracker()
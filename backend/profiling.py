@@ -0,0 +1,312 @@
+"""按请求开启的性能剖析 - 阶段耗时树、Server-Timing 头和可选的剖析转储
+
+请求带 X-Profile 头或 ?profile= 参数时，当前请求的所有阶段（perf.stage）和问题处理都记录为一棵耗时树；
+还可以对请求线程和它提交到线程池的任务做剖析，结果写入本地目录：
+- sample：采样剖析，后台线程定时读取这些线程的调用栈，按折叠栈计数（flamegraph/speedscope 格式）
+- cprofile：确定性剖析（cProfile），各线程的结果合并为 pstats 文件
+
+同一进程同时只做一个转储（其余请求只记录耗时树），目录中只保留最近 max_dumps 个文件。
+未开启时 span() 只做一次 ContextVar 读取，没有其他开销。
+"""
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+DUMP_MODES = ('sample', 'cprofile')
+_DUMP_SUFFIXES = {'sample': '.folded', 'cprofile': '.prof'}
+
+# (RequestProfile, 当前 TimingNode)，未开启剖析时为 None
+_current = ContextVar('legal_research_profile', default=None)
+# 正在做转储的请求数上限：cProfile 和采样都会拖慢整个进程，同时只允许一个
+_dump_slot = threading.Semaphore(1)
+
+
+class TimingNode:
+    __slots__ = ('name', 'attrs', 'start', 'end', 'children')
+
+    def __init__(self, name, attrs=None):
+        self.name = name
+        self.attrs = attrs or {}
+        self.start = time.perf_counter()
+        self.end = None
+        self.children = []
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def to_dict(self, origin):
+        node = {
+            'name': self.name,
+            'start_ms': round((self.start - origin) * 1000, 3),
+            'duration_ms': round(self.duration * 1000, 3)
+        }
+        node.update(self.attrs)
+        if self.end is None:
+            node['unfinished'] = True
+        if self.children:
+            node['children'] = [
+                child.to_dict(origin) for child in sorted(self.children, key=lambda c: c.start)
+            ]
+        return node
+
+
+class StackSampler:
+    """采样剖析：后台线程每隔 interval 秒读取已登记线程的调用栈，按折叠栈计数"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._threads = {}  # 线程 ident -> 登记次数
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def add_thread(self, ident):
+        with self._lock:
+            self._threads[ident] = self._threads.get(ident, 0) + 1
+
+    def remove_thread(self, ident):
+        with self._lock:
+            count = self._threads.pop(ident, 0) - 1
+            if count > 0:
+                self._threads[ident] = count
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            with self._lock:
+                idents = list(self._threads)
+            frames = sys._current_frames()
+            for ident in idents:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+                self.samples += 1
+
+    def dump(self, path):
+        """写出折叠栈：每行 "栈帧;栈帧;... 次数"，可直接用 flamegraph.pl 或 speedscope 打开"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _rotate_dumps(directory, keep):
+    """只保留目录中最近的 keep 个转储文件"""
+    try:
+        entries = [entry for entry in os.scandir(directory)
+                   if entry.is_file() and entry.name.endswith(tuple(_DUMP_SUFFIXES.values()))]
+    except OSError:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime_ns, reverse=True)
+    for entry in entries[keep:]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+class RequestProfile:
+    """单个请求的剖析数据
+
+    dump 为 DUMP_MODES 之一时在 dump_dir 中写转储；已有其他请求在转储时只记录耗时树（dump_skipped）。
+    """
+
+    def __init__(self, name, dump=None, dump_dir=None, max_dumps=20, sample_interval=0.005):
+        self.root = TimingNode(name)
+        self.dump = dump if dump in DUMP_MODES and dump_dir else None
+        self.dump_dir = dump_dir
+        self.max_dumps = max_dumps
+        self.sample_interval = sample_interval
+        self.dump_id = None
+        self.dump_skipped = False
+        self._profiles = []  # 已结束的 cProfile.Profile
+        self._sampler = None
+        self._holds_slot = False
+        self._lock = threading.Lock()
+        self._token = None
+        self._profiler = None
+
+    def activate(self):
+        """在当前线程开启剖析（请求开始时调用）"""
+        if self.dump is not None:
+            if _dump_slot.acquire(blocking=False):
+                self._holds_slot = True
+                if self.dump == 'sample':
+                    self._sampler = StackSampler(self.sample_interval)
+                    self._sampler.start()
+            else:
+                self.dump = None
+                self.dump_skipped = True
+        self._token = _current.set((self, self.root))
+        self._profiler = self.start_profiler()
+
+    def deactivate(self):
+        if self._token is not None:
+            _current.reset(self._token)
+            self._token = None
+
+    def start_profiler(self):
+        """在当前线程开始转储剖析，返回交给 stop_profiler 的句柄"""
+        sampler = self._sampler
+        if sampler is not None:
+            ident = threading.get_ident()
+            sampler.add_thread(ident)
+            return sampler, ident
+        if self.dump != 'cprofile' or self.root.end is not None:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # 同一线程已有其他剖析器在运行
+            return None
+        return profiler
+
+    def stop_profiler(self, handle):
+        if handle is None:
+            return
+        if isinstance(handle, tuple):
+            sampler, ident = handle
+            sampler.remove_thread(ident)
+            return
+        handle.disable()
+        with self._lock:
+            self._profiles.append(handle)
+
+    def finish(self):
+        """结束剖析；开启了转储时写入 dump_dir，返回转储ID（文件名）"""
+        if self.root.end is not None:
+            return self.dump_id
+        self.root.end = time.perf_counter()
+        self.stop_profiler(self._profiler)
+        self._profiler = None
+        if not self._holds_slot:
+            return None
+        try:
+            self._write_dump()
+        finally:
+            self._holds_slot = False
+            _dump_slot.release()
+        return self.dump_id
+
+    def _write_dump(self):
+        sampler, self._sampler = self._sampler, None
+        if sampler is not None:
+            sampler.stop()
+            if not sampler.samples:
+                return
+        with self._lock:
+            profiles = list(self._profiles)
+        if sampler is None and not profiles:
+            return
+        os.makedirs(self.dump_dir, exist_ok=True)
+        dump_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{self.root.name}-{uuid.uuid4().hex[:8]}{_DUMP_SUFFIXES[self.dump]}"
+        path = os.path.join(self.dump_dir, dump_id)
+        if sampler is not None:
+            sampler.dump(path)
+        else:
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(path)
+        self.dump_id = dump_id
+        _rotate_dumps(self.dump_dir, self.max_dumps)
+
+    def totals(self):
+        """按阶段名汇总耗时：{name: [次数, 总秒数]}（同一阶段在多个线程中并行时累加）"""
+        totals = {}
+        stack = list(self.root.children)
+        while stack:
+            node = stack.pop()
+            entry = totals.setdefault(node.name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += node.duration
+            stack.extend(node.children)
+        return totals
+
+    def server_timing(self):
+        """生成 Server-Timing 头的值"""
+        parts = [f'total;dur={self.root.duration * 1000:.1f}']
+        for name, (count, seconds) in sorted(self.totals().items()):
+            parts.append(f'{name};dur={seconds * 1000:.1f};desc="x{count}"')
+        return ', '.join(parts)
+
+    def to_dict(self):
+        data = {
+            'total_ms': round(self.root.duration * 1000, 3),
+            'stages': {
+                name: {'count': count, 'total_ms': round(seconds * 1000, 3)}
+                for name, (count, seconds) in sorted(self.totals().items())
+            },
+            'tree': self.root.to_dict(self.root.start)
+        }
+        if self.dump_id:
+            data['dump'] = self.dump_id
+        elif self.dump_skipped:
+            data['dump_skipped'] = 'busy'
+        return data
+
+
+def current_profile():
+    current = _current.get()
+    return current[0] if current is not None else None
+
+
+@contextmanager
+def span(name, **attrs):
+    """在当前剖析树下记录一个子节点；未开启剖析时不做任何事"""
+    current = _current.get()
+    if current is None:
+        yield
+        return
+    profile, parent = current
+    node = TimingNode(name, attrs)
+    parent.children.append(node)
+    token = _current.set((profile, node))
+    try:
+        yield
+    finally:
+        node.end = time.perf_counter()
+        _current.reset(token)
+
+
+def bind(func):
+    """把当前剖析上下文带到线程池任务中（ThreadPoolExecutor 不会复制 ContextVar）
+
+    未开启剖析时原样返回 func。
+    """
+    current = _current.get()
+    if current is None:
+        return func
+    profile = current[0]
+
+    def bound(*args, **kwargs):
+        token = _current.set(current)
+        profiler = profile.start_profiler()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.stop_profiler(profiler)
+            _current.reset(token)
+    return bound
@@ -0,0 +1,150 @@
+"""合并相同的并发工作（single-flight）
+
+同一个键同时只执行一次：第一个调用者执行，其余调用者等待同一个 Future 并得到相同的结果或异常。
+只合并正在进行的工作，执行结束后立即移除，结果不在这里缓存（缓存由答案缓存、知识库快照负责）。
+
+- do()：在调用线程中执行或阻塞等待，用于知识库加载、索引构建和AI调用
+- share()：合并提交到线程池的任务，等待者拿到与任务绑定的 Future，不占用线程池线程
+"""
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from backend import metrics
+from backend.perf import stage
+
+
+class SingleFlight:
+    """按键合并并发调用；enabled 为 False 时每次都直接执行"""
+
+    def __init__(self, name, enabled=True):
+        self.name = name
+        self.enabled = enabled
+        self._calls = {}  # key -> Future
+        self._shared = {}  # key -> [任务 Future, 未取消的调用者数]
+        # 可重入：取消任务时同步执行的回调会再次获取这把锁
+        self._lock = threading.RLock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def do(self, key, fn, timeout=None):
+        """执行 fn() 或等待正在执行的同键调用，返回其结果
+
+        等待者超过 timeout 秒时抛出 concurrent.futures.TimeoutError（执行者不受影响，继续运行）；
+        执行者抛出的异常原样传给所有等待者。
+        """
+        if not self.enabled:
+            return fn()
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            metrics.COALESCED.inc(kind=self.name)
+            try:
+                with stage('coalesced_wait'):
+                    return future.result(timeout)
+            except FutureTimeoutError:
+                with self._lock:
+                    self.timeouts += 1
+                raise
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, future)
+            future.set_exception(e)
+            raise
+        self._finish(key, future)
+        future.set_result(result)
+        return result
+
+    def share(self, key, start, join=None):
+        """返回与同键进行中任务绑定的新 Future；没有进行中的任务时调用 start() 提交并返回其 Future
+
+        每个调用者得到自己的 Future：取消它只影响该调用者，全部调用者都取消后才取消任务
+        （已开始的任务是否响应取消由任务 Future 自己决定）。
+        join(任务 Future) 对每个调用者（包括提交者）调用一次，可用于订阅任务的中间输出。
+        """
+        if not self.enabled:
+            source = start()
+            if join is not None:
+                join(source)
+            return source
+        with self._lock:
+            entry = self._shared.get(key)
+            leader = entry is None
+            if leader:
+                entry = self._shared[key] = [start(), 0]
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+            entry[1] += 1
+            source = entry[0]
+        if join is not None:
+            join(source)
+        if leader:
+            source.add_done_callback(lambda done: self._unshare(key, done))
+        else:
+            metrics.COALESCED.inc(kind=self.name)
+
+        proxy = Future()
+        source.add_done_callback(lambda done: _forward(done, proxy))
+        proxy.add_done_callback(lambda done: self._release_consumer(key, source, done))
+        return proxy
+
+    def _unshare(self, key, source):
+        with self._lock:
+            entry = self._shared.get(key)
+            if entry is not None and entry[0] is source:
+                del self._shared[key]
+
+    def _release_consumer(self, key, source, proxy):
+        if not proxy.cancelled():
+            return
+        with self._lock:
+            entry = self._shared.get(key)
+            if entry is None or entry[0] is not source:
+                return
+            entry[1] -= 1
+            if entry[1] == 0:
+                # 没有调用者需要这个结果了：取消任务，之后的调用者重新提交而不是加入被放弃的任务。
+                # 在锁内取消，避免新的调用者恰好加入到被取消的任务上
+                source.cancel()
+                if self._shared.get(key) is entry:
+                    del self._shared[key]
+
+    def _finish(self, key, future):
+        # 先移除再设置结果：之后到达的调用者开始新的一次执行，不会拿到已结束的调用
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'in_flight': len(self._calls) + len(self._shared),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'timeouts': self.timeouts
+            }
+
+
+def _forward(source, target):
+    """把任务的结果或异常转交给调用者的 Future；调用者已取消时忽略"""
+    if source.cancelled():
+        target.cancel()
+        return
+    if not target.set_running_or_notify_cancel():
+        return
+    exception = source.exception()
+    if exception is not None:
+        target.set_exception(exception)
+    else:
+        target.set_result(source.result())
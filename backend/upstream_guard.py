@@ -0,0 +1,244 @@
+"""Deepseek 上游保护 - 自适应并发上限(AIMD)、熔断器和带抖动的退避
+
+- 并发上限：每次成功加 1/上限（满并发时约每轮加1），429/5xx/超时时减半；
+  同一轮中并发的多个失败只减一次（只有在上次减半之后发出的请求才会再次触发减半）
+- 熔断器：连续失败达到阈值后打开，打开期间直接失败不发请求；reset_timeout 后放行一个探测请求，
+  探测成功则关闭，失败则重新打开
+- 退避：指数退避，在当前上限的一半到上限之间随机取值；带 Retry-After 时按其等待，
+  超过退避上限则不再重试，避免长时间占用请求线程
+
+不依赖 requests：调用方把响应状态码或异常归类为下面的结果类型后交给 release()。
+"""
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from backend import metrics
+
+# 一次调用的结果类型
+OUTCOME_OK = 'ok'
+OUTCOME_RATE_LIMITED = 'rate_limited'  # 429：上游存活但在限流
+OUTCOME_UNAVAILABLE = 'unavailable'    # 5xx、超时、连接失败
+OUTCOME_CLIENT_ERROR = 'client_error'  # 其他4xx：请求本身有问题，重试无意义
+OUTCOME_INVALID = 'invalid'            # 响应无法解析等，与上游健康状况无关
+
+CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN, CIRCUIT_OPEN = 'closed', 'half_open', 'open'
+# legal_research_upstream_circuit_state 的取值
+CIRCUIT_STATE_VALUES = {CIRCUIT_CLOSED: 0, CIRCUIT_HALF_OPEN: 1, CIRCUIT_OPEN: 2}
+
+
+class UpstreamUnavailable(Exception):
+    """熔断器打开或等待并发名额超时，请求未发送"""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+def classify_status(status_code):
+    """把HTTP错误状态码归类为结果类型"""
+    if status_code == 429:
+        return OUTCOME_RATE_LIMITED
+    if status_code >= 500 or status_code == 408:
+        return OUTCOME_UNAVAILABLE
+    return OUTCOME_CLIENT_ERROR
+
+
+def parse_retry_after(value):
+    """解析 Retry-After 头（秒数或HTTP日期），返回秒数；无法解析时返回None"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class AdaptiveLimiter:
+    """AIMD 并发上限；acquire() 返回的许可需要交还给 release()"""
+
+    def __init__(self, max_limit, min_limit=1, decrease=0.5):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.decrease = decrease
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self.increases = 0
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        metrics.UPSTREAM_CONCURRENCY_LIMIT.set(self.max_limit)
+
+    def acquire(self, timeout=None):
+        """等待并发名额，返回许可（发出时间）；超时返回None"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, permit, outcome):
+        with self._cond:
+            self.in_flight -= 1
+            if outcome == OUTCOME_OK:
+                if self.limit < self.max_limit:
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                    self.increases += 1
+            elif outcome in (OUTCOME_RATE_LIMITED, OUTCOME_UNAVAILABLE) and permit > self._last_decrease:
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+                self._last_decrease = time.monotonic()
+                self.decreases += 1
+            metrics.UPSTREAM_CONCURRENCY_LIMIT.set(int(self.limit))
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'limit': int(self.limit),
+                'max_limit': self.max_limit,
+                'min_limit': self.min_limit,
+                'in_flight': self.in_flight,
+                'increases': self.increases,
+                'decreases': self.decreases
+            }
+
+
+class CircuitBreaker:
+    """连续失败计数熔断器；半开状态同一时间只放行一个探测请求"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.transitions = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        metrics.UPSTREAM_CIRCUIT_STATE.set(CIRCUIT_STATE_VALUES[self.state])
+
+    def _transition(self, state):
+        if state == self.state:
+            return
+        print(f"Deepseek 熔断器: {self.state} -> {state}")
+        self.state = state
+        self.transitions += 1
+        if state == CIRCUIT_OPEN:
+            self.opened_at = time.monotonic()
+        self._probe_in_flight = False
+        metrics.UPSTREAM_CIRCUIT_STATE.set(CIRCUIT_STATE_VALUES[state])
+        metrics.UPSTREAM_CIRCUIT_TRANSITIONS.inc(state=state)
+
+    def allow(self):
+        """是否放行请求；打开状态超过 reset_timeout 后转为半开并放行一个探测请求"""
+        with self._lock:
+            if self.state == CIRCUIT_OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self._transition(CIRCUIT_HALF_OPEN)
+            if self.state == CIRCUIT_HALF_OPEN:
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def retry_in(self):
+        """距离下次探测的秒数"""
+        with self._lock:
+            if self.state != CIRCUIT_OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record(self, outcome):
+        with self._lock:
+            if outcome == OUTCOME_UNAVAILABLE:
+                self.failures += 1
+                if self.state == CIRCUIT_HALF_OPEN or self.failures >= self.failure_threshold:
+                    self._transition(CIRCUIT_OPEN)
+            elif outcome == OUTCOME_INVALID:
+                # 与上游健康无关：半开时让出探测名额，由下一个请求继续探测
+                self._probe_in_flight = False
+            else:
+                # 有响应（含429和4xx）即说明上游可达
+                self.failures = 0
+                self._transition(CIRCUIT_CLOSED)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'failure_threshold': self.failure_threshold,
+                'reset_timeout': self.reset_timeout,
+                'transitions': self.transitions
+            }
+
+
+class UpstreamGuard:
+    """并发上限 + 熔断器 + 退避策略
+
+    用法：
+        permit = guard.acquire()           # 熔断或等待超时时抛出 UpstreamUnavailable
+        try:
+            ...发送请求，得到 outcome...
+        finally:
+            guard.release(permit, outcome)
+    """
+
+    def __init__(self, max_in_flight=8, min_in_flight=1, acquire_timeout=30.0,
+                 failure_threshold=5, reset_timeout=30.0, backoff_base=1.0, backoff_max=10.0):
+        self.limiter = AdaptiveLimiter(max_in_flight, min_in_flight)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.acquire_timeout = acquire_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.random = random.Random()
+
+    def acquire(self):
+        if not self.breaker.allow():
+            metrics.UPSTREAM_REJECTIONS.inc(reason='circuit_open')
+            raise UpstreamUnavailable(
+                'circuit_open', f"熔断器已打开，{self.breaker.retry_in():.0f}秒后探测恢复"
+            )
+        permit = self.limiter.acquire(self.acquire_timeout)
+        if permit is None:
+            # 没有发出请求：半开时让出探测名额
+            self.breaker.record(OUTCOME_INVALID)
+            metrics.UPSTREAM_REJECTIONS.inc(reason='limit_timeout')
+            raise UpstreamUnavailable(
+                'limit_timeout', f"等待并发名额超过 {self.acquire_timeout:.0f} 秒"
+            )
+        return permit
+
+    def release(self, permit, outcome):
+        self.limiter.release(permit, outcome)
+        self.breaker.record(outcome)
+
+    def backoff_delay(self, attempt, retry_after=None):
+        """第 attempt 次重试前的等待秒数；Retry-After 超过 backoff_max 时返回None（不再重试）"""
+        if retry_after is not None:
+            if retry_after > self.backoff_max:
+                return None
+            # 在 Retry-After 基础上加少量抖动，避免被限流的请求同时重试
+            return retry_after + self.random.uniform(0, min(self.backoff_base, self.backoff_max - retry_after))
+        cap = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        return self.random.uniform(cap / 2, cap)
+
+    def stats(self):
+        return {
+            'limiter': self.limiter.stats(),
+            'circuit': self.breaker.stats(),
+            'acquire_timeout': self.acquire_timeout,
+            'backoff_base': self.backoff_base,
+            'backoff_max': self.backoff_max
+        }
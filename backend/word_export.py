@@ -0,0 +1,251 @@
+"""Word报告导出 - 预构建模板 + 渲染结果缓存
+
+标题、副标题、分隔线、页脚和样式表在模板中只构建一次。每次导出只复制正文 XML、填入报告内容，
+再把新的 word/document.xml 追加到预先打包好的静态部件（样式、主题、设置等）zip 中，
+不再重复解析默认模板，也不再重复压缩不变的部件。
+
+缓存的是填好报告内容的 document.xml，生成时间留作占位符：每次下载只替换生成时间并打包，
+同一份报告重复下载时文档中的生成时间与文件名一致，而不是首次渲染的时间。
+render_report_body 是模块级函数，可以直接提交到进程池执行。
+python-docx 在首次构建模板时才导入，只用到缓存的进程（如只处理检索请求的 worker）不需要加载它。
+"""
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+from datetime import datetime
+from io import BytesIO
+
+from backend.perf import stage
+
+REPORT_TITLE = '出海目标国数据隐私准入法律检索报告'
+FOOTER_TEXT = '本报告由法律法规检索应用自动生成'
+DOCUMENT_PART = 'word/document.xml'
+DOCX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+# 模板中生成时间段落的占位符，打包时替换为下载时间；位于报告正文之前，替换第一处即可
+GENERATED_AT_MARK = '@@generated_at@@'
+GENERATED_AT_FORMAT = '%Y年%m月%d日 %H:%M:%S'
+
+# 司法辖区章节标题，如 "(一) 英国"
+SECTION_HEADING_RE = re.compile(r'^\([一二三四五六七八九十]+\) ')
+
+
+def _without_entry(package, name):
+    """返回去掉指定部件后的 zip 字节"""
+    output = BytesIO()
+    with zipfile.ZipFile(BytesIO(package)) as source, \
+            zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as target:
+        for info in source.infolist():
+            if info.filename != name:
+                target.writestr(info, source.read(info.filename))
+    return output.getvalue()
+
+
+class ReportTemplate:
+    """报告模板：固定内容和样式只构建一次，clone() 得到可独立填充的正文"""
+
+    # 模板正文中各段落的位置
+    SUBTITLE, GENERATED_AT, CONTENT_ANCHOR = 1, 2, 4
+    # 报告正文用到的段落样式
+    STYLES = ('Normal', 'Heading 1', 'Heading 2', 'Intense Quote')
+
+    def __init__(self):
+        import docx
+        from docx.enum.style import WD_STYLE_TYPE
+        from docx.enum.text import WD_ALIGN_PARAGRAPH
+
+        doc = docx.Document()
+        doc.add_heading(REPORT_TITLE, 0).alignment = WD_ALIGN_PARAGRAPH.CENTER
+        doc.add_paragraph().alignment = WD_ALIGN_PARAGRAPH.CENTER  # 副标题
+        doc.add_paragraph().alignment = WD_ALIGN_PARAGRAPH.CENTER  # 生成时间
+        doc.add_paragraph('=' * 50).alignment = WD_ALIGN_PARAGRAPH.CENTER
+        doc.add_page_break()  # 报告内容插入到分页符之前
+        doc.add_paragraph(FOOTER_TEXT).alignment = WD_ALIGN_PARAGRAPH.CENTER
+        self.document = doc
+        # 按样式名查找样式需要遍历整个样式表，预先解析为样式ID（默认样式为None，即不写 pStyle）
+        default_style = doc.styles.default(WD_STYLE_TYPE.PARAGRAPH)
+        self.style_ids = {}
+        for name in self.STYLES:
+            style = doc.styles[name]
+            self.style_ids[name] = None if style == default_style else style.style_id
+
+        package = BytesIO()
+        doc.save(package)
+        self.static_package = _without_entry(package.getvalue(), DOCUMENT_PART)
+
+    def clone(self):
+        """复制模板正文，返回共享样式部件的文档对象（样式只读，可多线程同时使用）"""
+        from docx.document import Document as DocumentProxy
+        return DocumentProxy(copy.deepcopy(self.document.element), self.document.part)
+
+    @staticmethod
+    def serialize(document):
+        """文档正文的 word/document.xml 字节"""
+        from docx.opc.oxml import serialize_part_xml
+        return serialize_part_xml(document.element)
+
+    def package(self, body):
+        """把 word/document.xml 追加到静态部件 zip 中，返回 .docx 字节"""
+        output = BytesIO(self.static_package)
+        with zipfile.ZipFile(output, 'a', zipfile.ZIP_DEFLATED) as package:
+            package.writestr(DOCUMENT_PART, body)
+        return output.getvalue()
+
+
+_template = None
+_template_pid = None
+_template_lock = threading.Lock()
+
+
+def get_template():
+    """获取当前进程的报告模板（进程池的每个子进程各自构建一次）"""
+    global _template, _template_pid
+    with _template_lock:
+        if _template is None or _template_pid != os.getpid():
+            _template = ReportTemplate()
+            _template_pid = os.getpid()
+        return _template
+
+
+def template_ready():
+    """当前进程是否已构建报告模板"""
+    return _template is not None and _template_pid == os.getpid()
+
+
+def build_document(report_data, jurisdiction, generated_at=GENERATED_AT_MARK):
+    """根据报告文本填充模板，返回文档对象；generated_at 默认为占位符，由 package_report() 填入"""
+    doc = get_template().clone()
+    paragraphs = doc.paragraphs
+    paragraphs[ReportTemplate.SUBTITLE].text = f'司法辖区：{jurisdiction}'
+    paragraphs[ReportTemplate.GENERATED_AT].text = f'生成时间：{generated_at}'
+    anchor = paragraphs[ReportTemplate.CONTENT_ANCHOR]
+    style_ids = get_template().style_ids
+
+    def add(text=None, style=None):
+        paragraph = anchor.insert_paragraph_before(text)
+        if style is not None:
+            paragraph._p.style = style_ids[style]
+        return paragraph
+
+    for line in report_data.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+
+        if SECTION_HEADING_RE.match(line):
+            # 司法辖区章节标题
+            add(line, 'Heading 1')
+        elif line.startswith('Q') and ':' in line:
+            # 问题标题
+            add(line, 'Heading 2')
+        elif line.startswith('A:'):
+            # 答案内容
+            answer_text = line[2:].strip()  # 移除 "A:" 前缀
+
+            # 分析答案结构
+            if '法律依据：' in answer_text:
+                # 分离主要内容和法律依据
+                parts = answer_text.split('法律依据：')
+                main_content = parts[0].strip()
+                legal_basis = '法律依据：' + parts[1].strip() if len(parts) > 1 else ''
+
+                # 添加主要内容
+                if main_content:
+                    add(main_content, 'Normal')
+
+                # 添加法律依据（使用不同样式）
+                if legal_basis:
+                    add()  # 空行
+                    add(legal_basis, 'Intense Quote')
+            else:
+                # 没有法律依据分离的情况
+                add(answer_text, 'Normal')
+        elif line.startswith('以下是基于'):
+            # 引言
+            add(line, 'Normal')
+        elif not line.startswith('出海目标国') and not line.startswith('具体要求'):
+            # 其他内容
+            add(line)
+
+    return doc
+
+
+def render_report_body(report_data, jurisdiction):
+    """渲染报告正文，返回生成时间为占位符的 word/document.xml 字节（可缓存）"""
+    with stage('docx_build'):
+        doc = build_document(report_data, jurisdiction)
+        return ReportTemplate.serialize(doc)
+
+
+def package_report(body, generated_at=None):
+    """填入生成时间（默认当前时间）并打包为 .docx 字节"""
+    if generated_at is None:
+        generated_at = datetime.now().strftime(GENERATED_AT_FORMAT)
+    with stage('docx_save'):
+        body = body.replace(GENERATED_AT_MARK.encode('utf-8'), generated_at.encode('utf-8'), 1)
+        return get_template().package(body)
+
+
+def render_report(report_data, jurisdiction, generated_at=None):
+    """渲染报告并返回 .docx 字节"""
+    return package_report(render_report_body(report_data, jurisdiction), generated_at)
+
+
+def report_cache_key(report_data, jurisdiction):
+    payload = json.dumps([jurisdiction, report_data], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class RenderCache:
+    """已渲染报告正文（render_report_body 的结果）的内存LRU缓存，按字节数限制总量；max_bytes 为0时不缓存"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> bytes
+        self._lock = threading.Lock()
+        self._current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._current_bytes -= len(previous)
+            self._entries[key] = data
+            self._current_bytes += len(data)
+            while self._current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._current_bytes -= len(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,159 @@
+"""docx 解析基准 - 流式提取与 python-docx 的耗时和峰值内存对比
+
+对知识库中的 docx 文件和一个生成的大文件（默认 20000 段、每 200 段一个表格、带页眉），
+分别在独立子进程中提取文本，记录耗时和峰值RSS增量：
+- python-docx：docx.Document() 构建完整对象模型后拼接 doc.paragraphs
+- stream：backend.docx_text.extract_text() 流式提取（含表格和页眉页脚），返回完整文本
+- stream-iter：逐行消费 iter_paragraphs() 并写入文件，不保留全文，峰值内存即解析本身的开销
+
+检查：流式提取的文本包含 python-docx 得到的全部段落，包含表格内容和页眉；大文件上更快，
+逐行消费时的峰值内存增量不到 python-docx 的1/10。
+任一检查不通过时以非零状态码退出。
+
+用法：
+    python benchmarks/bench_docx.py
+    python benchmarks/bench_docx.py --paragraphs 50000 --output docx.json
+"""
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TABLE_MARKER = '费用等级'
+
+
+def extract(parser, filepath, text_path):
+    """提取文本并写入 text_path"""
+    if parser == 'stream-iter':
+        from backend.docx_text import iter_paragraphs
+        with open(text_path, 'w', encoding='utf-8') as f:
+            for position, line in enumerate(iter_paragraphs(filepath)):
+                f.write(line if position == 0 else '\n' + line)
+        return
+    if parser == 'stream':
+        from backend.docx_text import extract_text
+        text = extract_text(filepath)
+    else:
+        import docx
+        text = '\n'.join(paragraph.text for paragraph in docx.Document(filepath).paragraphs)
+    with open(text_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def peak_rss_kb():
+    """进程的峰值RSS（KB）；Linux 上读 VmHWM（exec 后重新计数，ru_maxrss 会继承父进程的峰值）"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_worker(parser, filepath, text_path):
+    """子进程：导入解析器后记录基线RSS，解析一次，输出耗时和峰值RSS增量"""
+    if parser == 'python-docx':
+        import docx  # noqa: F401
+    else:
+        import backend.docx_text  # noqa: F401
+    base_kb = peak_rss_kb()
+    start = time.perf_counter()
+    extract(parser, filepath, text_path)
+    seconds = time.perf_counter() - start
+    peak_kb = peak_rss_kb()
+    print(json.dumps({'ms': round(seconds * 1000, 1), 'peak_delta_mb': round((peak_kb - base_kb) / 1024, 1)}))
+
+
+def measure(parser, filepath, workdir):
+    text_path = os.path.join(workdir, f'{parser}.txt')
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--worker', parser, filepath, text_path],
+        capture_output=True, text=True, check=True, cwd=ROOT
+    ).stdout
+    with open(text_path, encoding='utf-8') as f:
+        text = f.read()
+    return dict(json.loads(output.strip().splitlines()[-1]), chars=len(text)), text
+
+
+def build_large_docx(path, paragraphs):
+    """生成大文件：正文段落、周期性的表格和页眉"""
+    import docx
+    document = docx.Document()
+    document.sections[0].header.paragraphs[0].text = '示例法规汇编（基准测试生成）'
+    for i in range(paragraphs):
+        document.add_paragraph(
+            f"第{i + 1}条 数据控制者应当在开始处理个人数据之前向监管机构登记，并按照规定缴纳费用。"
+            f"Article {i + 1}: the controller shall register with the supervisory authority before processing."
+        )
+        if i % 200 == 199:
+            table = document.add_table(rows=3, cols=3)
+            for row, values in enumerate([(TABLE_MARKER, '员工人数', '年费'), ('一级', '10人以下', '40'),
+                                          ('二级', '250人以下', '60')]):
+                for col, value in enumerate(values):
+                    table.cell(row, col).text = value
+    document.save(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='docx 解析基准')
+    parser.add_argument('--paragraphs', type=int, default=20000, help='生成的大文件段落数')
+    parser.add_argument('--worker', nargs=3, metavar=('PARSER', 'FILE', 'TEXT'), help=argparse.SUPPRESS)
+    parser.add_argument('--output', help='将结果写入JSON文件')
+    args = parser.parse_args(argv)
+    if args.worker:
+        run_worker(*args.worker)
+        return 0
+
+    workdir = tempfile.mkdtemp(prefix='legal-docx-')
+    large = os.path.join(workdir, f'生成_{args.paragraphs}段.docx')
+    build_large_docx(large, args.paragraphs)
+    files = sorted(glob.glob(os.path.join(ROOT, 'knowledge-base', '*.docx'))) + [large]
+
+    output = {'config': vars(args), 'results': {}}
+    status = 0
+    for filepath in files:
+        name = os.path.basename(filepath)
+        legacy, legacy_text = measure('python-docx', filepath, workdir)
+        stream, stream_text = measure('stream', filepath, workdir)
+        iterated, iterated_text = measure('stream-iter', filepath, workdir)
+        output['results'][name] = {'python-docx': legacy, 'stream': stream, 'stream-iter': iterated}
+        print(f"{name[:36]:<36} python-docx {legacy['ms']:>7.1f}ms {legacy['peak_delta_mb']:>5.1f}MB  "
+              f"stream {stream['ms']:>7.1f}ms {stream['peak_delta_mb']:>5.1f}MB  "
+              f"逐行 {iterated['peak_delta_mb']:>5.1f}MB  文本 {legacy['chars']} -> {stream['chars']} 字符")
+
+        lines = set(stream_text.split('\n'))
+        checks = {
+            '包含 python-docx 的全部段落': all(line in lines for line in legacy_text.split('\n') if line.strip()),
+            '逐行消费与完整提取的文本一致': iterated_text == stream_text
+        }
+        if filepath == large:
+            checks.update({
+                '包含表格内容': TABLE_MARKER in stream_text,
+                '包含页眉': stream_text.startswith('示例法规汇编'),
+                '大文件上快于 python-docx': stream['ms'] < legacy['ms'],
+                '逐行消费时峰值内存增量不到 python-docx 的1/10': iterated['peak_delta_mb'] < legacy['peak_delta_mb'] / 10
+            })
+        for description, passed in checks.items():
+            if not passed or filepath == large:
+                print(f"    {'✓' if passed else '✗'} {description}")
+            if not passed:
+                status = 1
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
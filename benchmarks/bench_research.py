@@ -0,0 +1,349 @@
+"""端到端性能基准
+
+启动本地 Deepseek 模拟服务，通过 Flask test client 在多个并发级别下压测
+/api/research 和 /api/export-word，输出 p50/p95/p99 延迟、吞吐量、峰值RSS和各阶段耗时，
+并与保存的基线比较，发现性能回退时以非零状态码退出。
+
+仓库内提交的 benchmarks/baseline.json 是参考基线，其 machine 字段记录了生成时的机器配置
+（CPU型号/核数、Python版本、平台）。延迟和吞吐量只在相同配置下可比：换机器后应先用
+--save-baseline 重新生成基线。配置不一致时只给出警告并跳过比较（绝对耗时在不同机器间没有意义），
+不计为回退；CI 模式下只有缺少基线视为错误。
+
+启动耗时单独在子进程中测量：全新解释器导入应用的耗时，以及 gunicorn 启动后 /health 可响应、
+/api/ready 返回就绪（后台预热完成）各需多久。
+
+用法：
+    python benchmarks/bench_research.py                      # 运行并与基线比较
+    python benchmarks/bench_research.py --save-baseline      # 运行并保存为新基线
+    python benchmarks/bench_research.py --ci                 # CI模式：缺少基线时非零退出
+    python benchmarks/bench_research.py --concurrency 1,8 --requests 32 --latency 0.5
+    python benchmarks/bench_research.py --batch              # 批量模式（每个司法辖区一次AI调用）
+    python benchmarks/bench_research.py --skip-startup       # 不测量 gunicorn 启动耗时
+    python benchmarks/bench_research.py --no-coalesce        # 关闭相同请求合并（对比突发流量下的AI调用次数）
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.bench_workers import free_port  # noqa: E402
+from benchmarks.mock_deepseek import MockConfig, start_mock_server  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    # Linux 下 ru_maxrss 单位为KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_load(app, send, concurrency, total_requests):
+    """以固定并发发送 total_requests 个请求，返回 (延迟列表, 失败数, 总耗时)"""
+    latencies = []
+    failures = [0]
+    lock = threading.Lock()
+    counter = iter(range(total_requests))
+
+    def worker():
+        client = app.test_client()
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    return
+            start = time.perf_counter()
+            ok = send(client)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    failures[0] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    wall_start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, failures[0], time.perf_counter() - wall_start
+
+
+def summarize(latencies, failures, wall, stages):
+    return {
+        'requests': len(latencies),
+        'failures': failures,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'throughput_rps': round(len(latencies) / wall, 3) if wall else 0.0,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'stages_ms': {
+            name: round(data['avg'] * 1000, 3) for name, data in sorted(stages.items())
+        }
+    }
+
+
+def clean_import_ms(env, runs=3):
+    """在全新解释器中导入应用的耗时（取多次的中位数）"""
+    code = 'import time; t = time.perf_counter(); import backend.app; print(time.perf_counter() - t)'
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return round(percentile(timings, 50) * 1000, 2)
+
+
+def poll_until_ok(url, deadline, interval=0.01):
+    """轮询直到返回200，返回是否成功"""
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=2) as response:
+                if response.status == 200:
+                    return True
+        except OSError:
+            pass
+        time.sleep(interval)
+    return False
+
+
+def measure_startup(env, workdir, timeout=120):
+    """启动 gunicorn（默认配置），返回 /health 可响应和 /api/ready 就绪的耗时（毫秒）"""
+    port = free_port()
+    env = dict(env, PORT=str(port))
+    base = f'http://127.0.0.1:{port}'
+    with open(os.path.join(workdir, 'gunicorn-startup.log'), 'w') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_config.py', 'backend.app:app'],
+            cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+        try:
+            deadline = start + timeout
+            if not poll_until_ok(f'{base}/health', deadline):
+                return None
+            health_ms = (time.perf_counter() - start) * 1000
+            if not poll_until_ok(f'{base}/api/ready', deadline):
+                return None
+            ready_ms = (time.perf_counter() - start) * 1000
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+    return {'health_ms': round(health_ms, 2), 'ready_ms': round(ready_ms, 2)}
+
+
+def cpu_model():
+    try:
+        with open('/proc/cpuinfo', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def machine_profile():
+    """基线对应的机器配置；不同配置间的延迟/吞吐量不可直接比较"""
+    return {
+        'cpu': cpu_model(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'platform': f"{platform.system()}-{platform.machine()}"
+    }
+
+
+def compare_startup(current, baseline, tolerance, slack_ms=50):
+    """启动耗时回退项；数值较小、波动相对较大，另加 slack_ms 的绝对余量"""
+    regressions = []
+    previous = baseline.get('startup', {})
+    for key in ('import_ms', 'health_ms', 'ready_ms'):
+        if current.get(key) is None or not previous.get(key):
+            continue
+        if current[key] > previous[key] * (1 + tolerance) + slack_ms:
+            regressions.append(f"startup: {key} {previous[key]}ms -> {current[key]}ms")
+    return regressions
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """返回回退项列表：p95 变慢或吞吐量下降超过容忍比例"""
+    regressions = []
+    for key, current in results.items():
+        previous = baseline.get('results', {}).get(key)
+        if not previous:
+            continue
+        if previous['p95_ms'] and current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{key}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+        if previous['throughput_rps'] and current['throughput_rps'] < previous['throughput_rps'] * (1 - tolerance):
+            regressions.append(
+                f"{key}: 吞吐量 {previous['throughput_rps']} -> {current['throughput_rps']} req/s"
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='法律检索服务端到端性能基准')
+    parser.add_argument('--concurrency', default='1,4,8', help='并发级别，逗号分隔')
+    parser.add_argument('--requests', type=int, default=16, help='每个并发级别的请求数')
+    parser.add_argument('--jurisdiction', default='英国')
+    parser.add_argument('--questions', default='1,2,3,4,5,6,7')
+    parser.add_argument('--latency', type=float, default=0.2, help='模拟服务平均延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.05, help='模拟服务延迟抖动（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='模拟服务503比例')
+    parser.add_argument('--response-chars', type=int, default=600, help='模拟答案长度')
+    parser.add_argument('--answer-cache', action='store_true', help='启用答案缓存（默认关闭以测量AI调用路径）')
+    parser.add_argument('--word-cache', action='store_true', help='启用Word渲染结果缓存（默认关闭以测量渲染路径）')
+    parser.add_argument('--batch', action='store_true', help='使用批量模式（每个司法辖区一次AI调用）')
+    parser.add_argument('--no-coalesce', action='store_true', help='关闭相同并发请求的合并')
+    parser.add_argument('--skip-startup', action='store_true', help='不测量子进程导入和 gunicorn 启动耗时')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='基线文件路径')
+    parser.add_argument('--save-baseline', action='store_true', help='将本次结果保存为基线')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许的回退比例')
+    parser.add_argument('--output', help='将结果写入JSON文件')
+    parser.add_argument('--ci', action='store_true', default=bool(os.getenv('CI')),
+                        help='CI模式：基线缺失时以非零状态码退出（设置CI环境变量时默认开启）')
+    args = parser.parse_args(argv)
+
+    mock_config = MockConfig(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                             response_chars=args.response_chars)
+    server, url = start_mock_server(mock_config)
+    workdir = tempfile.mkdtemp(prefix='legal-bench-')
+
+    # 必须在导入应用之前设置环境变量
+    os.environ['DEEPSEEK_API_URL'] = url
+    os.environ.setdefault('DEEPSEEK_API_KEY', 'benchmark')
+    os.environ['ANSWER_CACHE_ENABLED'] = '1' if args.answer_cache else '0'
+    os.environ['ANSWER_CACHE_PATH'] = os.path.join(workdir, 'answers.sqlite3')
+    os.environ['RESEARCH_JOB_DB'] = os.path.join(workdir, 'jobs.sqlite3')
+    if not args.word_cache:
+        os.environ['WORD_EXPORT_CACHE_BYTES'] = '0'
+    os.environ['RESEARCH_COALESCE'] = '0' if args.no_coalesce else '1'
+
+    startup = {}
+    if not args.skip_startup:
+        startup_env = dict(os.environ, RESEARCH_JOB_DB=os.path.join(workdir, 'startup-jobs.sqlite3'))
+        startup['import_ms'] = clean_import_ms(startup_env)
+        startup.update(measure_startup(startup_env, workdir) or {'health_ms': None, 'ready_ms': None})
+
+    # 压测部分不开启后台预热，首个请求的冷启动耗时与之前可比
+    os.environ['KB_WARMUP'] = '0'
+    quiet = io.StringIO()
+    with contextlib.redirect_stdout(quiet):
+        from backend import app as app_module
+
+    app = app_module.app
+    research_payload = {
+        'jurisdiction': args.jurisdiction,
+        'questions': [q.strip() for q in args.questions.split(',') if q.strip()],
+        'batch': args.batch
+    }
+
+    # 冷启动：首次请求包含知识库解析和索引构建
+    cold_start = time.perf_counter()
+    with contextlib.redirect_stdout(quiet):
+        response = app.test_client().post('/api/research', json=research_payload)
+    cold_seconds = time.perf_counter() - cold_start
+    startup['cold_request_ms'] = round(cold_seconds * 1000, 2)
+    if response.status_code != 200:
+        print(f"预热请求失败: {response.status_code} {response.get_data(as_text=True)}")
+        return 2
+    report = response.get_json()['report']
+    export_payload = {'report': report, 'jurisdiction': args.jurisdiction}
+
+    scenarios = {
+        'research': lambda client: client.post('/api/research', json=research_payload).status_code == 200,
+        'export': lambda client: client.post('/api/export-word', json=export_payload).status_code == 200
+    }
+
+    results = {}
+    for name, send in scenarios.items():
+        for concurrency in [int(c) for c in args.concurrency.split(',') if c.strip()]:
+            app_module.stage_timer.reset()
+            app_module.llm_usage.reset()
+            with contextlib.redirect_stdout(quiet):
+                latencies, failures, wall = run_load(app, send, concurrency, args.requests)
+            key = f"{name}@{concurrency}"
+            results[key] = summarize(latencies, failures, wall, app_module.stage_timer.snapshot())
+            results[key]['llm_usage'] = app_module.llm_usage.snapshot()
+            row = results[key]
+            print(f"{key:<14} p50={row['p50_ms']:>9.1f}ms p95={row['p95_ms']:>9.1f}ms "
+                  f"p99={row['p99_ms']:>9.1f}ms 吞吐={row['throughput_rps']:>7.2f}/s "
+                  f"失败={row['failures']} RSS={row['peak_rss_mb']}MB")
+            print(f"{'':<14} 阶段平均耗时(ms): {row['stages_ms']}")
+            for mode, usage in row['llm_usage'].items():
+                print(f"{'':<14} AI调用[{mode}]: {usage['calls']} 次 / {usage['questions']} 题，"
+                      f"每题 prompt {usage['prompt_tokens_per_question']} + "
+                      f"completion {usage['completion_tokens_per_question']} tokens，"
+                      f"每题 {usage['seconds_per_question']}s")
+
+    server.shutdown()
+    output = {
+        'created_at': time.time(),
+        'machine': machine_profile(),
+        'config': dict(vars(args), baseline=os.path.relpath(args.baseline, ROOT)),
+        'startup': startup,
+        'mock': mock_config.stats(),
+        'results': results
+    }
+    if args.skip_startup:
+        print(f"启动: 首个请求 {startup['cold_request_ms']}ms")
+    else:
+        print(f"启动: 导入 {startup['import_ms']}ms，/health 可响应 {startup['health_ms']}ms，"
+              f"/api/ready 就绪 {startup['ready_ms']}ms，首个请求 {startup['cold_request_ms']}ms")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存: {args.baseline}")
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('machine') != output['machine']:
+            print(f"警告：基线机器配置 {baseline.get('machine')} 与当前 {output['machine']} 不一致，"
+                  f"跳过与基线的比较；请在本机（或CI runner 上）使用 --save-baseline 生成基线")
+            return 0
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        regressions += compare_startup(startup, baseline, args.tolerance)
+        if regressions:
+            print("发现性能回退：")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print("与基线相比无性能回退")
+    else:
+        print(f"未找到基线文件 {args.baseline}，使用 --save-baseline 保存")
+        if args.ci:
+            return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""检索打分基准 - 知识库增长到数百个文件时每份报告的检索耗时
+
+用现有知识库文件循环拼接出不同规模的语料（默认 16 / 64 / 256 / 512 个文件），对每种规模测量：
+- 构建：BM25索引、打分矩阵（bm25 / tfidf / hybrid）的构建时间
+- legacy：逐题调用 BM25Index.search()（矩阵打分之前的做法）检索一份报告的全部问题
+- batch：一次矩阵乘积对全部问题打分并取前 top_k（缓存未命中时一份报告的检索耗时）
+- cached：同一知识库上再次检索（缓存命中）
+
+检查 bm25 矩阵打分与逐题检索的结果完全一致，安装 numpy 时最大规模下批量打分快于逐题检索。
+任一检查不通过时以非零状态码退出。
+
+用法：
+    python benchmarks/bench_retrieval.py
+    python benchmarks/bench_retrieval.py --files 16,128,512 --repeat 10 --no-numpy
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def build_corpus(sections, n_files):
+    """循环使用已有文件拼接出 n_files 个文件的知识库内容（文件名加序号，保持各文件不同）"""
+    parts = []
+    for i in range(n_files):
+        title, lines = sections[i % len(sections)]
+        name, _, ext = title.rpartition('.')
+        parts.append(f"\n\n=== {name}_{i}.{ext} ===\n" + '\n'.join(lines) + '\n')
+    return ''.join(parts)
+
+
+def timed_ms(fn, repeat):
+    """返回 (结果, 多次运行耗时的中位数ms)"""
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return result, round(statistics.median(samples), 3)
+
+
+def run_size(app_module, kb_vectors, sections, n_files, queries, args):
+    content = build_corpus(sections, n_files)
+    (index, build_ms) = timed_ms(lambda: app_module.BM25Index(content), 1)
+    result = {'files': n_files, 'chunks': len(index.chunks), 'index_build_ms': build_ms}
+
+    legacy, result['legacy_ms'] = timed_ms(
+        lambda: [index.search(weights, top_k=args.top_k) for _, weights in queries], args.repeat
+    )
+    equal = None
+    for mode in kb_vectors.RETRIEVAL_MODES:
+        scorer = kb_vectors.RelevanceScorer(index, mode)
+        _, result[f'{mode}_build_ms'] = timed_ms(scorer.build, 1)
+        hits, result[f'{mode}_batch_ms'] = timed_ms(
+            lambda: [kb_vectors.top_hits(row, args.top_k) for row in scorer.score(queries)], args.repeat
+        )
+        scorer.search(queries, args.top_k)
+        _, result[f'{mode}_cached_ms'] = timed_ms(lambda: scorer.search(queries, args.top_k), args.repeat)
+        if mode == 'bm25':
+            equal = all(
+                [c for _, c in left] == [c for _, c in right]
+                and all(abs(a - b) <= 1e-9 * max(1.0, abs(a)) for (a, _), (b, _) in zip(left, right))
+                for left, right in zip(legacy, hits)
+            )
+    return result, equal
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='检索打分基准')
+    parser.add_argument('--files', default='16,64,256,512', help='语料规模（文件数），逗号分隔')
+    parser.add_argument('--repeat', type=int, default=5, help='每项测量的重复次数（取中位数）')
+    parser.add_argument('--top-k', type=int, default=20)
+    parser.add_argument('--no-numpy', action='store_true', help='使用纯Python实现')
+    parser.add_argument('--output', help='将结果写入JSON文件')
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('KB_WARMUP', '0')
+    quiet = io.StringIO()
+    with contextlib.redirect_stdout(quiet):
+        from backend import app as app_module
+        from backend import kb_vectors
+        from backend.kb_index import split_sections
+        kb_vectors.load_numpy()
+        if args.no_numpy:
+            kb_vectors.np = None
+        sections = []
+        seen = set()
+        for jurisdiction in app_module.shard_catalog.jurisdictions:
+            for section in split_sections(app_module.load_knowledge_base(jurisdiction)):
+                if section[0] not in seen:
+                    seen.add(section[0])
+                    sections.append(section)
+    if not sections:
+        print('知识库为空，无法运行基准')
+        return 1
+
+    # 一份完整报告：每个司法辖区的全部问题
+    queries = [
+        (prompt, app_module.build_query_weights(prompt))
+        for prompt in (app_module.build_question_prompt('英国', qid) for qid in app_module.QUESTIONS)
+    ]
+    print(f"源文件 {len(sections)} 个，每份报告 {len(queries)} 个问题，numpy: {kb_vectors.np is not None}")
+
+    output = {'config': vars(args), 'numpy': kb_vectors.np is not None, 'results': []}
+    status = 0
+    largest = None
+    for n_files in (int(value) for value in args.files.split(',')):
+        result, equal = run_size(app_module, kb_vectors, sections, n_files, queries, args)
+        output['results'].append(result)
+        largest = result
+        print(f"[{n_files:>4} 文件 / {result['chunks']:>6} 段落] 索引构建 {result['index_build_ms']:.0f}ms  "
+              f"逐题 {result['legacy_ms']:.2f}ms")
+        for mode in kb_vectors.RETRIEVAL_MODES:
+            print(f"    {mode:<7} 矩阵构建 {result[f'{mode}_build_ms']:>9.1f}ms  "
+                  f"批量 {result[f'{mode}_batch_ms']:>8.2f}ms  缓存 {result[f'{mode}_cached_ms']:.3f}ms")
+        passed = bool(equal)
+        print(f"    {'✓' if passed else '✗'} bm25 矩阵打分与逐题检索结果一致")
+        if not passed:
+            status = 1
+
+    checks = {'缓存命中的检索不超过1ms': largest['bm25_cached_ms'] <= 1.0}
+    if kb_vectors.np is not None:
+        checks['最大规模下 bm25 批量打分快于逐题检索'] = largest['bm25_batch_ms'] < largest['legacy_ms']
+    for description, passed in checks.items():
+        print(f"{'✓' if passed else '✗'} {description}")
+        if not passed:
+            status = 1
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+"""知识库分片基准 - 司法辖区从10个增长到100个、文件数以千计时的启动开销和内存
+
+生成合成知识库：每个司法辖区一个分片子目录（默认20个文件，分在 statutes/ 和 guidance/ 下），
+另有一个被部分司法辖区 include 的公共分片，由 manifest.json 列出（均不预热）。
+对每种规模（默认 10 / 50 / 100 个司法辖区）在独立子进程中：
+- 启动：导入应用的耗时和RSS（只读取清单，不访问分片文件）
+- 首次请求：依次加载并索引每个司法辖区（load_knowledge_base + prime_retrieval，与检索请求相同），记录中位耗时
+- 再次请求：最近加载的分片命中内存
+- 内存：访问全部司法辖区后已加载分片的估算内存、淘汰次数、RSS和峰值RSS
+另在一个子进程中用 tracemalloc 实测一个分片（内容、条文记录、索引和打分矩阵）的内存，与估算值比较。
+
+检查：启动耗时和RSS不随司法辖区数增长；已加载分片的估算内存不超过上限；分片数超出上限能容纳的数量后
+（发生了淘汰的各规模之间）峰值RSS不再增长；命中内存的请求不超过1ms；内存估算与实测相差不超过25%。
+任一检查不通过时以非零状态码退出。
+
+用法：
+    python benchmarks/bench_shards.py
+    python benchmarks/bench_shards.py --jurisdictions 10,50,200 --files 30 --memory-mb 48 --output shards.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SHARED = '共同体'
+WORDS = (
+    'controller processor register registration fee authority notify personal data processing exemption '
+    'penalty fine certificate renewal annual tier employees turnover supervisory public body charity '
+    'consent transfer retention security breach officer record purpose lawful basis subject access '
+    'application form deadline guidance decision appeal tribunal sanction criminal civil administrative'
+).split()
+
+
+def build_knowledge_base(directory, n_jurisdictions, n_files, articles, seed=0):
+    """生成合成知识库和清单，返回司法辖区名列表"""
+    rng = random.Random(seed)
+    names = [f"J{i:03d}" for i in range(n_jurisdictions)]
+    shards = {SHARED: {'shared': True}}
+
+    def write(path, law, n_articles):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        lines = [law, '']
+        for number in range(1, n_articles + 1):
+            sentence = ' '.join(rng.choice(WORDS) for _ in range(40))
+            lines.append(f"Article {number}. {sentence[0].upper()}{sentence[1:]}.")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines))
+
+    write(os.path.join(directory, SHARED, 'regulation.txt'), 'Common Regulation', articles)
+    for i, name in enumerate(names):
+        for j in range(n_files):
+            kind = 'statutes' if j % 2 == 0 else 'guidance'
+            write(os.path.join(directory, name, kind, f"{kind}_{j:03d}.txt"), f"{name} {kind} {j}", articles)
+        shards[name] = {'include': [SHARED]} if i % 3 == 0 else {}
+    with open(os.path.join(directory, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump({'shards': shards}, f, ensure_ascii=False, indent=2)
+    return names
+
+
+def memory_kb(field):
+    """/proc/self/status 中的内存字段（KB）：VmRSS 为当前RSS，VmHWM 为峰值RSS"""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def configure_worker_env(knowledge_dir, memory_mb):
+    os.environ.update({
+        'KNOWLEDGE_DIR': knowledge_dir,
+        'KB_SHARD_MEMORY_MB': str(memory_mb),
+        'KB_WARMUP': '0',
+        'KB_WATCH_INTERVAL': '0',
+        'KB_CORPUS_PATH': '',
+        'ANSWER_CACHE_ENABLED': '0'
+    })
+
+
+def run_worker(knowledge_dir, memory_mb):
+    """子进程：导入应用后依次请求全部司法辖区，输出JSON结果"""
+    configure_worker_env(knowledge_dir, memory_mb)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        from backend import app as app_module
+    result = {'import_ms': round((time.perf_counter() - start) * 1000, 1), 'startup_rss_mb': memory_kb('VmRSS') / 1024}
+
+    client = app_module.app.test_client()
+    jurisdictions = client.get('/api/jurisdictions').json
+    result['jurisdictions'] = len(jurisdictions)
+    cold = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for jurisdiction in jurisdictions:
+            request_start = time.perf_counter()
+            content = app_module.load_knowledge_base(jurisdiction)
+            app_module.prime_retrieval(jurisdiction, content)
+            cold.append((time.perf_counter() - request_start) * 1000)
+        warm = []
+        for _ in range(20):
+            request_start = time.perf_counter()
+            content = app_module.load_knowledge_base(jurisdictions[-1])
+            app_module.prime_retrieval(jurisdictions[-1], content)
+            warm.append((time.perf_counter() - request_start) * 1000)
+    stats = app_module.loaded_shards.stats()
+    result.update({
+        'cold_ms': round(statistics.median(cold), 1),
+        'warm_ms': round(statistics.median(warm), 3),
+        'loaded': stats['entries'],
+        'shard_mb': round(stats['bytes'] / 1024 / 1024, 1),
+        'max_mb': round(stats['max_bytes'] / 1024 / 1024, 1),
+        'evictions': stats['evictions'],
+        'indexes': len(app_module._kb_indexes),
+        'rss_mb': round(memory_kb('VmRSS') / 1024, 1),
+        'peak_rss_mb': round(memory_kb('VmHWM') / 1024, 1)
+    })
+    result['startup_rss_mb'] = round(result['startup_rss_mb'], 1)
+    print(json.dumps(result))
+
+
+def run_estimate_worker(knowledge_dir):
+    """子进程：tracemalloc 实测一个分片的内存，与 knowledge_snapshot_bytes() 的估算比较"""
+    import gc
+    import tracemalloc
+    configure_worker_env(knowledge_dir, 1024)
+    with contextlib.redirect_stdout(io.StringIO()):
+        from backend import app as app_module
+        jurisdiction = app_module.shard_catalog.jurisdictions[0]
+        gc.collect()
+        tracemalloc.start()
+        content = app_module.load_knowledge_base(jurisdiction)
+        app_module.prime_retrieval(jurisdiction, content)
+        # 解析缓存不属于分片，不计入
+        app_module.document_cache.clear()
+        gc.collect()
+        measured, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    estimated = app_module.knowledge_snapshot_bytes(app_module.loaded_shards.peek(jurisdiction))
+    print(json.dumps({'measured_mb': round(measured / 1024 / 1024, 2), 'estimated_mb': round(estimated / 1024 / 1024, 2)}))
+
+
+def spawn(*args):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), *args], capture_output=True, text=True, check=True, cwd=ROOT
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='知识库分片基准')
+    parser.add_argument('--jurisdictions', default='10,50,100', help='司法辖区数，逗号分隔')
+    parser.add_argument('--files', type=int, default=20, help='每个司法辖区的文件数')
+    parser.add_argument('--articles', type=int, default=40, help='每个文件的条文数')
+    parser.add_argument('--memory-mb', type=float, default=64, help='KB_SHARD_MEMORY_MB')
+    parser.add_argument('--worker', nargs=2, metavar=('DIR', 'MEMORY_MB'), help=argparse.SUPPRESS)
+    parser.add_argument('--estimate-worker', metavar='DIR', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help='将结果写入JSON文件')
+    args = parser.parse_args(argv)
+    if args.worker:
+        run_worker(args.worker[0], float(args.worker[1]))
+        return 0
+    if args.estimate_worker:
+        run_estimate_worker(args.estimate_worker)
+        return 0
+
+    output = {'config': vars(args), 'results': []}
+    workdir = tempfile.mkdtemp(prefix='legal-shards-')
+    try:
+        sizes = [int(value) for value in args.jurisdictions.split(',')]
+        for n in sizes:
+            directory = os.path.join(workdir, f'kb_{n}')
+            build_knowledge_base(directory, n, args.files, args.articles)
+            result = dict(spawn('--worker', directory, str(args.memory_mb)), files=n * args.files + 1)
+            output['results'].append(result)
+            print(f"[{n:>4} 司法辖区 / {result['files']:>5} 文件] 启动 {result['import_ms']:>6.0f}ms "
+                  f"{result['startup_rss_mb']:>5.1f}MB  首次请求 {result['cold_ms']:>6.1f}ms  "
+                  f"命中 {result['warm_ms']:.3f}ms  已加载 {result['loaded']:>3} 个 {result['shard_mb']:>5.1f}/"
+                  f"{result['max_mb']:.0f}MB  淘汰 {result['evictions']:>3}  "
+                  f"RSS {result['rss_mb']:>5.1f}MB 峰值 {result['peak_rss_mb']:>5.1f}MB")
+        estimate = spawn('--estimate-worker', os.path.join(workdir, f'kb_{sizes[0]}'))
+        output['estimate'] = estimate
+        print(f"单个分片内存：估算 {estimate['estimated_mb']}MB，实测 {estimate['measured_mb']}MB")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    smallest, largest = output['results'][0], output['results'][-1]
+    bounded = [r['peak_rss_mb'] for r in output['results'] if r['evictions']]
+    checks = {
+        '启动耗时不随司法辖区数增长（最大规模不超过最小规模的1.5倍+50ms）':
+            largest['import_ms'] <= smallest['import_ms'] * 1.5 + 50,
+        '启动RSS不随司法辖区数增长（相差不超过5MB）': largest['startup_rss_mb'] - smallest['startup_rss_mb'] <= 5,
+        '已加载分片的估算内存不超过上限': all(r['shard_mb'] <= r['max_mb'] for r in output['results']),
+        '达到内存上限后峰值RSS不再增长（发生淘汰的各规模相差不超过10%）':
+            len(bounded) >= 2 and max(bounded) <= min(bounded) * 1.1,
+        '命中内存的请求不超过1ms': all(r['warm_ms'] <= 1.0 for r in output['results']),
+        '内存估算与实测相差不超过25%':
+            abs(output['estimate']['estimated_mb'] - output['estimate']['measured_mb'])
+            <= 0.25 * output['estimate']['measured_mb']
+    }
+    status = 0
+    for description, passed in checks.items():
+        print(f"{'✓' if passed else '✗'} {description}")
+        if not passed:
+            status = 1
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
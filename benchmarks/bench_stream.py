@@ -0,0 +1,209 @@
+"""流式答案基准 - 首个片段延迟、慢客户端合并和断开后中止上游
+
+启动本地 Deepseek 模拟服务（流式逐段返回），通过 /api/research/stream 运行四个场景：
+1. first_token：单个问题从发出请求到收到第一个 delta 的时间，与关闭上游流式 (DEEPSEEK_STREAM=0) 时
+   收到答案的时间对比；已收到的片段拼接后应是最终答案的开头（之后的片段随答案事件一起替换）
+2. slow_reader：客户端每读一个事件停顿一段时间，片段应在服务端合并（事件数远少于上游片段数），答案完整
+3. disconnect：收到第一个片段后断开，正在进行的上游流应被中止，排队中的问题不再调用
+4. 断开后同一问题的新请求仍能正常完成
+
+任一检查不通过时以非零状态码退出。
+
+用法：
+    python benchmarks/bench_stream.py
+    python benchmarks/bench_stream.py --latency 2 --response-chars 1200
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.mock_deepseek import MockConfig, start_mock_server  # noqa: E402
+
+
+def open_stream(app_module, jurisdiction, questions):
+    """发出流式请求，返回逐个产出事件的迭代器和响应对象（close() 即断开）"""
+    response = app_module.app.test_client().post('/api/research/stream', json={
+        'jurisdiction': jurisdiction, 'questions': questions
+    }, buffered=False)
+
+    def events():
+        buffer = b''
+        for chunk in response.response:
+            buffer += chunk
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                if line.strip():
+                    yield json.loads(line)
+
+    return events(), response
+
+
+def wait_idle(mock_config, timeout=10):
+    deadline = time.time() + timeout
+    while mock_config.in_flight and time.time() < deadline:
+        time.sleep(0.02)
+
+
+def run_first_token(app_module, mock_config, quiet):
+    timings = {}
+    assembled = answer = None
+    for streaming, question in ((False, '1'), (True, '2')):
+        app_module.DEEPSEEK_STREAM = streaming
+        start = time.perf_counter()
+        first_delta = first_answer = None
+        parts = []
+        with contextlib.redirect_stdout(quiet):
+            events, response = open_stream(app_module, '英国', [question])
+            for event in events:
+                if event['type'] == 'delta':
+                    if first_delta is None:
+                        first_delta = time.perf_counter() - start
+                    parts = [event['text']] if event.get('reset') else parts + [event['text']]
+                elif event['type'] == 'answer':
+                    first_answer = time.perf_counter() - start
+                    answer = event['answer']
+            response.close()
+        mode = 'stream' if streaming else 'buffered'
+        timings[mode] = {
+            'first_delta_ms': round(first_delta * 1000, 1) if first_delta is not None else None,
+            'answer_ms': round(first_answer * 1000, 1)
+        }
+        if streaming:
+            assembled = ''.join(parts)
+    app_module.DEEPSEEK_STREAM = True
+    first_visible = timings['stream']['first_delta_ms'] or timings['stream']['answer_ms']
+    result = dict(timings, speedup=round(timings['buffered']['answer_ms'] / first_visible, 1))
+    checks = {
+        '流式模式收到片段': timings['stream']['first_delta_ms'] is not None,
+        '首个片段早于完整答案的一半时间': first_visible < timings['buffered']['answer_ms'] / 2,
+        '片段拼接是最终答案的开头': bool(assembled) and answer.startswith(assembled)
+    }
+    return result, checks
+
+
+def run_slow_reader(app_module, mock_config, args, quiet):
+    before = mock_config.stats()['streamed_chars']
+    deltas = 0
+    answers = 0
+    with contextlib.redirect_stdout(quiet):
+        events, response = open_stream(app_module, '法国', ['1', '2'])
+        for event in events:
+            if event['type'] == 'delta':
+                deltas += 1
+                time.sleep(args.latency / 4)
+            elif event['type'] == 'answer':
+                answers += 1 if not event['answer'].startswith('错误') else 0
+        response.close()
+    upstream_pieces = (mock_config.stats()['streamed_chars'] - before) // mock_config.chunk_chars
+    result = {'delta_events': deltas, 'upstream_pieces': upstream_pieces, 'answers': answers}
+    checks = {
+        '慢客户端的片段被合并（事件数少于上游片段数的1/4）': deltas < upstream_pieces / 4,
+        '两个答案完整返回': answers == 2
+    }
+    return result, checks
+
+
+def run_disconnect(app_module, mock_config, quiet):
+    cancelled_before = app_module.metrics.LLM_ATTEMPTS.value(mode='single', outcome='cancelled')
+    stats_before = mock_config.stats()
+    with contextlib.redirect_stdout(quiet):
+        events, response = open_stream(app_module, '德国', ['1', '2', '3', '4', '5', '6', '7'])
+        for event in events:
+            if event['type'] == 'delta':
+                break
+        disconnected = time.perf_counter()
+        response.close()
+        wait_idle(mock_config)
+        # 等待工作线程读到下一个片段后关闭上游连接
+        time.sleep(0.5)
+    stats_after = mock_config.stats()
+    aborted = stats_after['streams_aborted'] - stats_before['streams_aborted']
+    upstream_requests = stats_after['requests'] - stats_before['requests']
+    streamed = stats_after['streamed_chars'] - stats_before['streamed_chars']
+    cancelled = app_module.metrics.LLM_ATTEMPTS.value(mode='single', outcome='cancelled') - cancelled_before
+    full = upstream_requests * mock_config.response_chars
+    result = {
+        'upstream_requests': upstream_requests,
+        'streams_aborted': aborted,
+        'cancelled_calls': cancelled,
+        'streamed_chars': streamed,
+        'full_chars': full,
+        'settle_ms': round((time.perf_counter() - disconnected) * 1000, 1)
+    }
+    checks = {
+        '排队中的问题未调用上游': upstream_requests < 7,
+        '进行中的上游流被中止': aborted >= 1 and cancelled >= 1,
+        '上游生成的内容少于完整答案': streamed < full
+    }
+    return result, checks
+
+
+def run_after_disconnect(app_module, quiet):
+    """断开的请求放弃了共享任务，新请求不应拿到被取消的结果"""
+    with contextlib.redirect_stdout(quiet):
+        events, response = open_stream(app_module, '德国', ['1'])
+        answers = [event['answer'] for event in events if event['type'] == 'answer']
+        response.close()
+    result = {'answer_prefix': answers[0][:20] if answers else None}
+    checks = {'新请求得到正常答案': bool(answers) and not answers[0].startswith('错误')}
+    return result, checks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='流式答案基准')
+    parser.add_argument('--latency', type=float, default=1.0, help='模拟服务生成完整答案的时间（秒）')
+    parser.add_argument('--response-chars', type=int, default=600, help='答案长度（字符）')
+    parser.add_argument('--output', help='将结果写入JSON文件')
+    args = parser.parse_args(argv)
+
+    mock_config = MockConfig(latency=args.latency, response_chars=args.response_chars)
+    server, url = start_mock_server(mock_config)
+    workdir = tempfile.mkdtemp(prefix='legal-stream-')
+
+    # 必须在导入应用之前设置环境变量
+    os.environ.update({
+        'DEEPSEEK_API_URL': url,
+        'DEEPSEEK_API_KEY': os.environ.get('DEEPSEEK_API_KEY', 'benchmark'),
+        'ANSWER_CACHE_ENABLED': '0',
+        'RESEARCH_JOB_DB': os.path.join(workdir, 'jobs.sqlite3'),
+        'KB_WARMUP': '0',
+        'RESEARCH_MAX_CONCURRENCY': '2'
+    })
+    quiet = io.StringIO()
+    with contextlib.redirect_stdout(quiet):
+        from backend import app as app_module
+
+    scenarios = [
+        ('first_token', lambda: run_first_token(app_module, mock_config, quiet)),
+        ('slow_reader', lambda: run_slow_reader(app_module, mock_config, args, quiet)),
+        ('disconnect', lambda: run_disconnect(app_module, mock_config, quiet)),
+        ('after_disconnect', lambda: run_after_disconnect(app_module, quiet))
+    ]
+    output = {'config': vars(args), 'results': {}}
+    status = 0
+    for name, run in scenarios:
+        result, checks = run()
+        output['results'][name] = dict(result, checks=checks)
+        print(f"[{name}] {json.dumps(result, ensure_ascii=False)}")
+        for description, passed in checks.items():
+            print(f"    {'✓' if passed else '✗'} {description}")
+            if not passed:
+                status = 1
+    server.shutdown()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""上游故障注入基准 - 验证自适应并发上限和熔断器
+
+启动带故障注入的本地 Deepseek 模拟服务，依次运行三个场景并检查上游保护的行为：
+1. overload：模拟服务同时只能处理 --capacity 个请求，超出返回429；并发上限应降低，问题仍能完成
+2. outage：模拟服务全部返回503；连续失败达到阈值后熔断器打开，之后的调用应立即失败而不是等待超时
+3. recovery：模拟服务恢复；reset_timeout 后探测请求成功，熔断器关闭
+
+任一检查不通过时以非零状态码退出。
+
+用法：
+    python benchmarks/bench_upstream.py
+    python benchmarks/bench_upstream.py --capacity 2 --concurrency 4 --latency 0.3
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.mock_deepseek import MockConfig, start_mock_server  # noqa: E402
+
+BREAKER_THRESHOLD = 3
+BREAKER_RESET = 1.0
+
+
+def chat_payload(text):
+    return {
+        'model': 'deepseek-chat',
+        'messages': [{'role': 'user', 'content': text}],
+        'temperature': 0.1
+    }
+
+
+def upstream_metrics(app_module):
+    return [line for line in app_module.metrics.registry.render().splitlines()
+            if line.startswith('legal_research_upstream')]
+
+
+def run_overload(app_module, mock_config, args, quiet):
+    """多个检索请求并发，模拟服务容量不足"""
+    mock_config.capacity = args.capacity
+    client_errors = []
+    failed_questions = [0]
+    lock = threading.Lock()
+
+    def client():
+        response = app_module.app.test_client().post('/api/research', json={
+            'jurisdiction': '英国', 'questions': ['1', '2', '3', '4', '5', '6', '7']
+        })
+        with lock:
+            if response.status_code != 200:
+                client_errors.append(response.status_code)
+                return
+            failed_questions[0] += response.get_json()['report'].count('错误：')
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(args.concurrency)]
+    # redirect_stdout 替换的是全局 sys.stdout，只在主线程中进入一次
+    with contextlib.redirect_stdout(quiet):
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - start
+    mock_config.capacity = 0
+
+    limiter = app_module.get_upstream_guard().limiter.stats()
+    mock_stats = mock_config.stats()
+    result = {
+        'seconds': round(elapsed, 3),
+        'mock_rate_limited': mock_stats['rate_limited'],
+        'mock_peak_in_flight': mock_stats['peak_in_flight'],
+        'limit_after': limiter['limit'],
+        'limit_decreases': limiter['decreases'],
+        'failed_questions': failed_questions[0],
+        'failed_requests': len(client_errors)
+    }
+    checks = {
+        '并发上限在429后降低': limiter['decreases'] > 0,
+        '所有检索请求成功返回': not client_errors,
+        '问题失败比例低于10%': failed_questions[0] <= 0.1 * 7 * args.concurrency
+    }
+    return result, checks
+
+
+def run_outage(app_module, mock_config, quiet):
+    """模拟服务宕机：熔断前的调用经历重试，熔断后立即失败"""
+    mock_config.outage = True
+    guard = app_module.get_upstream_guard()
+    latencies = []
+    errors = []
+    for index in range(BREAKER_THRESHOLD + 5):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(quiet):
+            answer, error = app_module.request_chat_completion(chat_payload(f'宕机{index}'))
+        latencies.append(time.perf_counter() - start)
+        errors.append(error)
+    circuit = guard.breaker.stats()
+    open_latencies = latencies[-3:]
+    result = {
+        'circuit_state': circuit['state'],
+        'latencies_ms': [round(value * 1000, 1) for value in latencies],
+        'fast_fail_ms': round(max(open_latencies) * 1000, 2),
+        'rejections': app_module.metrics.UPSTREAM_REJECTIONS.value(reason='circuit_open')
+    }
+    checks = {
+        '熔断器已打开': circuit['state'] == 'open',
+        '熔断后调用立即失败(<20ms)': max(open_latencies) < 0.02,
+        '熔断后返回服务不可用': all(error and '暂时不可用' in error for error in errors[-3:])
+    }
+    return result, checks
+
+
+def run_recovery(app_module, mock_config, quiet):
+    """模拟服务恢复：等待 reset_timeout 后探测成功，熔断器关闭"""
+    mock_config.outage = False
+    guard = app_module.get_upstream_guard()
+    time.sleep(BREAKER_RESET + 0.1)
+    with contextlib.redirect_stdout(quiet):
+        answer, error = app_module.request_chat_completion(chat_payload('恢复'))
+    circuit = guard.breaker.stats()
+    result = {'circuit_state': circuit['state'], 'transitions': circuit['transitions'], 'error': error}
+    checks = {
+        '探测请求成功': answer is not None,
+        '熔断器已关闭': circuit['state'] == 'closed'
+    }
+    return result, checks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Deepseek 上游故障注入基准')
+    parser.add_argument('--capacity', type=int, default=3, help='overload 场景模拟服务的并发容量')
+    parser.add_argument('--concurrency', type=int, default=3, help='overload 场景同时发出的检索请求数（每个7个问题）')
+    parser.add_argument('--latency', type=float, default=0.2, help='模拟服务平均延迟（秒）')
+    parser.add_argument('--output', help='将结果写入JSON文件')
+    args = parser.parse_args(argv)
+
+    mock_config = MockConfig(latency=args.latency, jitter=args.latency / 4, retry_after=0)
+    server, url = start_mock_server(mock_config)
+    workdir = tempfile.mkdtemp(prefix='legal-upstream-')
+
+    # 必须在导入应用之前设置环境变量
+    os.environ.update({
+        'DEEPSEEK_API_URL': url,
+        'DEEPSEEK_API_KEY': os.environ.get('DEEPSEEK_API_KEY', 'benchmark'),
+        'ANSWER_CACHE_ENABLED': '0',
+        'RESEARCH_JOB_DB': os.path.join(workdir, 'jobs.sqlite3'),
+        'KB_WARMUP': '0',
+        'RESEARCH_MAX_CONCURRENCY': '8',
+        'DEEPSEEK_MAX_IN_FLIGHT': '8',
+        'DEEPSEEK_BREAKER_THRESHOLD': str(BREAKER_THRESHOLD),
+        'DEEPSEEK_BREAKER_RESET': str(BREAKER_RESET),
+        'DEEPSEEK_BACKOFF_BASE': '0.1',
+        'DEEPSEEK_BACKOFF_MAX': '2'
+    })
+    quiet = io.StringIO()
+    with contextlib.redirect_stdout(quiet):
+        from backend import app as app_module
+
+    scenarios = [
+        ('overload', lambda: run_overload(app_module, mock_config, args, quiet)),
+        ('outage', lambda: run_outage(app_module, mock_config, quiet)),
+        ('recovery', lambda: run_recovery(app_module, mock_config, quiet))
+    ]
+    output = {'config': vars(args), 'results': {}}
+    status = 0
+    for name, run in scenarios:
+        result, checks = run()
+        output['results'][name] = dict(result, checks=checks)
+        print(f"[{name}] {json.dumps(result, ensure_ascii=False)}")
+        for description, passed in checks.items():
+            print(f"    {'✓' if passed else '✗'} {description}")
+            if not passed:
+                status = 1
+    print('\n'.join(upstream_metrics(app_module)))
+    server.shutdown()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,250 @@
+"""多 worker 内存基准
+
+用 gunicorn_config.py 启动真实的 gunicorn（连接本地 Deepseek 模拟服务），并发发送检索请求，
+读取 master 和每个 worker 的 /proc/<pid>/smaps_rollup，输出 RSS、PSS（按共享比例分摊）和私有内存(USS)，
+并检查：
+- 所有进程的 PSS 总和不超过内存预算
+- 每个 worker 都处理了请求（CPU时间有增长），即多个 worker 在同时服务
+
+默认先后运行预加载模式 (PRELOAD_KB=1) 和默认模式，便于对比共享带来的节省。仅支持 Linux。
+
+用法：
+    python benchmarks/bench_workers.py                         # 3个worker，两种模式对比
+    python benchmarks/bench_workers.py --workers 4 --memory-budget 512 --mode preload
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.mock_deepseek import MockConfig, start_mock_server  # noqa: E402
+
+JURISDICTIONS = ["英国", "法国", "德国", "土耳其", "阿塞拜疆", "阿根廷", "加拿大", "荷兰"]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def memory_of(pid):
+    """读取进程内存（MB）：rss、pss、uss(私有)、shared"""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                values[parts[0][:-1]] = int(parts[1]) / 1024.0
+    private = values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)
+    return {
+        'rss': round(values.get('Rss', 0), 1),
+        'pss': round(values.get('Pss', 0), 1),
+        'uss': round(private, 1),
+        'shared': round(values.get('Shared_Clean', 0) + values.get('Shared_Dirty', 0), 1)
+    }
+
+
+def cpu_seconds(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    # utime、stime 是 ')' 之后的第12、13个字段
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def children_of(pid):
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def post_json(url, payload, timeout=120):
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode('utf-8'), headers={'Content-Type': 'application/json'}
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.status
+
+
+def wait_for(url, deadline):
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=2) as response:
+                if response.status == 200:
+                    return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def run_mode(mode, args, mock_url, workdir):
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        'PORT': str(port),
+        'PRELOAD_KB': '1' if mode == 'preload' else '0',
+        'WEB_CONCURRENCY': str(args.workers),
+        'GUNICORN_THREADS': str(args.threads),
+        'DEEPSEEK_API_URL': mock_url,
+        'DEEPSEEK_API_KEY': env.get('DEEPSEEK_API_KEY', 'benchmark'),
+        'ANSWER_CACHE_ENABLED': '0',
+        'RESEARCH_JOB_DB': os.path.join(workdir, f'jobs-{mode}.sqlite3'),
+        'PYTHONUNBUFFERED': '1'
+    })
+    log_path = os.path.join(workdir, f'gunicorn-{mode}.log')
+    log = open(log_path, 'w')
+    master = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_config.py', 'backend.app:app'],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    base = f'http://127.0.0.1:{port}'
+    try:
+        if not wait_for(f'{base}/health', time.time() + 60):
+            raise RuntimeError(f'gunicorn 未能启动，日志见 {log_path}')
+        # 等所有 worker 启动
+        deadline = time.time() + 30
+        while len(children_of(master.pid)) < args.workers and time.time() < deadline:
+            time.sleep(0.2)
+        workers = children_of(master.pid)
+        cpu_before = {pid: cpu_seconds(pid) for pid in workers}
+
+        latencies = []
+        failures = [0]
+        lock = threading.Lock()
+        counter = iter(range(args.requests))
+
+        def client():
+            while True:
+                with lock:
+                    index = next(counter, None)
+                if index is None:
+                    return
+                payload = {
+                    'jurisdiction': JURISDICTIONS[index % len(JURISDICTIONS)],
+                    'questions': ['1', '2', '3', '4', '5', '6', '7']
+                }
+                start = time.perf_counter()
+                try:
+                    ok = post_json(f'{base}/api/research', payload) == 200
+                except OSError:
+                    ok = False
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+                    if not ok:
+                        failures[0] += 1
+
+        wall_start = time.perf_counter()
+        clients = [threading.Thread(target=client) for _ in range(args.concurrency)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        wall = time.perf_counter() - wall_start
+
+        processes = {'master': memory_of(master.pid)}
+        busy_workers = 0
+        for pid in workers:
+            try:
+                processes[f'worker-{pid}'] = dict(
+                    memory_of(pid), cpu_seconds=round(cpu_seconds(pid) - cpu_before.get(pid, 0), 3)
+                )
+            except OSError:
+                continue  # worker 已按 max_requests 重启
+            if processes[f'worker-{pid}']['cpu_seconds'] > 0:
+                busy_workers += 1
+        worker_rows = [row for name, row in processes.items() if name != 'master']
+        return {
+            'mode': mode,
+            'workers': len(worker_rows),
+            'busy_workers': busy_workers,
+            'requests': len(latencies),
+            'failures': failures[0],
+            'wall_seconds': round(wall, 3),
+            'avg_latency_seconds': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+            'total_pss_mb': round(sum(row['pss'] for row in processes.values()), 1),
+            'avg_worker_uss_mb': round(sum(row['uss'] for row in worker_rows) / len(worker_rows), 1)
+            if worker_rows else 0.0,
+            'processes': processes
+        }
+    finally:
+        master.send_signal(signal.SIGTERM)
+        try:
+            master.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            master.kill()
+        log.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='多 worker 内存基准')
+    parser.add_argument('--mode', choices=['preload', 'default', 'both'], default='both')
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=24, help='检索请求总数（每个请求7个问题）')
+    parser.add_argument('--concurrency', type=int, default=6, help='并发客户端数')
+    parser.add_argument('--latency', type=float, default=0.2, help='模拟服务平均延迟（秒）')
+    parser.add_argument('--memory-budget', type=float, default=512, help='所有进程PSS总和上限（MB）')
+    parser.add_argument('--output', help='将结果写入JSON文件')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists('/proc/self/smaps_rollup'):
+        print('需要 Linux /proc/<pid>/smaps_rollup')
+        return 2
+
+    server, mock_url = start_mock_server(MockConfig(latency=args.latency, jitter=args.latency / 4))
+    workdir = tempfile.mkdtemp(prefix='legal-workers-')
+    modes = ['preload', 'default'] if args.mode == 'both' else [args.mode]
+    results = []
+    status = 0
+    try:
+        for mode in modes:
+            result = run_mode(mode, args, mock_url, workdir)
+            results.append(result)
+            print(f"[{mode}] {result['workers']} 个worker（{result['busy_workers']} 个处理了请求），"
+                  f"{result['requests']} 个请求 / {result['wall_seconds']}s，失败 {result['failures']}，"
+                  f"平均延迟 {result['avg_latency_seconds']}s")
+            for name, row in result['processes'].items():
+                print(f"    {name:<14} RSS={row['rss']:>7.1f}MB PSS={row['pss']:>7.1f}MB "
+                      f"私有={row['uss']:>7.1f}MB 共享={row['shared']:>7.1f}MB")
+            print(f"    PSS合计 {result['total_pss_mb']}MB（预算 {args.memory_budget}MB），"
+                  f"每个worker私有内存平均 {result['avg_worker_uss_mb']}MB")
+            if mode == 'preload':
+                if result['total_pss_mb'] > args.memory_budget:
+                    print('    ✗ 超出内存预算')
+                    status = 1
+                if result['busy_workers'] < min(2, args.workers) or result['failures']:
+                    print('    ✗ 未能由多个worker并发处理全部请求')
+                    status = 1
+    finally:
+        server.shutdown()
+        if status == 0:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'config': vars(args), 'results': results}, f, ensure_ascii=False, indent=2)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""本地 Deepseek chat-completions 模拟服务
+
+可配置响应延迟、抖动、错误率、限流(429 + Retry-After)和答案长度，用于离线压测和故障注入。
+故障注入：capacity 限制同时处理的请求数，超出时返回429（模拟上游过载）；
+outage 为 True 时所有请求立即返回503（模拟上游宕机），可在运行中切换。
+请求带 "stream": true 时以 SSE（chunked 编码）逐段返回：先等待 first_token × 延迟，
+其余延迟平均分配到各片段；客户端中途断开时停止发送并计入 streams_aborted。
+
+单独运行：
+    python benchmarks/mock_deepseek.py --port 18080 --latency 0.5 --error-rate 0.05
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockConfig:
+    def __init__(self, latency=0.2, jitter=0.0, error_rate=0.0, rate_limit_rate=0.0,
+                 retry_after=1, response_chars=600, seed=0, capacity=0, outage=False,
+                 first_token=0.2, chunk_chars=4):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.response_chars = response_chars
+        self.capacity = capacity
+        self.outage = outage
+        self.first_token = first_token  # 流式响应首个片段前的等待占总延迟的比例
+        self.chunk_chars = chunk_chars  # 每个流式片段的字符数（约一个token）
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.streams = 0
+        self.streams_aborted = 0
+        self.streamed_chars = 0
+
+    def draw(self):
+        """返回 (延迟, 结果类型)，结果类型为 ok / error / rate_limited / outage
+
+        结果为 ok 时计入并发数，响应后需调用 finish()。
+        """
+        with self.lock:
+            self.requests += 1
+            if self.outage:
+                self.errors += 1
+                return 0.0, 'outage'
+            if self.capacity and self.in_flight >= self.capacity:
+                self.rate_limited += 1
+                return 0.0, 'rate_limited'
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            roll = self.random.random()
+            if roll < self.rate_limit_rate:
+                self.rate_limited += 1
+                return delay, 'rate_limited'
+            if roll < self.rate_limit_rate + self.error_rate:
+                self.errors += 1
+                return delay, 'error'
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            return delay, 'ok'
+
+    def finish(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        with self.lock:
+            return {'requests': self.requests, 'errors': self.errors, 'rate_limited': self.rate_limited,
+                    'peak_in_flight': self.peak_in_flight, 'streams': self.streams,
+                    'streams_aborted': self.streams_aborted, 'streamed_chars': self.streamed_chars}
+
+
+def _answer_text(length):
+    base = "结论：有。说明：数据控制者需向监管机构登记并缴纳费用。法律依据：第一条。"
+    return (base * (length // len(base) + 1))[:length]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 头部和正文分两次写出，关闭Nagle避免与延迟ACK叠加产生额外40ms
+    disable_nagle_algorithm = True
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        request = json.loads(self.rfile.read(length) or b'{}')
+        delay, outcome = self.config.draw()
+        if outcome == 'ok':
+            try:
+                if request.get('stream'):
+                    self._stream_answer(request, delay)
+                else:
+                    time.sleep(delay)
+                    self._send_answer(request)
+            finally:
+                self.config.finish()
+            return
+        time.sleep(delay)
+
+        if outcome == 'rate_limited':
+            self._send_json(429, {'error': {'message': 'rate limited'}},
+                            {'Retry-After': str(self.config.retry_after)})
+            return
+        self._send_json(503, {'error': {'message': 'upstream unavailable'}})
+
+    def _send_answer(self, request):
+        prompt_chars = sum(len(m.get('content', '')) for m in request.get('messages', []))
+        content = _answer_text(self.config.response_chars)
+        completion_chars = self.config.response_chars
+        if (request.get('response_format') or {}).get('type') == 'json_object':
+            # 批量模式：按用户消息中的"问题N："逐题返回，键为问题编号
+            user_message = request['messages'][-1].get('content', '')
+            question_ids = re.findall(r'问题(\d+)：', user_message)
+            content = json.dumps({qid: _answer_text(self.config.response_chars) for qid in question_ids},
+                                 ensure_ascii=False)
+            completion_chars = self.config.response_chars * max(1, len(question_ids))
+        self._send_json(200, {
+            'id': 'mock',
+            'object': 'chat.completion',
+            'model': request.get('model'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop'
+            }],
+            'usage': {
+                'prompt_tokens': prompt_chars,
+                'completion_tokens': completion_chars,
+                'total_tokens': prompt_chars + completion_chars
+            }
+        })
+
+    def _write_chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+
+    def _stream_answer(self, request, delay):
+        config = self.config
+        prompt_chars = sum(len(m.get('content', '')) for m in request.get('messages', []))
+        content = _answer_text(config.response_chars)
+        pieces = [content[i:i + config.chunk_chars] for i in range(0, len(content), config.chunk_chars)]
+        interval = delay * (1 - config.first_token) / max(1, len(pieces))
+        with config.lock:
+            config.streams += 1
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        started = time.monotonic() + delay * config.first_token
+        sent = 0
+        try:
+            for index, piece in enumerate(pieces):
+                # 按绝对时间安排每个片段，逐次 sleep 的误差不会累积
+                wait = started + index * interval - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                chunk = {'id': 'mock', 'object': 'chat.completion.chunk', 'model': request.get('model'),
+                         'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]}
+                self._write_chunk(b'data: ' + json.dumps(chunk, ensure_ascii=False).encode('utf-8') + b'\n\n')
+                sent += len(piece)
+            if (request.get('stream_options') or {}).get('include_usage'):
+                usage = {'id': 'mock', 'object': 'chat.completion.chunk', 'choices': [], 'usage': {
+                    'prompt_tokens': prompt_chars,
+                    'completion_tokens': sent,
+                    'total_tokens': prompt_chars + sent
+                }}
+                self._write_chunk(b'data: ' + json.dumps(usage).encode('utf-8') + b'\n\n')
+            self._write_chunk(b'data: [DONE]\n\n')
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端已断开：停止生成
+            self.close_connection = True
+            with config.lock:
+                config.streams_aborted += 1
+        finally:
+            with config.lock:
+                config.streamed_chars += sent
+
+
+def start_mock_server(config, host='127.0.0.1', port=0):
+    """在后台线程启动模拟服务，返回 (server, url)"""
+    handler = type('ConfiguredMockHandler', (MockHandler,), {'config': config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://{host}:{server.server_address[1]}/v1/chat/completions"
+    return server, url
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Deepseek chat-completions 模拟服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--latency', type=float, default=0.2, help='平均响应延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.0, help='延迟抖动幅度（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回503的比例')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='返回429的比例')
+    parser.add_argument('--retry-after', type=int, default=1, help='429响应的Retry-After秒数')
+    parser.add_argument('--response-chars', type=int, default=600, help='答案长度（字符）')
+    parser.add_argument('--capacity', type=int, default=0, help='同时处理的请求上限，超出返回429（0表示不限）')
+    parser.add_argument('--outage', action='store_true', help='所有请求返回503')
+    args = parser.parse_args()
+
+    config = MockConfig(args.latency, args.jitter, args.error_rate, args.rate_limit_rate,
+                        args.retry_after, args.response_chars, capacity=args.capacity, outage=args.outage)
+    server, url = start_mock_server(config, args.host, args.port)
+    print(f"模拟服务已启动: {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
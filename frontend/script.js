@@ -219,7 +219,7 @@ async function generateReport() {
     setLoadingState(true);
     
     try {
-        const response = await fetch(`${API_BASE_URL}/research`, {
+        const response = await fetch(`${API_BASE_URL}/research/stream`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -242,13 +242,23 @@ async function generateReport() {
             throw new Error(errorMsg);
         }
         
-        const text = await response.text();
-        if (!text) {
-            throw new Error('服务器返回空响应');
-        }
+        let finished = false;
+        await readEventStream(response, (event) => {
+            if (event.type === 'start') {
+                startProgressiveReport(event);
+            } else if (event.type === 'delta') {
+                appendAnswerDelta(event);
+            } else if (event.type === 'answer') {
+                updateProgressiveReport(event);
+            } else if (event.type === 'done') {
+                finished = true;
+                displayReport(event);
+            }
+        });
         
-        const result = JSON.parse(text);
-        displayReport(result);
+        if (!finished) {
+            throw new Error('服务器连接中断，报告未完成');
+        }
         
     } catch (error) {
         console.error('生成报告失败:', error);
@@ -258,10 +268,122 @@ async function generateReport() {
     }
 }
 
+// 逐行读取NDJSON流，每解析出一个事件就回调一次
+async function readEventStream(response, onEvent) {
+    const handleLine = (line) => {
+        if (line.trim()) {
+            onEvent(JSON.parse(line));
+        }
+    };
+    
+    if (!response.body || !response.body.getReader) {
+        // 不支持流式读取的浏览器：等待全部内容后再逐行处理
+        const text = await response.text();
+        text.split('\n').forEach(handleLine);
+        return;
+    }
+    
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder('utf-8');
+    let buffer = '';
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) {
+            break;
+        }
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        lines.forEach(handleLine);
+    }
+    buffer += decoder.decode();
+    handleLine(buffer);
+}
+
+// 流式报告的当前状态
+let progressiveReport = null;
+
+// 收到start事件：先展示各司法辖区的引言和待生成的问题
+function startProgressiveReport(event) {
+    progressiveReport = {
+        sections: event.sections,
+        answers: {},
+        partials: {},
+        renderScheduled: false,
+        total: event.sections.reduce((sum, section) => sum + section.questions.length, 0)
+    };
+    
+    document.getElementById('reportTitleContainer').innerHTML = `
+        <h3>出海目标国数据隐私准入法律检索报告</h3>
+        <p class="report-meta">生成中: 已完成 0/${progressiveReport.total}</p>
+    `;
+    renderProgressiveReport();
+    
+    resultsSection.style.display = 'block';
+    resultsSection.scrollIntoView({ behavior: 'smooth' });
+}
+
+// 收到answer事件：填入对应司法辖区、对应问题的答案
+function updateProgressiveReport(event) {
+    if (!progressiveReport) {
+        return;
+    }
+    const key = `${event.jurisdiction}:${event.question_id}`;
+    progressiveReport.answers[key] = event.answer;
+    delete progressiveReport.partials[key];
+    
+    const completed = Object.keys(progressiveReport.answers).length;
+    const meta = document.querySelector('#reportTitleContainer .report-meta');
+    if (meta) {
+        meta.textContent = `生成中: 已完成 ${completed}/${progressiveReport.total}`;
+    }
+    renderProgressiveReport();
+}
+
+// 收到delta事件：追加生成中答案的片段（reset 时先清空），每帧最多重绘一次
+function appendAnswerDelta(event) {
+    if (!progressiveReport) {
+        return;
+    }
+    const key = `${event.jurisdiction}:${event.question_id}`;
+    if (key in progressiveReport.answers) {
+        return;
+    }
+    const previous = event.reset ? '' : (progressiveReport.partials[key] || '');
+    progressiveReport.partials[key] = previous + event.text;
+    
+    if (!progressiveReport.renderScheduled) {
+        progressiveReport.renderScheduled = true;
+        requestAnimationFrame(() => {
+            if (progressiveReport) {
+                progressiveReport.renderScheduled = false;
+                renderProgressiveReport();
+            }
+        });
+    }
+}
+
+const SECTION_NUMERALS = ['一', '二', '三', '四', '五', '六', '七', '八', '九', '十'];
+
+function renderProgressiveReport() {
+    const { sections, answers, partials } = progressiveReport;
+    const parts = sections.map((section, index) => {
+        const numeral = SECTION_NUMERALS[index] || String(index + 1);
+        let text = `(${numeral}) ${section.jurisdiction}\n\n${section.introduction}`;
+        section.questions.forEach(question => {
+            const key = `${section.jurisdiction}:${question.question_id}`;
+            const answer = answers[key] || partials[key] || '生成中...';
+            text += `\n\nQ${question.question_id}: ${question.question_title}\nA: ${answer}`;
+        });
+        return text;
+    });
+    reportContent.innerHTML = `<div class="report-content-text">${formatReportContent(parts.join('\n\n'))}</div>`;
+}
+
 // 设置加载状态
 function setLoadingState(loading) {
     const btnText = generateBtn.querySelector('.btn-text');
-    
+
     if (loading) {
         btnText.textContent = '生成中...';
         generateBtn.disabled = true;
@@ -340,6 +462,8 @@ async function exportWordDocument() {
 }
 
 function displayReport(result) {
+    progressiveReport = null;
+    
     // 显示报告标题
     document.getElementById('reportTitleContainer').innerHTML = `
         <h3>出海目标国数据隐私准入法律检索报告</h3>
@@ -363,10 +487,10 @@ if (exportBtn) {
 
 // 格式化报告内容
 function formatReportContent(content) {
-    // 将换行符转换为HTML换行标签，移除加粗和斜体样式
+    // 司法辖区章节标题（(一) 英国、(二) 法国……）显示为标题，再将换行符转换为HTML换行标签
     return content
-        .replace(/\n/g, '<br>')
-        .replace(/((一) [^\n]+)/g, '<h3>$1</h3>');
+        .replace(/^(\([一二三四五六七八九十]+\) .+)$/gm, '<h3>$1</h3>')
+        .replace(/\n/g, '<br>');
 }
 
 // 显示错误信息
@@ -1,17 +1,70 @@
-"""Gunicorn配置文件 - 优化Render部署"""
+"""Gunicorn配置文件 - 优化Render部署
+
+两种模式：
+- 默认：1个worker、1个线程，每个worker自行解析知识库（内存最省，适合免费套餐）
+- PRELOAD_KB=1：master 在 fork 前解析并索引全部知识库后调用 gc.freeze()，worker 以写时复制方式共享，
+  worker 数和线程数根据可用内存和CPU计算（可用 WEB_CONCURRENCY / GUNICORN_THREADS 覆盖）
+"""
+import gc
 import multiprocessing
 import os
 
+PRELOAD_KB = os.environ.get('PRELOAD_KB', '0') == '1'
+
+
+def _memory_limit_mb():
+    """容器内存上限（cgroup v2/v1），取不到时使用系统可用内存"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:  # cgroup v1 无限制时是一个极大值
+            return int(value) / (1024 * 1024)
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+# 内存预算（MB）：默认取容器上限，预留20%给页缓存和突发
+MEMORY_BUDGET_MB = float(os.environ.get('MEMORY_BUDGET_MB') or _memory_limit_mb() or 512)
+# master（含共享的知识库和索引）与每个worker私有内存的估算值，见 benchmarks/bench_workers.py 的实测结果
+MASTER_MEMORY_MB = float(os.environ.get('MASTER_MEMORY_MB', '110'))
+WORKER_MEMORY_MB = float(os.environ.get('WORKER_MEMORY_MB', '45'))
+
+
+def _preload_workers():
+    cpus = multiprocessing.cpu_count()
+    by_memory = int((MEMORY_BUDGET_MB * 0.8 - MASTER_MEMORY_MB) // WORKER_MEMORY_MB)
+    return max(1, min(2 * cpus + 1, by_memory))
+
+
+def _preload_threads():
+    # 请求大部分时间在等待AI接口，线程数按CPU放大，上限8
+    return max(4, min(8, 2 * multiprocessing.cpu_count()))
+
 # 绑定地址
 bind = f"0.0.0.0:{os.environ.get('PORT', '5001')}"
 
 # Worker配置
-workers = 1  # Render免费套餐内存有限，使用1个worker
+if PRELOAD_KB:
+    workers = int(os.environ.get('WEB_CONCURRENCY') or _preload_workers())
+    threads = int(os.environ.get('GUNICORN_THREADS') or _preload_threads())
+else:
+    workers = int(os.environ.get('WEB_CONCURRENCY') or 1)  # Render免费套餐内存有限，使用1个worker
+    threads = int(os.environ.get('GUNICORN_THREADS') or 1)  # 单线程处理
 worker_class = 'gthread'  # 使用线程worker，更适合I/O密集型任务
 worker_connections = 100  # 减少并发连接数
-max_requests = 50  # 每50个请求后重启worker
-max_requests_jitter = 5
-threads = 1  # 单线程处理
+# 处理指定数量的请求后重启worker，0表示不重启（默认）：知识库解析为流式、各缓存都有上限，内存不随请求数增长；
+# 需要时可作为保险开启（预加载模式下重新fork的worker同样共享master内存）
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
 
 # 超时配置
 timeout = 0  # 禁用超时，允许长时间API调用
@@ -27,8 +80,9 @@ access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s"
 # 进程命名
 proc_name = 'legal-research-app'
 
-# 预加载应用（可选，节省内存）
-preload_app = False  # 设为False避免fork问题
+# 预加载应用：PRELOAD_KB 模式下在master中导入应用并加载知识库；
+# 线程池、连接池、监视线程等都按进程懒创建，fork 后由各 worker 自行创建
+preload_app = PRELOAD_KB
 
 # Worker临时目录
 worker_tmp_dir = '/dev/shm'  # 使用内存文件系统，更快
@@ -38,6 +92,32 @@ limit_request_line = 4096
 limit_request_fields = 100
 limit_request_field_size = 8190
 
+def when_ready(server):
+    """master 启动完成、fork worker 之前：预加载知识库并冻结GC"""
+    if not PRELOAD_KB:
+        return
+    from backend.app import preload_knowledge_base
+    stats = preload_knowledge_base()
+    server.log.info(
+        "知识库预加载完成: %d 个司法辖区, %d 个文件, %d 字符, 耗时 %.2f 秒",
+        len(stats['jurisdictions']), stats['files'], stats['chars'], stats['seconds']
+    )
+    server.log.info("workers=%d threads=%d memory_budget=%.0fMB", workers, threads, MEMORY_BUDGET_MB)
+    # 把现有对象移出GC管理：worker 中的垃圾回收不再遍历（写入）这些对象，共享页保持不被复制
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    server.log.info("Worker %s 已启动 (preload=%s, frozen_objects=%d)", worker.pid, PRELOAD_KB, gc.get_freeze_count())
+
+
+def post_worker_init(worker):
+    """worker 加载应用后立即在后台预热，不等第一个请求；/api/ready 在预热完成后返回200"""
+    from backend.app import start_warmup
+    start_warmup()
+
+
 def worker_int(worker):
     """Worker被中断时的处理"""
     worker.log.info("Worker received INT or QUIT signal")
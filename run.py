@@ -76,6 +76,19 @@ def start_backend():
     os.chdir("backend")
     return subprocess.Popen([sys.executable, "app.py"])
 
+def wait_for_backend(url="http://localhost:5001/health", timeout=30):
+    """轮询健康检查端点直到后端可以响应，返回是否在超时前启动"""
+    from urllib.request import urlopen
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
 def open_frontend():
     """打开前端页面"""
     # 返回项目根目录
@@ -109,7 +122,8 @@ def main():
         
         # 等待后端启动
         print("等待后端服务启动...")
-        time.sleep(3)
+        if not wait_for_backend():
+            print("⚠ 后端在30秒内未响应健康检查，仍尝试打开前端页面")
         
         # 打开前端
         open_frontend()
@@ -0,0 +1,22 @@
+"""测试公共设置：仓库根目录加入 sys.path，提供本地 Deepseek 模拟服务"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.mock_deepseek import MockConfig, start_mock_server  # noqa: E402
+
+
+@pytest.fixture
+def mock_deepseek():
+    """启动模拟服务，返回 (config, url)；可在测试中修改 config.outage 等字段注入故障"""
+    config = MockConfig(latency=0.0, response_chars=40)
+    server, url = start_mock_server(config)
+    try:
+        yield config, url
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,89 @@
+import docx
+from docx.enum.section import WD_SECTION
+from docx.enum.text import WD_BREAK
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+
+from backend.docx_text import extract_text, iter_paragraphs
+
+
+def build(path, fill):
+    document = docx.Document()
+    fill(document)
+    document.save(str(path))
+    return str(path)
+
+
+def test_paragraphs_match_python_docx(tmp_path):
+    def fill(document):
+        document.add_heading('第一条 总则', level=1)
+        document.add_paragraph('本法适用于\t个人数据。')
+        paragraph = document.add_paragraph('第一行')
+        run = paragraph.add_run()
+        run.add_break()
+        run.add_text('第二行')
+        paragraph.add_run().add_break(WD_BREAK.PAGE)
+        document.add_paragraph('')
+        document.add_paragraph('Article 2 Scope')
+
+    path = build(tmp_path / 'paragraphs.docx', fill)
+    expected = [p.text for p in docx.Document(path).paragraphs]
+    assert list(iter_paragraphs(path)) == expected
+    assert extract_text(path) == '\n'.join(expected)
+    assert '第一行\n第二行' in expected
+
+
+def test_tables_are_one_line_per_row(tmp_path):
+    def fill(document):
+        document.add_paragraph('前言')
+        table = document.add_table(rows=2, cols=2)
+        table.cell(0, 0).text = '条款'
+        table.cell(0, 1).text = '内容'
+        table.cell(1, 0).text = '第1条'
+        cell = table.cell(1, 1)
+        cell.text = '第一段'
+        cell.add_paragraph('第二段')
+        inner = cell.add_table(rows=1, cols=2)
+        inner.cell(0, 0).text = 'a'
+        inner.cell(0, 1).text = 'b'
+        document.add_table(rows=1, cols=2)  # 空行不输出
+        document.add_paragraph('结尾')
+
+    path = build(tmp_path / 'tables.docx', fill)
+    assert list(iter_paragraphs(path)) == ['前言', '条款 | 内容', '第1条 | 第一段 第二段 a | b', '结尾']
+
+
+def test_deleted_text_and_tab_stops_are_skipped(tmp_path):
+    def fill(document):
+        paragraph = document.add_paragraph('保留')
+        paragraph.paragraph_format.tab_stops.add_tab_stop(docx.shared.Inches(1))
+        paragraph._p.append(parse_xml(
+            f'<w:del {nsdecls("w")} w:id="1" w:author="a">'
+            '<w:r><w:delText>删除的文字</w:delText></w:r></w:del>'
+        ))
+        paragraph.add_run('文字')
+
+    path = build(tmp_path / 'revisions.docx', fill)
+    assert list(iter_paragraphs(path)) == ['保留文字']
+
+
+def test_headers_and_footers_are_deduplicated(tmp_path):
+    def fill(document):
+        section = document.sections[0]
+        section.header.paragraphs[0].text = '机密'
+        section.footer.paragraphs[0].text = '第 1 页'
+        document.add_paragraph('正文一')
+        second = document.add_section(WD_SECTION.NEW_PAGE)
+        second.header.is_linked_to_previous = False
+        second.header.paragraphs[0].text = '机密'
+        second.footer.is_linked_to_previous = False
+        second.footer.paragraphs[0].text = '附录'
+        document.add_paragraph('正文二')
+
+    path = build(tmp_path / 'header.docx', fill)
+    lines = list(iter_paragraphs(path))
+    assert lines[0] == '机密'
+    assert lines.count('机密') == 1
+    assert sorted(lines[-2:]) == sorted(['第 1 页', '附录'])
+    # 正文与 python-docx 一致（含分节符所在的空段落）
+    assert lines[1:-2] == [p.text for p in docx.Document(path).paragraphs]
@@ -0,0 +1,105 @@
+from backend.kb_articles import ArticleIndex, ArticleSpans, chinese_to_int, parse_articles, parse_citation
+from backend.kb_index import BM25Index, KnowledgeText, TextLines
+
+
+def spans(lines):
+    return [(s.start, s.end, s.line, s.number, s.label, s.heading) for s in parse_articles(lines)]
+
+
+def test_chinese_numbers():
+    assert chinese_to_int('十') == 10
+    assert chinese_to_int('二十') == 20
+    assert chinese_to_int('一百二十三') == 123
+    assert chinese_to_int('45') == 45
+
+
+def test_strong_markers_split_articles():
+    lines = ['第一条 总则', '内容一', '', '第十二条 内容十二', '']
+    assert spans(lines) == [(0, 2, 0, '1', '第1条', '总则'), (3, 4, 3, '12', '第12条', '内容十二')]
+
+
+def test_strong_markers_take_precedence_over_numbered_items():
+    lines = ['Article 3 Scope', '1. This Regulation applies', '2. It does not apply', 'Article 4 Definitions']
+    assert [s[3] for s in spans(lines)] == ['3', '4']
+    assert spans(lines)[0][:2] == (0, 3)
+
+
+def test_heading_line_before_marker_joins_article():
+    lines = ['Kapsam', 'MADDE 1 –', 'Bu Kanunun amacı', 'Tanımlar', 'MADDE 2 –', 'Bu Kanunun uygulanmasında']
+    assert spans(lines) == [(0, 3, 1, '1', 'MADDE 1', 'Kapsam'), (3, 6, 4, '2', 'MADDE 2', 'Tanımlar')]
+
+
+def test_numbered_lines_group_subsections():
+    lines = ['Intro', '1. First rule', '1.1. sub', '2. Second', '2013. year', '90.1. inserted']
+    assert spans(lines) == [
+        (1, 3, 1, '1', '§1', 'First rule'),
+        (3, 5, 3, '2', '§2', 'Second'),
+        (5, 6, 5, '90.1', '§90.1', 'inserted'),
+    ]
+
+
+def test_references_and_unmarked_files_produce_no_articles():
+    assert spans(['Section 2 of the Act says', 'plain text']) == []
+    assert spans(['指南', '没有条文编号的说明']) == []
+
+
+def test_parse_citation():
+    for citation, number in [('137', '137'), ('s.137', '137'), ('Article 3', '3'), ('第十二条', '12'),
+                             ('十二', '12'), ('MADDE 16', '16'), ('§ 5', '5'), ('Reg. 2', '2')]:
+        assert parse_citation(citation) == number
+    assert parse_citation('abc') is None
+    assert parse_citation('') is None
+
+
+SECTIONS = [
+    ('gdpr.txt', ['欧盟 - GDPR', '', 'Article 1 Subject-matter', 'This Regulation lays down rules.',
+                  'Article 2 Material scope', '  applies to processing  ', '']),
+    ('dpa.txt', ['英国 - Data Protection Act', '', '137 Charges payable', 'The Commissioner may charge.']),
+    ('guide.txt', ['英国 - Guidance', 'no numbered rules here']),
+]
+
+
+def test_article_index_lookup():
+    index = ArticleIndex('英国', SECTIONS)
+    assert len(index) == 3
+
+    article, = index.lookup('2')
+    assert article.law == '欧盟 - GDPR'
+    assert article.source == 'gdpr.txt'
+    assert article.label == 'Article 2'
+    assert article.text == 'Article 2 Material scope\napplies to processing'
+
+    article, = index.lookup('137', law='data protection')
+    assert article.law == 'Data Protection Act'
+    assert index.lookup('137', law='gdpr') == []
+    assert index.lookup('999') == []
+
+    assert index.laws() == [('欧盟 - GDPR', 'gdpr.txt', ['Article 1', 'Article 2']),
+                            ('Data Protection Act', 'dpa.txt', ['§137'])]
+
+
+def test_article_spans_find():
+    article_spans = ArticleSpans.parse(SECTIONS)
+    assert article_spans.find(0, 1) is None
+    assert article_spans.find(0, 3).label == 'Article 1'
+    assert article_spans.find(0, 5).label == 'Article 2'
+    # 条文末尾的空行不属于该条
+    assert article_spans.find(0, 6) is None
+    assert article_spans.find(1, 3).number == '137'
+    assert article_spans.find(2, 1) is None
+
+
+def test_index_shares_article_spans_with_bm25():
+    index = ArticleIndex('英国', SECTIONS)
+    spans = ArticleSpans.parse(SECTIONS)
+    for section_id, (_, lines) in enumerate(SECTIONS):
+        for line_no in range(len(lines)):
+            assert index.spans.find(section_id, line_no) == spans.find(section_id, line_no)
+
+    sections = [(title, TextLines('\n'.join(lines))) for title, lines in SECTIONS]
+    articles = ArticleIndex('英国', sections)
+    bm25 = BM25Index(KnowledgeText(sections, articles.spans))
+    # 不再切分一遍，条文位置的内存只计入快照
+    assert bm25.articles is articles.spans
+    standalone = BM25Index(KnowledgeText(sections))
+    assert standalone.memory_bytes() == bm25.memory_bytes() + articles.spans.memory_bytes()
@@ -0,0 +1,159 @@
+import threading
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import pytest
+
+from backend.single_flight import SingleFlight
+
+
+def run_concurrently(flight, key, fn, callers, **kwargs):
+    """callers 个线程同时调用 flight.do()，返回各自的结果或异常"""
+    with ThreadPoolExecutor(callers) as pool:
+        futures = [pool.submit(flight.do, key, fn, **kwargs) for _ in range(callers)]
+        outcomes = []
+        for future in futures:
+            try:
+                outcomes.append(future.result(10))
+            except Exception as e:
+                outcomes.append(e)
+        return outcomes
+
+
+def test_do_runs_once_for_concurrent_callers():
+    flight = SingleFlight('test')
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return object()
+
+    with ThreadPoolExecutor(4) as pool:
+        leader = pool.submit(flight.do, 'k', work)
+        assert started.wait(5)
+        waiters = [pool.submit(flight.do, 'k', work) for _ in range(3)]
+        while flight.stats()['coalesced'] < 3:
+            threading.Event().wait(0.01)
+        release.set()
+        results = [leader.result(5)] + [w.result(5) for w in waiters]
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert flight.stats() == dict(flight.stats(), in_flight=0, leaders=1, coalesced=3)
+
+
+def test_do_shares_exception_and_forgets_finished_calls():
+    flight = SingleFlight('test')
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise ValueError('boom')
+
+    with pytest.raises(ValueError):
+        flight.do('k', fail)
+    # 结束后不缓存：下一次调用重新执行
+    assert flight.do('k', lambda: 42) == 42
+    assert len(calls) == 1
+
+    gate = threading.Event()
+
+    def slow_fail():
+        gate.wait(5)
+        raise ValueError('shared')
+
+    threading.Timer(0.1, gate.set).start()
+    outcomes = run_concurrently(flight, 'k2', slow_fail, 3)
+    assert all(isinstance(outcome, ValueError) for outcome in outcomes)
+
+
+def test_do_waiter_timeout_does_not_affect_leader():
+    flight = SingleFlight('test')
+    started = threading.Event()
+    release = threading.Event()
+
+    def work():
+        started.set()
+        release.wait(5)
+        return 'done'
+
+    with ThreadPoolExecutor(1) as pool:
+        leader = pool.submit(flight.do, 'k', work)
+        assert started.wait(5)
+        with pytest.raises(FutureTimeoutError):
+            flight.do('k', work, timeout=0.05)
+        release.set()
+        assert leader.result(5) == 'done'
+    assert flight.stats()['timeouts'] == 1
+
+
+def test_disabled_runs_every_call():
+    flight = SingleFlight('test', enabled=False)
+    calls = []
+    run_concurrently(flight, 'k', lambda: calls.append(1), 3)
+    assert len(calls) == 3
+    assert flight.stats()['leaders'] == 0
+
+
+def test_share_submits_once_and_forwards_result():
+    flight = SingleFlight('test')
+    task = Future()
+    starts = []
+    joined = []
+
+    def start():
+        starts.append(1)
+        return task
+
+    first = flight.share('k', start, join=joined.append)
+    second = flight.share('k', start, join=joined.append)
+    assert len(starts) == 1
+    assert joined == [task, task]
+    assert first is not second
+
+    task.set_running_or_notify_cancel()
+    task.set_result('report')
+    assert first.result(1) == second.result(1) == 'report'
+    assert flight.stats()['in_flight'] == 0
+
+    # 任务结束后再次调用会重新提交
+    flight.share('k', lambda: Future())
+    assert flight.stats()['leaders'] == 2
+
+
+def test_share_cancels_task_only_when_every_caller_cancels():
+    flight = SingleFlight('test')
+    task = Future()
+    first = flight.share('k', lambda: task)
+    second = flight.share('k', lambda: Future())
+
+    assert first.cancel()
+    assert not task.cancelled()
+    assert second.cancel()
+    assert task.cancelled()
+
+    # 被放弃的任务已移除，新调用者重新提交
+    replacement = Future()
+    third = flight.share('k', lambda: replacement)
+    replacement.set_running_or_notify_cancel()
+    replacement.set_result(1)
+    assert third.result(1) == 1
+
+
+def test_share_forwards_exception_and_cancellation():
+    flight = SingleFlight('test')
+    task = Future()
+    proxy = flight.share('k', lambda: task)
+    task.set_running_or_notify_cancel()
+    task.set_exception(RuntimeError('failed'))
+    with pytest.raises(RuntimeError):
+        proxy.result(1)
+
+    task = Future()
+    proxy = flight.share('k2', lambda: task)
+    task.cancel()
+    with pytest.raises(CancelledError):
+        proxy.result(1)
@@ -0,0 +1,204 @@
+import threading
+
+import pytest
+
+from backend.deepseek_client import DeepSeekClient
+from backend.upstream_guard import (
+    CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN, CIRCUIT_OPEN,
+    OUTCOME_CLIENT_ERROR, OUTCOME_INVALID, OUTCOME_OK, OUTCOME_RATE_LIMITED, OUTCOME_UNAVAILABLE,
+    AdaptiveLimiter, CircuitBreaker, UpstreamGuard, UpstreamUnavailable, classify_status, parse_retry_after
+)
+
+
+def expire(breaker):
+    """跳过 reset_timeout 的等待"""
+    breaker.opened_at -= breaker.reset_timeout + 1
+
+
+def test_classify_status():
+    assert classify_status(429) == OUTCOME_RATE_LIMITED
+    assert classify_status(503) == OUTCOME_UNAVAILABLE
+    assert classify_status(408) == OUTCOME_UNAVAILABLE
+    assert classify_status(400) == OUTCOME_CLIENT_ERROR
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('3') == 3.0
+    assert parse_retry_after('-1') == 0.0
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after(None) is None
+
+
+def test_limiter_halves_once_per_round_and_grows_additively():
+    limiter = AdaptiveLimiter(8)
+    permits = [limiter.acquire() for _ in range(4)]
+    # 同一轮发出的请求先后失败，只减半一次
+    for permit in permits:
+        limiter.release(permit, OUTCOME_UNAVAILABLE)
+    assert limiter.stats()['limit'] == 4
+    assert limiter.decreases == 1
+
+    # 减半之后发出的请求再次失败才继续减半，且不低于下限
+    for expected in (2, 1, 1):
+        limiter.release(limiter.acquire(), OUTCOME_RATE_LIMITED)
+        assert limiter.stats()['limit'] == expected
+
+    # 成功时每次加 1/上限：1 -> 2 -> 2.5 -> 2.9 -> 3.24
+    for expected in (2, 2, 2, 3):
+        limiter.release(limiter.acquire(), OUTCOME_OK)
+        assert limiter.stats()['limit'] == expected
+
+
+def test_limiter_ignores_client_errors_and_never_exceeds_max():
+    limiter = AdaptiveLimiter(2)
+    limiter.release(limiter.acquire(), OUTCOME_CLIENT_ERROR)
+    limiter.release(limiter.acquire(), OUTCOME_INVALID)
+    limiter.release(limiter.acquire(), OUTCOME_OK)
+    assert limiter.stats() == dict(limiter.stats(), limit=2, in_flight=0, increases=0, decreases=0)
+
+
+def test_limiter_acquire_blocks_at_limit():
+    limiter = AdaptiveLimiter(1)
+    permit = limiter.acquire()
+    assert limiter.acquire(timeout=0.05) is None
+
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(limiter.acquire(timeout=5)))
+    waiter.start()
+    limiter.release(permit, OUTCOME_OK)
+    waiter.join(5)
+    assert acquired and acquired[0] is not None
+    assert limiter.stats()['in_flight'] == 1
+
+
+def test_breaker_opens_after_threshold_and_probes_once():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record(OUTCOME_UNAVAILABLE)
+    assert breaker.state == CIRCUIT_CLOSED
+    breaker.record(OUTCOME_UNAVAILABLE)
+    assert breaker.state == CIRCUIT_OPEN
+    assert not breaker.allow()
+    assert 0 < breaker.retry_in() <= 30
+
+    expire(breaker)
+    assert breaker.allow()
+    assert breaker.state == CIRCUIT_HALF_OPEN
+    # 探测进行中，其他请求不放行
+    assert not breaker.allow()
+
+    breaker.record(OUTCOME_OK)
+    assert breaker.state == CIRCUIT_CLOSED
+    assert breaker.stats()['consecutive_failures'] == 0
+    assert breaker.allow() and breaker.allow()
+
+
+def test_breaker_failed_probe_reopens():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record(OUTCOME_UNAVAILABLE)
+    expire(breaker)
+    assert breaker.allow()
+    breaker.record(OUTCOME_UNAVAILABLE)
+    assert breaker.state == CIRCUIT_OPEN
+    assert not breaker.allow()
+    assert breaker.transitions == 3
+
+
+def test_breaker_invalid_outcome_frees_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record(OUTCOME_UNAVAILABLE)
+    expire(breaker)
+    assert breaker.allow()
+    breaker.record(OUTCOME_INVALID)
+    assert breaker.state == CIRCUIT_HALF_OPEN
+    assert breaker.allow()
+
+
+def test_breaker_counts_only_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=2)
+    breaker.record(OUTCOME_UNAVAILABLE)
+    breaker.record(OUTCOME_RATE_LIMITED)  # 429 说明上游可达
+    breaker.record(OUTCOME_UNAVAILABLE)
+    assert breaker.state == CIRCUIT_CLOSED
+
+
+def test_backoff_delay():
+    guard = UpstreamGuard(backoff_base=1.0, backoff_max=4.0)
+    for attempt, cap in ((1, 1.0), (2, 2.0), (3, 4.0), (6, 4.0)):
+        assert cap / 2 <= guard.backoff_delay(attempt) <= cap
+    assert 2.0 <= guard.backoff_delay(1, retry_after=2.0) <= 3.0
+    assert guard.backoff_delay(1, retry_after=5.0) is None
+
+
+def test_guard_limit_timeout_releases_probe():
+    guard = UpstreamGuard(max_in_flight=1, acquire_timeout=0.05, failure_threshold=1, reset_timeout=30)
+    permit = guard.acquire()
+    guard.release(permit, OUTCOME_UNAVAILABLE)
+    assert guard.breaker.state == CIRCUIT_OPEN
+    with pytest.raises(UpstreamUnavailable) as excinfo:
+        guard.acquire()
+    assert excinfo.value.reason == 'circuit_open'
+
+    expire(guard.breaker)
+    held = guard.limiter.acquire()
+    with pytest.raises(UpstreamUnavailable) as excinfo:
+        guard.acquire()
+    assert excinfo.value.reason == 'limit_timeout'
+    guard.limiter.release(held, OUTCOME_INVALID)
+    # 等待超时的请求没有发出，探测名额让给下一个请求
+    guard.release(guard.acquire(), OUTCOME_OK)
+    assert guard.breaker.state == CIRCUIT_CLOSED
+
+
+def call(guard, client):
+    """与 app 中的调用方式相同：取得许可、发送请求、按状态码归类结果后交还"""
+    permit = guard.acquire()
+    outcome = OUTCOME_UNAVAILABLE
+    try:
+        response = client.post({'model': 'mock', 'messages': [{'role': 'user', 'content': '问题'}]})
+        outcome = OUTCOME_OK if response.ok else classify_status(response.status_code)
+        return response.status_code
+    finally:
+        guard.release(permit, outcome)
+
+
+def test_guard_against_mock_outage(mock_deepseek):
+    config, url = mock_deepseek
+    guard = UpstreamGuard(max_in_flight=4, failure_threshold=3, reset_timeout=30)
+    client = DeepSeekClient(url, 'test', pool_size=2)
+    try:
+        assert call(guard, client) == 200
+
+        config.outage = True
+        for _ in range(3):
+            assert call(guard, client) == 503
+        assert guard.breaker.state == CIRCUIT_OPEN
+        assert guard.limiter.stats()['limit'] < 4
+        requests_before = config.stats()['requests']
+        with pytest.raises(UpstreamUnavailable):
+            call(guard, client)
+        # 熔断期间不再发出请求
+        assert config.stats()['requests'] == requests_before
+
+        config.outage = False
+        expire(guard.breaker)
+        assert call(guard, client) == 200
+        assert guard.breaker.state == CIRCUIT_CLOSED
+    finally:
+        client.close()
+
+
+def test_guard_against_mock_rate_limit(mock_deepseek):
+    config, url = mock_deepseek
+    config.rate_limit_rate = 1.0
+    guard = UpstreamGuard(max_in_flight=8, failure_threshold=1)
+    client = DeepSeekClient(url, 'test')
+    try:
+        assert call(guard, client) == 429
+        # 429 降低并发上限，但上游可达，不打开熔断器
+        assert guard.limiter.stats()['limit'] == 4
+        assert guard.breaker.state == CIRCUIT_CLOSED
+    finally:
+        client.close()
@@ -0,0 +1,37 @@
+from backend.docx_text import iter_paragraphs
+from backend.word_export import GENERATED_AT_MARK, package_report, render_report, render_report_body
+
+REPORT = '\n'.join([
+    '以下是基于英国相关法律法规的数据隐私准入制度检索结果。',
+    '(一) 英国',
+    'Q1: 是否有准入要求？',
+    'A: 有。需向ICO登记。法律依据：Data Protection Act 137',
+    f'(二) 法国 {GENERATED_AT_MARK}',
+])
+
+
+def lines_of(data, tmp_path, name):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return list(iter_paragraphs(str(path)))
+
+
+def test_cached_body_takes_the_download_time(tmp_path):
+    body = render_report_body(REPORT, '英国')
+    first = lines_of(package_report(body, '2026年01月01日 09:00:00'), tmp_path, 'first.docx')
+    second = lines_of(package_report(body, '2026年01月01日 09:00:05'), tmp_path, 'second.docx')
+
+    assert '生成时间：2026年01月01日 09:00:00' in first
+    assert '生成时间：2026年01月01日 09:00:05' in second
+    # 只替换模板中的生成时间，报告正文原样保留
+    assert f'(二) 法国 {GENERATED_AT_MARK}' in second
+    assert [line for line in first if not line.startswith('生成时间')] == \
+        [line for line in second if not line.startswith('生成时间')]
+
+
+def test_render_report_fills_current_time(tmp_path):
+    lines = lines_of(render_report(REPORT, '英国'), tmp_path, 'report.docx')
+    generated = [line for line in lines if line.startswith('生成时间：')]
+    assert len(generated) == 1 and GENERATED_AT_MARK not in generated[0]
+    assert '司法辖区：英国' in lines
+    assert '(一) 英国' in lines
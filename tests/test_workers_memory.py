@@ -0,0 +1,32 @@
+"""预加载模式下多 worker 的内存预算：复用 benchmarks/bench_workers.py 启动真实 gunicorn"""
+import argparse
+import importlib.util
+import os
+
+import pytest
+
+from benchmarks.bench_workers import run_mode
+from benchmarks.mock_deepseek import MockConfig, start_mock_server
+
+# 与 bench_workers.py 的默认预算一致
+MEMORY_BUDGET_MB = 512
+
+pytestmark = [
+    pytest.mark.skipif(not os.path.exists('/proc/self/smaps_rollup'), reason='需要 Linux /proc/<pid>/smaps_rollup'),
+    pytest.mark.skipif(importlib.util.find_spec('gunicorn') is None, reason='需要 gunicorn'),
+]
+
+
+def test_preload_mode_stays_within_pss_budget(tmp_path):
+    server, url = start_mock_server(MockConfig(latency=0.05, jitter=0.01))
+    args = argparse.Namespace(workers=3, threads=4, requests=12, concurrency=6)
+    try:
+        result = run_mode('preload', args, url, str(tmp_path))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert result['failures'] == 0
+    assert result['requests'] == args.requests
+    assert result['busy_workers'] >= 2, result['processes']
+    assert result['total_pss_mb'] <= MEMORY_BUDGET_MB, result['processes']